@@ -1,7 +1,11 @@
 from network_parser import *
+from snapshot_cache import load_cached_graph
+from csr_graph import CSRGraph
 from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes, mark_inset
 import matplotlib.pyplot as plt
 import numpy as np
+import multiprocessing
+import os
 
 
 """
@@ -16,7 +20,9 @@ import numpy as np
        from the rest of the network.
     3. Plotting Degree Analysis: running the attack on each node in the network and plotting the costs (number of 
        channels the attacker opens) per node by its degree.
-    4. Plotting Implementation Analysis: we wish to give a degree analysis on a hypothetical network where all nodes run
+    4. Scanning all nodes in the network (see scan_hubs) and ranking them by the capacity the attack locks per
+       attacker channel.
+    5. Plotting Implementation Analysis: we wish to give a degree analysis on a hypothetical network where all nodes run
        the same implementation (from LND\C-Lightning\Eclair). For each implementation we create new nodes having the
        corresponding implementation default values, with different degrees. We assume the neighbors of the victim node
        run the same implementation as it does. We attack these nodes and for each implementation plot the costs (number 
@@ -27,6 +33,12 @@ import numpy as np
 LOCKTIME_MAX = 144 * 14  # = 2016
 MAX_ROUTE_LEN = 20
 LOCK_PERIOD = 432  # 3 days
+HUB_SCAN_DIR = 'hub_scans/'
+# The per-node columns of a hub scan (see scan_hubs) and their types. A column is stored in a <column>.npy file.
+HUB_SCAN_COLUMNS = {'node': 'U66', 'attacker_channels': np.int32, 'locked_channels': np.int32,
+                    'locked_capacity': np.int64, 'unattackable_channels': np.int32}
+# The number of nodes a hub scan worker evaluates at once.
+HUB_SCAN_CHUNK_SIZE = 1024
 
 
 def _calc_num_of_payments(attacker_edge, target_edge):
@@ -75,71 +87,111 @@ def _attack_edge(attacker_edge, target_edge):
     return True
 
 
-def attack_node(G, node, alias=None):
+def _lock_adjacent_channels(adjacent_channels, open_attacker_channel):
     """
-    Given a target node, the attacker connects to it and paralyzes its adjacent channels one by one sending payments
-    going back and forth on these channels.
+    Locks the given target node channels one by one, using the attacker channels opened (each time the previous one
+    exhausted its HTLC quota) by the open_attacker_channel function.
     """
-    G = G.copy()
-    neighbours = G.adj[node]._atlas
-    adjacent_channels = [neighbours[adj_node_id][channel_id] for adj_node_id in neighbours for channel_id in
-                         neighbours[adj_node_id]]
-    num_adjacent_channels = len(adjacent_channels)
-    alias = G.nodes(data=True)[node]['alias'] if alias is None else alias
-
-    if num_adjacent_channels == 0:
-        logger.info("Node [" + alias + ":" + node + "] is already isolated.")
-        return 0
-
-    total_attacked_capacity = sum([c['capacity'] for c in adjacent_channels])
-    logger.debug("["+alias+"] Attacking node " + node + ". Degree: " + str(num_adjacent_channels) + ", Capacity: " +
-                str(round(total_attacked_capacity / 1e8, 1)) + " BTC (" +
-                str(round(total_attacked_capacity * 100 / G.graph['network_capacity'], 1)) +
-                "% of the network).")
-
-    # Add attacker node
-    G.add_node("0" * 66)
-
-    #  Attacker opens a channel with the target node. It sets the channels' attributes to fit the attack according to
-    # the target node implementation.
-    node_cltv_delta = CLTV_DELTA_DEFAULTS[G.nodes()[node]['implementation']]
-    # The attacker is restricted in sending requests to the target node in accordance with the nodes' max_htlc.
-    attacker_max_htlc = MAX_CONCURRENT_HTLCS_DEFAULTS[G.nodes()[node]['implementation']]
-    attacker_edge_key = node + "-" + str(G.number_of_edges("0" * 66, node))
-    G.add_edge("0" * 66, node, attacker_edge_key, htlc=attacker_max_htlc, Attacker=True,
-               node1_pub="0" * 66, node2_pub=node, channel_id=attacker_edge_key, time_lock=node_cltv_delta)
-
-    attacker_edge = G.edges["0" * 66, node, attacker_edge_key]
+    attacker_edge = open_attacker_channel()
 
     while adjacent_channels:  # iterate the adjacent channels and lock them one by one
 
         # If the attacker exhausted the quota of HTLCs it can hold, he opens a new channel.
         if attacker_edge['htlc'] <= 1:
-            attacker_edge_key = node + "-" + str(G.number_of_edges("0" * 66, node))
-            G.add_edge("0" * 66, node, attacker_edge_key, htlc=attacker_max_htlc, Attacker=True,
-                       node1_pub="0" * 66, node2_pub=node, channel_id=attacker_edge_key, time_lock=node_cltv_delta)
-            attacker_edge = G.edges["0" * 66, node, attacker_edge_key]
+            attacker_edge = open_attacker_channel()
 
         # Attack the first available (not locked) target node channel.
         if not _attack_edge(attacker_edge, adjacent_channels[0]):
             #  If channel cannot be attacked using back and forth strategy, move to the next channel.
             adjacent_channels = adjacent_channels[1:]
         #  If target channel was fully locked (or remain with 1 HTLC quota)
-        if adjacent_channels[0]['htlc'] <= 1:
+        elif adjacent_channels[0]['htlc'] <= 1:
             adjacent_channels = adjacent_channels[1:]
         #  Leftovers of 1 HTLCs and channels that cannot be attacked back and forth but can in one direction,
         #  can be handled by passing one direction payments through them in order to fully lock them.
 
-    attacked_channels = \
-        list(filter(lambda x: x["htlc"] <= 1, [i[2] for i in G.edges(data=True) if not i[2]['Attacker']]))
-    locked_capacity = sum(list(map(lambda x: x['capacity'], attacked_channels)))
-    num_attacker_channels = G.number_of_edges("0" * 66, node)
+
+def _log_node_attack_results(alias, num_adjacent_channels, attacked_channels, num_attacker_channels, locked_capacity,
+                             network_capacity):
     logger.debug("["+alias+"] Succeeded to attack " + str(len(attacked_channels)) +
                 " out of " + str(num_adjacent_channels) + " adjacent channels.")
     logger.debug("["+alias+"] Attacker needed to open " +
                 str(num_attacker_channels) + " channels for the attack. It locked " +
-                str(round(locked_capacity / G.graph['network_capacity'] * 100, 1))
+                str(round(locked_capacity / network_capacity * 100, 1))
                 + "% of the network capacity for " + str(round(LOCK_PERIOD / 144, 1)) + " days.")
+
+
+def _get_target_node(G, node):
+    """
+    Returns the alias and implementation of the given node of G (a networkx multigraph or a csr_graph.CSRGraph), and an
+    overlay of its (not removed) adjacent channels, holding their htlc counters, in the order attack_node attacks them.
+    Each channel is returned along with the neighbour on its other side.
+    """
+    if isinstance(G, CSRGraph):
+        channels, neighbours, _ = G.adjacent(G.node_index[node])
+        adjacent_channels = [(G.nodes[neighbour], {'channel_id': G.channel_ids[channel],
+                                                   'capacity': int(G.capacity[channel]),
+                                                   'time_lock': int(G.time_lock[channel]),
+                                                   'htlc': int(G.htlc[channel])})
+                             for channel, neighbour in zip(channels, neighbours)]
+        implementation = None
+        if adjacent_channels:
+            implementation = decode_implementations([G.implementation[G.node_index[node]]])[0]
+        return G.alias[G.node_index[node]], implementation, adjacent_channels
+    require_graph_attributes(G, ['implementation', 'htlc'])
+    neighbours = G.adj[node]._atlas
+    adjacent_channels = [(adj_node_id, {'channel_id': channel_id, 'capacity': channel['capacity'],
+                                        'time_lock': channel['time_lock'], 'htlc': channel['htlc']})
+                         for adj_node_id in neighbours for channel_id, channel in neighbours[adj_node_id].items()]
+    return G.nodes[node]['alias'], G.nodes[node]['implementation'], adjacent_channels
+
+
+def attack_node(G, node, alias=None):
+    """
+    Given a target node, the attacker connects to it and paralyzes its adjacent channels one by one sending payments
+    going back and forth on these channels.
+    G is either a networkx multigraph or a csr_graph.CSRGraph. G is not modified: the attack is simulated on an overlay
+    holding the htlc counters of the target node channels and of the attacker channels only.
+    """
+    node_alias, implementation, adjacent_channels = _get_target_node(G, node)
+    return _attack_node_channels(node, node_alias if alias is None else alias,
+                                 [channel for _, channel in adjacent_channels], implementation,
+                                 G.graph['network_capacity'])
+
+
+def _attack_node_channels(node, alias, adjacent_channels, implementation, network_capacity):
+    """
+    Simulates the attack on the target node, given (the overlay of) its adjacent channels, which is modified.
+    """
+    num_adjacent_channels = len(adjacent_channels)
+
+    if num_adjacent_channels == 0:
+        logger.info("Node [" + alias + ":" + node + "] is already isolated.")
+        return 0
+
+    total_attacked_capacity = sum([c['capacity'] for c in adjacent_channels])
+    logger.debug("["+alias+"] Attacking node " + node + ". Degree: " + str(num_adjacent_channels) + ", Capacity: " +
+                str(round(total_attacked_capacity / 1e8, 1)) + " BTC (" +
+                str(round(total_attacked_capacity * 100 / network_capacity, 1)) +
+                "% of the network).")
+
+    #  Attacker opens a channel with the target node. It sets the channels' attributes to fit the attack according to
+    # the target node implementation.
+    attacker_channels = list()
+
+    def open_attacker_channel():
+        # The attacker is restricted in sending requests to the target node in accordance with the nodes' max_htlc.
+        attacker_channels.append({'htlc': MAX_CONCURRENT_HTLCS_DEFAULTS[implementation],
+                                  'time_lock': CLTV_DELTA_DEFAULTS[implementation]})
+        return attacker_channels[-1]
+
+    _lock_adjacent_channels(adjacent_channels, open_attacker_channel)
+
+    attacked_channels = [channel for channel in adjacent_channels if channel['htlc'] <= 1]
+    locked_capacity = sum(list(map(lambda x: x['capacity'], attacked_channels)))
+    num_attacker_channels = len(attacker_channels)
+    _log_node_attack_results(alias, num_adjacent_channels, attacked_channels, num_attacker_channels, locked_capacity,
+                             network_capacity)
     # We still have leftovers of 1 HTLCs in channels if the node runs LND implementation. The attacker too has this
     # leftovers on its channels, it can open few more channels in strategic locations - where in creates short
     # paths between many of the target channels and then perform circular one direction routes passing through these
@@ -149,62 +201,125 @@ def attack_node(G, node, alias=None):
     return num_attacker_channels, len(attacked_channels), locked_capacity
 
 
-def _remove_intra_edges(G, nodes):
+def _segment_sums(values, indptr):
+    # Sums values over each segment values[indptr[i]:indptr[i + 1]] (exact for integers, empty segments sum to 0).
+    cumulative = np.concatenate(([0], np.cumsum(values, dtype=np.int64)))
+    return cumulative[indptr[1:]] - cumulative[indptr[:-1]]
+
+
+def calc_attack_costs(indptr, time_locks, htlcs, capacities, implementations):
     """
-    Remove channels connecting the given nodes.
+    Evaluates attack_node on a batch of target nodes at once, in closed form. The adjacent channels of the i'th target
+    node are given by the slice indptr[i]:indptr[i + 1] of the time_locks, htlcs and capacities arrays (in the order
+    attack_node attacks them), and implementations[i] is its implementation.
+    Returns four arrays: the number of attacker channels, the number of attacked channels, the capacity locked and the
+    number of channels that cannot be attacked back and forth, per target node (all 0 for isolated nodes, where
+    attack_node returns 0).
     """
-    all_pairs = list()  # all pairs of nodes
-    for p1 in range(len(nodes)):
-        for p2 in range(p1 + 1, len(nodes)):
-            all_pairs.append([nodes[p1], nodes[p2]])
-    # num_intra_edges = len([edge_key for node1, node2 in all_pairs for edge_key in list(G.adj[node1]._atlas[node2])])
-    for node1, node2 in all_pairs:  # for each pair of nodes
-        if node2 in G.adj[node1]._atlas:
-            for edge_key in list(G.adj[node1]._atlas[node2]):  # for each edge between this pair
-                edge = G.adj[node1]._atlas[node2][edge_key]
-                G.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])  # remove edge from graph
-
-
-def _get_channels_connected_to_nodes_info(G, nodes):
+    indptr = np.asarray(indptr, dtype=np.int64)
+    time_locks = np.asarray(time_locks, dtype=np.int64)
+    htlcs = np.asarray(htlcs, dtype=np.int64)
+    capacities = np.asarray(capacities, dtype=np.int64)
+    degrees = np.diff(indptr)
+    segment = np.repeat(np.arange(len(degrees)), degrees)
+
+    # Each attacker channel is opened with the target node defaults, and sends up to htlc / 2 payments (each one holds
+    # an HTLC when leaving and when returning to the target node).
+    attacker_time_lock = np.array([CLTV_DELTA_DEFAULTS[impl] for impl in implementations], dtype=np.int64)
+    attacker_payments = np.array([MAX_CONCURRENT_HTLCS_DEFAULTS[impl] // 2 for impl in implementations],
+                                 dtype=np.int64)
+    quota = attacker_payments[segment]
+
+    # The number of times each payment crosses the target channel, as in _calc_num_of_payments.
+    crossings = np.minimum((LOCKTIME_MAX - LOCK_PERIOD - attacker_time_lock[segment]) //
+                           np.maximum(time_locks, 1) * 2, MAX_ROUTE_LEN - 2)
+    attackable = (crossings > 0) & (htlcs > 0)
+    crossings = np.maximum(crossings, 1)
+    # A target channel is locked by ceil(htlc / crossings) payments, which may be split between consecutive attacker
+    # channels. Once its quota drops to 1 it is left, hence when htlc = 1 (mod crossings) and an attacker channel is
+    # exhausted right before the last payment, this payment is not sent. The payments of each channel depend on the
+    # ones sent before it, so this is resolved one such channel per target node at a time, the channels before it being
+    # settled.
+    payments = np.where(attackable, -(-htlcs // crossings), 0)
+    may_save_payment = attackable & (htlcs > 1) & (htlcs % crossings == 1)
+    positions = np.arange(len(payments))
+    while may_save_payment.any():
+        cumulative = np.concatenate(([0], np.cumsum(payments)))
+        payments_before = cumulative[:-1] - cumulative[indptr[:-1]][segment]
+        saves_payment = may_save_payment & ((payments_before + payments - 1) % quota == 0)
+        first = np.flatnonzero(saves_payment)
+        first = first[np.unique(segment[first], return_index=True)[1]]
+        # The channels up to the first saving one of each target node (all of them if there is none) are settled.
+        settled_until = indptr[1:].copy()
+        settled_until[segment[first]] = first
+        may_save_payment[positions <= settled_until[segment]] = False
+        payments[first] -= 1
+
+    # A new attacker channel is opened whenever the previous one is exhausted and there are channels left to attack
+    # (even ones that cannot be attacked). Hence no channel is opened after the last payment only if it was sent to the
+    # last channel.
+    total_payments = _segment_sums(payments, indptr)
+    last_attacked = np.zeros(len(degrees), dtype=bool)
+    last_attacked[degrees > 0] = attackable[indptr[1:][degrees > 0] - 1]
+    ends_exhausted = last_attacked & (total_payments % attacker_payments == 0)
+    num_attacker_channels = np.where(degrees > 0, 1 + total_payments // attacker_payments - ends_exhausted, 0)
+
+    # Attacked channels are the ones left with a quota of at most 1 HTLC.
+    attacked = attackable | (htlcs <= 1)
+    return num_attacker_channels, _segment_sums(attacked, indptr), \
+        _segment_sums(np.where(attacked, capacities, 0), indptr), _segment_sums(~attackable, indptr)
+
+
+def _get_group_channels(G, nodes):
     """
-    Returns a list of all channels connected to at least one node from the given list.
+    Returns the channels connected to at least one of the given nodes, as a dict mapping their ids to their capacity,
+    and for each node, the (overlay of the) channels connecting it to nodes outside of the group (the cut channels).
+    Runs a single pass over the nodes adjacency, using a membership set of the group.
     """
-    channels = list()
-    for node in nodes:
-        neighbours = G.adj[node]._atlas
-        channels += [channel for adj_node_id in neighbours for channel in neighbours[adj_node_id].items()]
-    # Remove duplications
-    seen = set()
-    channels = [(a, b) for a, b in channels if not (a in seen or seen.add(a))]
-    num_of_channels = len(channels)
-    capacity = sum([channel[1]['capacity'] for channel in channels])
-    return num_of_channels, capacity
+    group = set(nodes)
+    alias_and_implementation = dict()
+    group_channels = dict()
+    cut_channels = dict()
+    for node in dict.fromkeys(nodes):
+        alias, implementation, adjacent_channels = _get_target_node(G, node)
+        alias_and_implementation[node] = alias, implementation
+        cut_channels[node] = list()
+        for neighbour, channel in adjacent_channels:
+            # Channels inside the group are seen from both of their nodes.
+            group_channels[channel['channel_id']] = channel['capacity']
+            if neighbour not in group:
+                cut_channels[node].append(channel)
+    return group_channels, cut_channels, alias_and_implementation
 
 
 def _isolate_group_of_nodes(G, nodes, alias=None):
     """
-    Isolate a set of nodes from the network
+    Isolate a set of nodes from the network, attacking only the channels connecting them to the rest of the network
+    (channels between the given nodes are not attacked). G is not modified.
     """
-    G = G.copy()
-    num_of_channels, capacity = _get_channels_connected_to_nodes_info(G, nodes)
-    logger.info("["+alias+"] Attacking " + str(len(nodes)) + " nodes, having " + str(num_of_channels) +
+    group_channels, cut_channels, alias_and_implementation = _get_group_channels(G, nodes)
+    capacity = sum(group_channels.values())
+    logger.info("["+alias+"] Attacking " + str(len(cut_channels)) + " nodes, having " + str(len(group_channels)) +
                 " channels with a total capacity of " + str(round(capacity / 1e8, 1)) + " BTC (" +
                 str(round(capacity * 100 / G.graph['network_capacity'], 1)) + "% of the network).")
 
-    # Remove all edges between given nodes (we want to attack only the inter edges).
-    _remove_intra_edges(G, nodes)
-    num_of_channels, capacity = _get_channels_connected_to_nodes_info(G, nodes)
+    # We attack only the inter edges (the cut channels).
+    num_of_channels = sum(len(channels) for channels in cut_channels.values())
+    capacity = sum(channel['capacity'] for channels in cut_channels.values() for channel in channels)
     logger.info("[" + alias + "] Attacking " + str(num_of_channels) +
                 " channels (without the intra edges), which hold total capacity of " + str(round(capacity / 1e8, 1)) +
                 " BTC (" + str(round(capacity * 100 / G.graph['network_capacity'], 1)) + "% of the network).")
     total_num_attacker_channels = 0
     total_num_attacked_channels = 0
     total_locked_capacity = 0
-    for node in nodes:
-        num_attacker_channels, num_attacked_channels, locked_capacity = attack_node(G, node)
-        total_num_attacker_channels += num_attacker_channels
-        total_num_attacked_channels += num_attacked_channels
-        total_locked_capacity += locked_capacity
+    for node, channels in cut_channels.items():
+        node_alias, implementation = alias_and_implementation[node]
+        result = _attack_node_channels(node, node_alias, channels, implementation, G.graph['network_capacity'])
+        if result:
+            num_attacker_channels, num_attacked_channels, locked_capacity = result
+            total_num_attacker_channels += num_attacker_channels
+            total_num_attacked_channels += num_attacked_channels
+            total_locked_capacity += locked_capacity
     logger.info("[" + alias + "] Attacker needed to open " +
                 str(total_num_attacker_channels) + " channels for the attack. It locked " + str(total_num_attacked_channels) +
                 " channels with " + str(round(total_locked_capacity / G.graph['network_capacity'] * 100, 1))
@@ -217,10 +332,9 @@ def attack_selected_hubs(snapshot_path):
      In addition, we attack LNBIG nodes as a group, separating them from the rest of the network.
      All results are printed to logs.
     """
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Read json file created by LND describegraph command on the mainnet, and parse it into a networkx MultiGraph obj
+    # (or read the parsed graph from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['capacity', 'implementation', 'htlc'])
 																												
 										  
     # nodes sorted by decreasing capacity
@@ -244,10 +358,9 @@ def plot_degree_analysis(snapshot_path):
     each node.
     """
     logger.info("Attack on Hub: Running Degree Analysis")
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Read json file created by LND describegraph command on the mainnet, and parse it into a networkx MultiGraph obj
+    # (or read the parsed graph from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['capacity', 'implementation', 'htlc'])
 
 																												
 										  
@@ -284,12 +397,17 @@ def plot_degree_analysis(snapshot_path):
     # We plot the relation between the degree and the number of channels the attacker needs to open in order to perform
     # the attack on each node. Each node will be represented by a point in the graph. The number of channels is not
     # directly determined by the degree, because different nodes set up  different values of cltv deltas.
+    # Every node is attacked, so the attack costs are evaluated at once (see calc_attack_costs) on the array
+    # representation of the graph.
+    C = CSRGraph.from_graph(G)
+    num_attacker_channels = calc_attack_costs(C.indptr, C.time_lock[C.adj_channel], C.htlc[C.adj_channel],
+                                              C.capacity[C.adj_channel],
+                                              decode_implementations(C.implementation))[0]
     attack_cost_by_degree = dict()
-    for node in nodes:
-        degree = G.degree(node[0])
+    for degree, node_result in zip(np.diff(C.indptr), num_attacker_channels):
         if not degree in attack_cost_by_degree.keys():
             attack_cost_by_degree[degree] = list()
-        attack_cost_by_degree[degree].append(attack_node(G, node[0])[0])
+        attack_cost_by_degree[degree].append(node_result)
     for degree in sorted(attack_cost_by_degree.keys()):
         for node_result in attack_cost_by_degree[degree]:
             ax2.scatter(degree, node_result, s=16, color="#4C72B0", alpha=0.5, edgecolors='none')
@@ -306,22 +424,99 @@ def plot_degree_analysis(snapshot_path):
     plt.savefig("plots/attack_on_hub_degree_analysis.svg")
 
 
-def _add_node(G, implementation, degree):
+# The adjacency (CSR form) and implementations of the nodes the hub scan workers evaluate (see scan_hubs).
+_scan_data = None
+
+
+def _init_scan_worker(scan_data):
+    # Sets the scan data of a worker process. scan_data is None if the worker was forked, having inherited it.
+    global _scan_data
+    if scan_data is not None:
+        _scan_data = scan_data
+
+
+def _scan_nodes(nodes_range):
+    # Evaluates the attack on the nodes start, ..., stop - 1.
+    start, stop = nodes_range
+    indptr, time_locks, htlcs, capacities, implementations = _scan_data
+    first, last = indptr[start], indptr[stop]
+    return nodes_range, calc_attack_costs(indptr[start:stop + 1] - first, time_locks[first:last], htlcs[first:last],
+                                          capacities[first:last], implementations[start:stop])
+
+
+def scan_hubs(G, output_dir=HUB_SCAN_DIR, top_k=20, processes=None):
     """
-    Adds to the graph a new node that initializes to the default values corresponding to the input implementation,
-    and opens channels to it according to the given degree.
+    Evaluates the attack (as attack_node) on every node of G (a networkx multigraph or a csr_graph.CSRGraph, which is
+    not modified), in chunks of HUB_SCAN_CHUNK_SIZE nodes running on a pool of processes (as many as the cpu cores by
+    default). The results are written to output_dir as they arrive, one .npy file per column of HUB_SCAN_COLUMNS (row i
+    holds the results of the i'th node of G), and can be read back by read_hub_scan.
+    Returns the top_k nodes by capacity locked per attacker channel (see rank_hubs).
     """
-    node = implementation + "-" + str(degree)
-    G.add_node(node, implementation=implementation, alias=node)
+    global _scan_data
+    C = G if isinstance(G, CSRGraph) else CSRGraph.from_graph(G)
+    # The (not removed) adjacent channels of each node, in the order attack_node attacks them.
+    alive = C.alive[C.adj_channel]
+    channels = C.adj_channel[alive]
+    indptr = np.concatenate(([0], np.cumsum(alive)))[C.indptr]
+    num_nodes = C.number_of_nodes()
+    _scan_data = (indptr, C.time_lock[channels], C.htlc[channels], C.capacity[channels],
+                  decode_implementations(C.implementation))
+    chunks = [(start, min(start + HUB_SCAN_CHUNK_SIZE, num_nodes)) for start in range(0, num_nodes,
+                                                                                         HUB_SCAN_CHUNK_SIZE)]
+    processes = min(len(chunks), processes or os.cpu_count() or 1)
+
+    os.makedirs(output_dir, exist_ok=True)
+    scan = {column: np.lib.format.open_memmap(os.path.join(output_dir, column + '.npy'), mode='w+', dtype=dtype,
+                                              shape=(num_nodes,))
+            for column, dtype in HUB_SCAN_COLUMNS.items()}
+    scan['node'][:] = C.nodes
+
+    def write_results(results):
+        for (start, stop), columns in results:
+            for column, values in zip(list(HUB_SCAN_COLUMNS)[1:], columns):
+                scan[column][start:stop] = values
+
+    try:
+        if processes <= 1:
+            write_results(map(_scan_nodes, chunks))
+        else:
+            fork = 'fork' in multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if fork else None)
+            with context.Pool(processes, initializer=_init_scan_worker,
+                              initargs=(None if fork else _scan_data,)) as pool:
+                write_results(pool.imap_unordered(_scan_nodes, chunks))
+    finally:
+        _scan_data = None
+    for column in scan.values():
+        column.flush()
+
+    logger.info("Scanned " + str(num_nodes) + " nodes, results were written to " + output_dir)
+    return rank_hubs(scan, top_k)
+
+
+def read_hub_scan(output_dir=HUB_SCAN_DIR):
+    """
+    Returns the columns of the hub scan written to output_dir by scan_hubs, as a dict of (memory-mapped) arrays.
+    """
+    return {column: np.load(os.path.join(output_dir, column + '.npy'), mmap_mode='r') for column in HUB_SCAN_COLUMNS}
 
-    neighbour = G.add_node("neighbour", implementation=implementation, alias="neighbour-" + node)
 
-    for i in range(degree):  # Since it is a multigraph, we can add #degree edges to the same neighbour.
-        channel_id = node + "-" + str(i)
-        G.add_edge(node, neighbour, channel_id, htlc=MAX_CONCURRENT_HTLCS_DEFAULTS[implementation],
-                   Attacker=False, node1_pub=node, node2_pub=neighbour, channel_id=channel_id,
-                   time_lock=2 * CLTV_DELTA_DEFAULTS[implementation], capacity=0)
-    return node
+def rank_hubs(scan, top_k=20):
+    """
+    Given the columns of a hub scan, returns the top_k nodes by capacity locked per attacker channel, as a list of
+    (node, locked capacity per attacker channel, attacker channels, locked channels, locked capacity, unattackable
+    channels) tuples, sorted in descending order. Isolated nodes (with no attacker channels) are not ranked.
+    """
+    attacker_channels = np.asarray(scan['attacker_channels'])
+    locked_capacity_per_channel = np.zeros(len(attacker_channels))
+    np.divide(scan['locked_capacity'], attacker_channels, out=locked_capacity_per_channel,
+              where=attacker_channels > 0)
+    candidates = np.flatnonzero(attacker_channels > 0)
+    # Sort by capacity locked per attacker channel, breaking ties by the nodes order.
+    top = candidates[np.lexsort((candidates, -locked_capacity_per_channel[candidates]))][:top_k]
+    return [(str(scan['node'][i]), float(locked_capacity_per_channel[i]), int(attacker_channels[i]),
+             int(scan['locked_channels'][i]), int(scan['locked_capacity'][i]), int(scan['unattackable_channels'][i]))
+            for i in top]
 
 
 def plot_implementation_analysis():
@@ -331,18 +526,20 @@ def plot_implementation_analysis():
     for LOCK_PERIOD days for different degrees.
     """
     logger.info("Attack on Hub: Running Implementation Analysis")
-    # Initiate a new networkx MultiGraph obj.
-    G = nx.MultiGraph()
-    G.graph['network_capacity'] = 1
     # A dictionary that holds for each implementation a list of the number of channels the attacker needs to open in
     # order to attack nodes of each degree.
     results_by_impl = dict()
     max_degree = 520
+    degrees = np.arange(1, max_degree)
+    indptr = np.concatenate(([0], np.cumsum(degrees)))
     for implementation in IMPLEMENTATIONS:
-        results_by_impl[implementation] = list()
-        for degree in range(1, max_degree):
-            node = _add_node(G, implementation, degree)
-            results_by_impl[implementation].append(attack_node(G, node)[0])
+        # A node of each degree, all of its channels (to neighbors running the same implementation) set to the
+        # implementation default values. These nodes are attacked at once (see calc_attack_costs).
+        num_channels = indptr[-1]
+        results_by_impl[implementation] = list(calc_attack_costs(
+            indptr, np.full(num_channels, 2 * CLTV_DELTA_DEFAULTS[implementation]),
+            np.full(num_channels, MAX_CONCURRENT_HTLCS_DEFAULTS[implementation]), np.zeros(num_channels),
+            [implementation] * len(degrees))[0])
 
     fig, ax = plt.subplots(figsize=(5, 4))
     for implementation in results_by_impl.keys():
@@ -378,6 +575,10 @@ def main():
 
     attack_selected_hubs(snapshot_path)
     plot_degree_analysis(snapshot_path)
+    G = load_cached_graph(snapshot_path, ['capacity', 'implementation', 'htlc', 'dust'])
+    for rank, hub in enumerate(scan_hubs(G)):
+        logger.info(str(rank + 1) + ". " + hub[0] + ": " + str(round(hub[1] / 1e8, 2)) +
+                    " BTC locked per attacker channel (" + str(hub[2]) + " channels)")
     plot_implementation_analysis()
 
 
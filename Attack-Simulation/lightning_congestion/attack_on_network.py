@@ -1,11 +1,17 @@
 from network_parser import *
+from edge_betweenness import EdgeBetweennessTracker
+from snapshot_cache import load_cached_graph
+from snapshot_ingestion import list_snapshots, ingest_snapshots
+from csr_graph import CSRGraph
+from connectivity import count_connected_pairs_after_removals
 from mpl_toolkits.axes_grid1.inset_locator import zoomed_inset_axes, mark_inset
 import matplotlib.pyplot as plt
-from os.path import isfile, join
-from os import listdir
 import numpy as np
 import datetime
-import operator
+import multiprocessing
+import os
+import heapq
+import time
 
 """
     This module simulates an attack on the Lightning Network and evaluates the attack results.
@@ -25,6 +31,9 @@ MAX_ROUTE_LEN = 20
 AVG_TX_FEES_USD = 2.204  # Average transaction fees observed on Sep 21, 2020
 OPEN_CHANNEL_COST_BTC = 0.000096 * AVG_TX_FEES_USD
 MIN_CHANNEL_CAPACITY_BTC = 1.1e-5  # = 1100 sat
+# Time (in seconds) the optimal route search may spend on a starting channel, after which it keeps the best route
+# found so far.
+ROUTE_SEARCH_TIME_BUDGET = 0.05
 		   
 
 
@@ -49,104 +58,163 @@ class Route:
 class AttackRoutes:
     """
     The attack results with a list of disjoint routes (in the order they've been chosen).
-    This class holds the data for each route (potentially to be attacked).
+    This class holds the data for each route (potentially to be attacked), in NumPy arrays holding an entry per route.
+    The channels of the routes are held in CSR form: the channels of route i are the slice indptr[i]:indptr[i + 1] of
+    the channel_ids, node1_pubs and node2_pubs arrays.
     """
 
-    def __init__(self):
+    # The arrays holding an entry per route.
+    ROUTE_FIELDS = ('lengths', 'lock_times', 'capacities', 'amounts_sent', 'amounts_received', 'rejected',
+                    'max_htlcs', 'betweenness')
 
-        # Holds each route edges
-        self.edges = list()
+    def __init__(self, routes=()):
+        routes = list(routes)
 
         # Holds each route length
-        self.lengths = list()
+        self.lengths = np.array([len(route) for route in routes], dtype=np.int32)
 
         # Holds each route lock time
-        self.lock_times = list()
+        self.lock_times = np.array([route.time_lock for route in routes], dtype=np.int64)
 
         # Holds each route capacity (sum of capacities along its' channels)
-        self.capacities = list()
+        self.capacities = np.array([route.capacity for route in routes], dtype=np.int64)
 
         # Holds the payment amount (in msat) sent (by the first node - the attacker) in each route
-        # (includes the fees)
-        self.amounts_sent = list()
-
-        # Holds the payment amount (in msat) received (by the last node - the attacker) in each route
-        self.amounts_received = list()
+        # (includes the fees), the payment amount (in msat) received (by the last node - the attacker) in each route,
+        # and whether an intermediate node rejects the payment (its amount is below its min_htlc or the dust limit)
+        policies = [policy for route in routes for policy in route.policies]
+        self.amounts_sent, self.amounts_received, self.rejected = calc_routes_amounts(
+            np.concatenate(([0], np.cumsum([len(route.policies) for route in routes]))),
+            [policy['min_htlc'] for policy in policies], [policy['fee_base_msat'] for policy in policies],
+            [policy['fee_rate_milli_msat'] for policy in policies],
+            [max(edge['dust'] for edge in route.edges) for route in routes])
 
         # Holds each route max_htlc - equals to the max_htlc value of all channels along it (30 or 483)
-        self.max_htlcs = list()
+        self.max_htlcs = np.array([route.edges[0]['htlc'] for route in routes], dtype=np.int32)
 
-        # Holds each route first edge betweenness (when removed)
-        self.betweenness = list()
+        # Holds each route first edge betweenness (when removed), nan if it was not computed
+        self.betweenness = np.array([np.nan if route.betweenness is None else route.betweenness for route in routes],
+                                    dtype=np.float64)
 
+        # Holds each route channels (ids and peers)
+        self.indptr = np.concatenate(([0], np.cumsum([len(route.edges) for route in routes]))).astype(np.int64)
+        self.channel_ids = np.array([edge['channel_id'] for route in routes for edge in route.edges], dtype=object)
+        self.node1_pubs = np.array([edge['node1_pub'] for route in routes for edge in route.edges], dtype=object)
+        self.node2_pubs = np.array([edge['node2_pub'] for route in routes for edge in route.edges], dtype=object)
 
     @classmethod
     def combine(cls, attack_routes1, attack_routes2):
         attack_routes = cls()
-        attack_routes.edges += attack_routes1.edges + attack_routes2.edges
-        attack_routes.lengths += attack_routes1.lengths + attack_routes2.lengths
-        attack_routes.lock_times += attack_routes1.lock_times + attack_routes2.lock_times
-        attack_routes.capacities += attack_routes1.capacities + attack_routes2.capacities
-        attack_routes.amounts_sent += attack_routes1.amounts_sent + attack_routes2.amounts_sent
-        attack_routes.amounts_received += attack_routes1.amounts_received + attack_routes2.amounts_received
-        attack_routes.max_htlcs += attack_routes1.max_htlcs + attack_routes2.max_htlcs
-        attack_routes.betweenness += attack_routes1.betweenness + attack_routes2.betweenness
+        for field in cls.ROUTE_FIELDS + ('channel_ids', 'node1_pubs', 'node2_pubs'):
+            setattr(attack_routes, field, np.concatenate((getattr(attack_routes1, field),
+                                                          getattr(attack_routes2, field))))
+        attack_routes.indptr = np.concatenate((attack_routes1.indptr,
+                                               attack_routes2.indptr[1:] + attack_routes1.indptr[-1]))
         return attack_routes
 
-    def add_route(self, route):
-        self.edges.append(route.edges)
-        self.lengths.append(len(route))
-        self.lock_times.append(route.time_lock)
-        self.capacities.append(route.capacity)
-        dust_limit = max(edge['dust'] for edge in route.edges)
-        amount_sent = _calc_min_payment_amount_for_route(route.policies, dust_limit)
-        self.amounts_sent.append(amount_sent)
-        self.amounts_received.append(_calc_received_amount_for_route(route.policies, amount_sent))
-        self.max_htlcs.append(route.edges[0]['htlc'])
-        self.betweenness.append(route.betweenness)
-
     def __len__(self):
         return len(self.lengths)
 
+    @property
+    def edges(self):
+        """
+        The channels of each route, as lists of dicts holding their channel_id, node1_pub and node2_pub.
+        """
+        return [[{'channel_id': channel_id, 'node1_pub': node1_pub, 'node2_pub': node2_pub}
+                 for channel_id, node1_pub, node2_pub in zip(self.channel_ids[start:end], self.node1_pubs[start:end],
+                                                             self.node2_pubs[start:end])]
+                for start, end in zip(self.indptr[:-1], self.indptr[1:])]
+
+    def _reorder(self, order):
+        # Reorders the routes by the given permutation of their indices.
+        for field in self.ROUTE_FIELDS:
+            setattr(self, field, getattr(self, field)[order])
+        num_channels = np.diff(self.indptr)[order]
+        indptr = np.concatenate(([0], np.cumsum(num_channels))).astype(np.int64)
+        channels = np.repeat(self.indptr[:-1][order] - indptr[:-1], num_channels) + np.arange(indptr[-1])
+        self.channel_ids, self.node1_pubs, self.node2_pubs = \
+            self.channel_ids[channels], self.node1_pubs[channels], self.node2_pubs[channels]
+        self.indptr = indptr
+
     def sort_by_capacity(self):
-        sorted_tuples = sorted(zip(self.edges, self.lengths, self.lock_times,
-                                   self.capacities, self.amounts_sent, self.amounts_received,
-                                   self.max_htlcs, self.betweenness),
-                               key=lambda pair: pair[3], reverse=True)
-        self.edges, self.lengths, self.lock_times, self.capacities, self.amounts_sent, self.amounts_received, self.max_htlcs, self.betweenness = list(
-            zip(*sorted_tuples))
+        # Stable, as sorted is: ties keep the order the routes were chosen in.
+        self._reorder(np.argsort(-self.capacities, kind='stable'))
 
     def sort_by_betweenness(self):
-        sorted_tuples = sorted(zip(self.edges, self.lengths, self.lock_times,
-                                   self.capacities, self.amounts_sent, self.amounts_received,
-                                   self.max_htlcs, self.betweenness),
-                               key=lambda pair: pair[7], reverse=True)
-        self.edges, self.lengths, self.lock_times, self.capacities, self.amounts_sent, self.amounts_received, self.max_htlcs, self.betweenness = list(
-            zip(*sorted_tuples))
+        self._reorder(np.argsort(-self.betweenness, kind='stable'))
 
     def reduced(self, num_of_routes):
         """
-        Returns num_of_routes first routes
+        Returns num_of_routes first routes. The arrays of the returned object are views of this object's arrays.
         """
-        attacker_results = copy.deepcopy(self)
-        attacker_results.edges = attacker_results.edges[:num_of_routes]
-        attacker_results.lengths = attacker_results.lengths[:num_of_routes]
-        attacker_results.lock_times = attacker_results.lock_times[:num_of_routes]
-        attacker_results.capacities = attacker_results.capacities[:num_of_routes]
-        attacker_results.amounts_sent = attacker_results.amounts_sent[:num_of_routes]
-        attacker_results.amounts_received = attacker_results.amounts_received[:num_of_routes]
-        attacker_results.max_htlcs = attacker_results.max_htlcs[:num_of_routes]
-        attacker_results.betweenness = attacker_results.betweenness[:num_of_routes]
+        attacker_results = AttackRoutes()
+        for field in self.ROUTE_FIELDS:
+            setattr(attacker_results, field, getattr(self, field)[:num_of_routes])
+        attacker_results.indptr = self.indptr[:num_of_routes + 1]
+        end = attacker_results.indptr[-1]
+        attacker_results.channel_ids = self.channel_ids[:end]
+        attacker_results.node1_pubs = self.node1_pubs[:end]
+        attacker_results.node2_pubs = self.node2_pubs[:end]
         return attacker_results
 
     def get_capacity_needed_to_attack(self):
         """
-        Returns a list of the sums of two channels capacities the attacker needs to have (in BTC) in order to attack
+        Returns an array of the sums of two channels capacities the attacker needs to have (in BTC) in order to attack
         each route.
         """
-        return [max(MIN_CHANNEL_CAPACITY_BTC, ((a * b / 1e3) / 1e8)) +
-                max(MIN_CHANNEL_CAPACITY_BTC, ((c * b / 1e3) / 1e8)) for a, b, c in
-                zip(self.amounts_sent, self.max_htlcs, self.amounts_received)]
+        # The amounts may be held in object arrays (see calc_routes_amounts).
+        amounts_sent = np.asarray(self.amounts_sent, dtype=np.float64)
+        amounts_received = np.asarray(self.amounts_received, dtype=np.float64)
+        return np.maximum(MIN_CHANNEL_CAPACITY_BTC, (amounts_sent * self.max_htlcs / 1e3) / 1e8) + \
+            np.maximum(MIN_CHANNEL_CAPACITY_BTC, (amounts_received * self.max_htlcs / 1e3) / 1e8)
+
+
+class AttackBudgetIndex:
+    """
+    Answers budget queries on attack results. The routes are ordered by decreasing capacity locked per BTC spent
+    (locked liquidity and blockchain fees), and the prefix sums of their costs and capacities along this order are
+    kept, hence each query is a binary search. Queries accept arrays as well.
+    Fee assumptions can be swept by building an index per open_channel_cost_btc value from the same routes.
+    """
+
+    def __init__(self, attack_routes, network_capacity, open_channel_cost_btc=OPEN_CHANNEL_COST_BTC):
+        # Costs in BTC: the attacker opens two channels per route.
+        locked_liquidity = attack_routes.get_capacity_needed_to_attack()
+        blockchain_fees = np.full(len(attack_routes), open_channel_cost_btc * 2)
+        order = np.argsort(-(attack_routes.capacities / (locked_liquidity + blockchain_fees)), kind='stable')
+        self.network_capacity = network_capacity
+
+        # Prefix sums (starting with 0 routes) of the blockchain fees, the locked liquidity, their total and the
+        # attacked capacity (in BTC), along the order.
+        self.blockchain_fees = np.concatenate(([0], np.cumsum(blockchain_fees[order])))
+        self.locked_liquidity = np.concatenate(([0], np.cumsum(locked_liquidity[order])))
+        self.costs = self.blockchain_fees + self.locked_liquidity
+        self.capacities = np.concatenate(([0], np.cumsum(attack_routes.capacities[order] / 1e8)))
+
+    def max_capacity(self, budget):
+        """
+        Returns the capacity (in BTC) locked by the routes of the prefix whose total cost is at most the given budget
+        (in BTC).
+        """
+        return self.capacities[np.searchsorted(self.costs, budget, side='right') - 1]
+
+    def budget_needed(self, fraction):
+        """
+        Returns the cost (in BTC) of the shortest prefix of the routes locking the given fraction of the network
+        capacity (inf if the routes do not lock that much).
+        """
+        num_of_routes = np.searchsorted(self.capacities, np.asarray(fraction) * self.network_capacity / 1e8)
+        return np.concatenate((self.costs, [np.inf]))[num_of_routes]
+
+
+def _proportional_fee(amount, fee_proportional_millionths):
+    """
+    Returns the proportional fee (in msat) a node charges for forwarding the given amount, rounded down (BOLT07). The
+    amount is split into its millions and remainder, so that the products do not overflow when the arguments are
+    NumPy arrays.
+    """
+    millions, remainder = amount // 1000000, amount % 1000000
+    return millions * fee_proportional_millionths + remainder * fee_proportional_millionths // 1000000
 
 
 def _hop_amount_calculation(amount, min_htlc, fee_base, fee_proportional_millionths):
@@ -156,7 +224,7 @@ def _hop_amount_calculation(amount, min_htlc, fee_base, fee_proportional_million
     """
     if amount < min_htlc:  # min_htlc is the minimum amount that the node will accept
         amount = min_htlc
-    return amount + fee_base + amount * fee_proportional_millionths / 1e6  # BOLT07
+    return amount + fee_base + _proportional_fee(amount, fee_proportional_millionths)  # BOLT07
 
 
 def _calc_min_payment_amount_for_route(nodes_policies, dust_limit):
@@ -164,7 +232,7 @@ def _calc_min_payment_amount_for_route(nodes_policies, dust_limit):
     Given the intermediate nodes policies along a route and the maximum dust limit of intermediate nodes,
     returns the minimal amount (in msat) that can be transferred via a single payment through this route.
     """
-    amount = dust_limit * 1e3
+    amount = dust_limit * 1000
     for node in reversed(nodes_policies):
         amount = _hop_amount_calculation(amount, node['min_htlc'], node['fee_base_msat'], node['fee_rate_milli_msat'])
 
@@ -174,11 +242,12 @@ def _calc_min_payment_amount_for_route(nodes_policies, dust_limit):
 def _hop_amount_calculation_reverse(amount, min_htlc, fee_base, fee_proportional_millionths):
     """
    Given policy details of a node (fees and min_htlc) and a payment amount sent to it for forwarding, returns the
-   amount (in msat) that should be forwarded from it (after removing its' fees).
+   amount (in msat) that should be forwarded from it (after removing its' fees): the largest amount x for which
+   x + fee_base + _proportional_fee(x, fee_proportional_millionths) does not exceed the amount sent.
    """
-    if amount + EPSILON < min_htlc or amount + EPSILON < min(DEFAULT_DUST_LIMIT_SAT.values()) * 1e3:
+    if amount < min_htlc or amount < min(DEFAULT_DUST_LIMIT_SAT.values()) * 1000:
         raise Exception('Cannot transfer less than min htlc msat or dust limit')
-    return (amount - fee_base) / (1 + (fee_proportional_millionths / 1e6))
+    return (1000000 * (amount - fee_base + 1) - 1) // (1000000 + fee_proportional_millionths)
 
 
 def _calc_received_amount_for_route(nodes_policies, amount_sent):
@@ -193,68 +262,243 @@ def _calc_received_amount_for_route(nodes_policies, amount_sent):
     return amount
 
 
-def _append_next_edge_to_route(G, route, lock_period, max_route_length, type='capacity'):
+def _calc_route_amounts(nodes_policies, dust_limit):
+    # The amounts calc_routes_amounts computes for a single route, in Python ints (which never overflow): the amounts
+    # sent and received, and whether an intermediate node rejects the payment.
+    amount_sent = _calc_min_payment_amount_for_route(nodes_policies, dust_limit)
+    amount, rejected = amount_sent, False
+    for node in nodes_policies:
+        rejected |= amount < node['min_htlc'] or amount < min(DEFAULT_DUST_LIMIT_SAT.values()) * 1000
+        amount = (1000000 * (amount - node['fee_base_msat'] + 1) - 1) // (1000000 + node['fee_rate_milli_msat'])
+    return amount_sent, amount, rejected
+
+
+def _max_forwarded_amounts(amounts, fee_proportional_millionths):
+    # The vectorized version of _hop_amount_calculation_reverse (given the amounts without the base fees, and with no
+    # checks). Starts from the floating point solution, and fixes its rounding errors.
+    forwarded = np.floor(amounts * 1e6 / (1e6 + fee_proportional_millionths)).astype(np.int64)
+    while True:
+        too_large = forwarded + _proportional_fee(forwarded, fee_proportional_millionths) > amounts
+        if not too_large.any():
+            break
+        forwarded -= too_large
+    while True:
+        too_small = forwarded + 1 + _proportional_fee(forwarded + 1, fee_proportional_millionths) <= amounts
+        if not too_small.any():
+            break
+        forwarded += too_small
+    return forwarded
+
+
+def calc_routes_amounts(indptr, min_htlcs, fee_base_msat, fee_rate_milli_msat, dust_limits):
     """
-    A recursive function which adds edges to the route until the time lock lower bound or maximum route length
-    is reached.
+    Computes the amounts _calc_min_payment_amount_for_route and _calc_received_amount_for_route return for many
+    routes at once. The policies of the intermediate nodes along route i are given by the slice indptr[i]:indptr[i + 1]
+    of the min_htlcs, fee_base_msat and fee_rate_milli_msat arrays, and dust_limits[i] is its maximum dust limit.
+    Returns the amounts (in msat) sent and received in each route, and an array flagging the routes on which
+    _hop_amount_calculation_reverse rejects an amount (for which the received amounts are meaningless).
+    The amounts are computed in int64, except for the routes whose amounts may exceed it (e.g. routes through several
+    nodes charging huge proportional fees), which are computed in Python ints. The amounts are returned in object
+    arrays (of Python ints) if there are such routes.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    min_htlcs, fee_base_msat, fee_rate_milli_msat = [np.asarray(column, dtype=np.int64)
+                                                     for column in (min_htlcs, fee_base_msat, fee_rate_milli_msat)]
+    num_hops = np.diff(indptr)
+    max_num_hops = num_hops.max() if len(num_hops) else 0
+
+    # Each step handles the hop-th intermediate node of all routes having one, from the last node backwards. A route is
+    # flagged as overflowing (and left to the scalar computation) once its amount, estimated in floating point, nears
+    # the int64 limit. The amounts received never exceed the amounts sent, hence only this step may overflow.
+    amounts_sent = np.asarray(dust_limits, dtype=np.int64) * 1000
+    overflow = np.zeros(len(num_hops), dtype=bool)
+    for hop in range(max_num_hops):
+        routes = np.flatnonzero((num_hops > hop) & ~overflow)
+        policies = indptr[routes + 1] - 1 - hop
+        amounts = np.maximum(amounts_sent[routes], min_htlcs[policies])
+        overflows = amounts * (1 + fee_rate_milli_msat[policies] / 1e6) + fee_base_msat[policies] >= \
+            np.iinfo(np.int64).max / 2
+        overflow[routes[overflows]] = True
+        routes, policies, amounts = routes[~overflows], policies[~overflows], amounts[~overflows]
+        amounts_sent[routes] = amounts + fee_base_msat[policies] + _proportional_fee(amounts,
+                                                                                     fee_rate_milli_msat[policies])
+
+    # Each step handles the hop-th intermediate node of all routes having one, from the first node onwards.
+    amounts_received = amounts_sent.copy()
+    rejected = np.zeros(len(num_hops), dtype=bool)
+    for hop in range(max_num_hops):
+        routes = np.flatnonzero((num_hops > hop) & ~overflow)
+        policies = indptr[routes] + hop
+        amounts = amounts_received[routes]
+        rejected[routes] |= (amounts < min_htlcs[policies]) | \
+            (amounts < min(DEFAULT_DUST_LIMIT_SAT.values()) * 1000)
+        amounts_received[routes] = _max_forwarded_amounts(amounts - fee_base_msat[policies],
+                                                          fee_rate_milli_msat[policies])
+
+    if overflow.any():
+        amounts_sent, amounts_received = amounts_sent.astype(object), amounts_received.astype(object)
+        for route in np.flatnonzero(overflow):
+            nodes_policies = [{'min_htlc': int(min_htlcs[policy]), 'fee_base_msat': int(fee_base_msat[policy]),
+                               'fee_rate_milli_msat': int(fee_rate_milli_msat[policy])}
+                              for policy in range(indptr[route], indptr[route + 1])]
+            amounts_sent[route], amounts_received[route], rejected[route] = \
+                _calc_route_amounts(nodes_policies, int(dust_limits[route]))
+    return amounts_sent, amounts_received, rejected
+
+
+class SortedAdjacency:
+    """
+    The channels adjacent to each node of G, in the order the greedy route search prefers them: by decreasing capacity
+    (or betweenness, according to type), then by increasing cltv delta of the node, then by their order in G. The list
+    of a node is built the first time the node is visited. Channels removed from G since then are dropped when
+    they are encountered. Hence a SortedAdjacency can be reused across the routes chosen from G as long as channels are
+    only removed from G and their attributes are not modified.
+    For a CSRGraph, the lists of all nodes are sorted at once (see CSRGraph.sorted_adjacency), and a cursor per node
+    skips the channels removed from the start of its list.
     """
 
-    neighbours = G.adj[route.last_node]._atlas
-
-    # tuples of all adjacent channels (adj_node_id, channel_id, capacity, cltv_delta, next_node default cltv_delta, betweenness)
-    adj_channels = [(adj_node_id, channel_id, neighbours[adj_node_id][channel_id]['capacity'],
-                     get_policy(neighbours[adj_node_id][channel_id], route.last_node)['time_lock_delta'],
-                     CLTV_DELTA_DEFAULTS[G.nodes()[adj_node_id]['implementation']],
-                     neighbours[adj_node_id][channel_id]['betweenness']) for
-                    adj_node_id in neighbours for channel_id in neighbours[adj_node_id]]
-
-    # remove edges that already appear in route
-    adj_channels = [channel_tup for channel_tup in adj_channels if
-                    channel_tup[1] not in list(map(lambda x: x['channel_id'], route.edges))]
-
-    # filter to channels that keep the route locked for at least lock_period blocks.
-    adj_channels = list(filter(lambda x: route.time_lock - x[3] - x[4] >= lock_period, adj_channels))
-
-    # Dead end - if there are no potential channels to continue the route.
-    if not adj_channels:
-        # End the route. Reduce the cltv delta of the last node (one before the attacker), assuming it will use the
-        # default according to the implementation it runs.
-        route.time_lock -= CLTV_DELTA_DEFAULTS[G.nodes()[route.last_node]['implementation']]
-        return route
-
-    if type == 'capacity':
-        # Extract the channels with the maximum capacity
-        optimal_adj_channels = [channel_tup for channel_tup in adj_channels
-                                     if channel_tup[2] == max(adj_channels, key=operator.itemgetter(2))[2]]
-
-        # From the max capacity adjacent channels pick a channel with minimum cltv delta
-        channel_tup = min(optimal_adj_channels, key=operator.itemgetter(3))
-    elif type == 'betweenness':
-        # Extract the channels with the maximum betweenness
-        optimal_adj_channels = [channel_tup for channel_tup in adj_channels
-                                     if channel_tup[5] == max(adj_channels, key=operator.itemgetter(5))[5]]
-
-        # From the max betweenness adjacent channels pick a channel with minimum cltv delta
-        channel_tup = min(optimal_adj_channels, key=operator.itemgetter(3))
-
-    channel = neighbours[channel_tup[0]][channel_tup[1]]
+    def __init__(self, G, type='capacity'):
+        self.G = G
+        self.type = type
+        self._adjacency = dict()
+        if isinstance(G, CSRGraph):
+            channels, neighbours, sides = G.sorted_adjacency(G.capacity if type == 'capacity' else G.betweenness)
+            # Lists, for fast access to single items.
+            self._channels, self._neighbours, self._sides = channels.tolist(), neighbours.tolist(), sides.tolist()
+            self._cltv_deltas = G.time_lock_delta[channels, sides].tolist()
+            self._cursors = G.indptr[:-1].tolist()
+            self._ends = G.indptr[1:].tolist()
+
+    def csr_channels(self, node):
+        """
+        For a CSRGraph, yields the sorted (not removed) channels of the node with the given id, as tuples (channel id,
+        adjacent node id, side of the node, cltv delta of the node).
+        """
+        alive = self.G.alive
+        i, end = self._cursors[node], self._ends[node]
+        # Removed channels at the start of the list are skipped once and for all.
+        while i < end and not alive[self._channels[i]]:
+            i += 1
+        self._cursors[node] = i
+        for i in range(i, end):
+            if alive[self._channels[i]]:
+                yield self._channels[i], self._neighbours[i], self._sides[i], self._cltv_deltas[i]
+
+    def channels(self, node):
+        """
+        Returns the sorted list of the node's channels, as tuples (channel, adjacent node, cltv delta of the node,
+        default cltv delta of the adjacent node).
+        """
+        if node not in self._adjacency:
+            neighbours = self.G.adj[node]
+            adj_channels = [(channel, adj_node_id, get_policy(channel, node)['time_lock_delta'],
+                             CLTV_DELTA_DEFAULTS[self.G.nodes[adj_node_id]['implementation']])
+                            for adj_node_id in neighbours for channel in neighbours[adj_node_id].values()]
+            # sorted is stable, hence ties remain in the order of G.
+            self._adjacency[node] = sorted(adj_channels, key=lambda x: (-x[0][self.type], x[2]))
+        return self._adjacency[node]
+
+    def remove_missing_channels(self, node):
+        # Drops from the node's list the channels that were removed from G.
+        neighbours = self.G.adj[node]
+        self._adjacency[node] = [channel_tup for channel_tup in self._adjacency[node]
+                                 if channel_tup[0]['channel_id'] in neighbours.get(channel_tup[1], ())]
+
+
+def _append_next_edge_to_route(G, route, lock_period, max_route_length, type='capacity', sorted_adjacency=None):
+    """
+    Adds edges to the route until the time lock lower bound or maximum route length is reached. Each time, the channel
+    with the maximum capacity (or betweenness) out of the channels of the last node that are not in the route and keep
+    the route locked for at least lock_period blocks is added (the one with minimum cltv delta if there are several).
+    sorted_adjacency is a SortedAdjacency of G (a new one is used if it is not given).
+    """
+    if sorted_adjacency is None:
+        sorted_adjacency = SortedAdjacency(G, type)
+    if isinstance(G, CSRGraph):
+        return _append_next_edge_to_route_csr(G, route, lock_period, max_route_length, sorted_adjacency)
+    route_channels = {edge['channel_id'] for edge in route.edges}
+
+    while True:
+        # The first channel (in the order of preference) that is not in the route and that keeps the route locked for
+        # at least lock_period blocks. Channels preceding it, which do not meet these conditions, are scanned.
+        channel_tup = None
+        missing_channels = False
+        for adj_channel_tup in sorted_adjacency.channels(route.last_node):
+            channel, adj_node_id, cltv_delta, adj_node_cltv_delta = adj_channel_tup
+            if channel['channel_id'] not in G.adj[route.last_node].get(adj_node_id, ()):
+                missing_channels = True
+            elif channel['channel_id'] not in route_channels and \
+                    route.time_lock - cltv_delta - adj_node_cltv_delta >= lock_period:
+                channel_tup = adj_channel_tup
+                break
+        if missing_channels:
+            sorted_adjacency.remove_missing_channels(route.last_node)
+
+        # Dead end - if there are no potential channels to continue the route.
+        if channel_tup is None:
+            break
+
+        channel, adj_node_id, cltv_delta, _ = channel_tup
+        route.edges.append(channel)
+        route_channels.add(channel['channel_id'])
+        route.time_lock = route.time_lock - cltv_delta
+        route.capacity = route.capacity + channel['capacity']
+        route.policies.append(get_policy(channel, route.last_node))
+        route.last_node = adj_node_id
+        if len(route) >= max_route_length:
+            break
+
+    # End the route. Reduce the cltv delta of the last node (one before the attacker), assuming it will use the
+    # default according to the implementation it runs.
+    route.time_lock -= CLTV_DELTA_DEFAULTS[G.nodes()[route.last_node]['implementation']]
+    return route
 
-    route.edges.append(channel)
-    route.time_lock = route.time_lock - channel_tup[3]
-    route.capacity = route.capacity + channel_tup[2]
-    route.policies.append(get_policy(channel, route.last_node))
-    route.last_node = channel_tup[0]
 
-    if len(route) < max_route_length:
-        return _append_next_edge_to_route(G, route, lock_period, max_route_length, type)
-    route.time_lock -= CLTV_DELTA_DEFAULTS[G.nodes()[route.last_node]['implementation']]
+def _append_next_edge_to_route_csr(C, route, lock_period, max_route_length, sorted_adjacency):
+    """
+    The same as _append_next_edge_to_route, for a CSRGraph and its SortedAdjacency. Adds edges to the route
+    (iteratively) until the time lock lower bound or maximum route length is reached.
+    """
+    route_channels = {C.channel_index[edge['channel_id']] for edge in route.edges}
+    last_node = C.node_index[route.last_node]
+    cltv_delta_default = C.cltv_delta_default
+
+    while True:
+        # The first channel (in the order of preference) that is not in the route and that keeps the route locked for
+        # at least lock_period blocks. Channels preceding it, which do not meet these conditions, are scanned.
+        channel_tup = None
+        for adj_channel_tup in sorted_adjacency.csr_channels(last_node):
+            channel, adj_node, _, cltv_delta = adj_channel_tup
+            if channel not in route_channels and \
+                    route.time_lock - cltv_delta - cltv_delta_default[adj_node] >= lock_period:
+                channel_tup = adj_channel_tup
+                break
+
+        # Dead end - if there are no potential channels to continue the route.
+        if channel_tup is None:
+            break
+
+        channel, adj_node, side, cltv_delta = channel_tup
+        route.edges.append(C.channel_data(channel))
+        route_channels.add(channel)
+        route.time_lock = route.time_lock - cltv_delta
+        route.capacity = route.capacity + int(C.capacity[channel])
+        route.policies.append(C.get_policy(channel, side))
+        last_node = adj_node
+        route.last_node = C.nodes[last_node]
+        if len(route) >= max_route_length:
+            break
+
+    # End the route. Reduce the cltv delta of the last node (one before the attacker), assuming it will use the
+    # default according to the implementation it runs.
+    route.time_lock -= int(C.cltv_delta_default[last_node])
     return route
 
 
-def _locate_route(G, starting_edge, lock_period, max_route_length, type='capacity'):
+def _locate_route(G, starting_edge, lock_period, max_route_length, type='capacity', sorted_adjacency=None):
     """
     Locates a route starting with the input edge, by greedily appending edges with high capacity that keep the route
-    locktime >= lock_period
+    locktime >= lock_period. sorted_adjacency is an optional SortedAdjacency of G, to be reused across routes.
     """
 
     route_edges = list()
@@ -278,86 +522,261 @@ def _locate_route(G, starting_edge, lock_period, max_route_length, type='capacit
     # corresponding cltv delta.
     route_time_lock = LOCKTIME_MAX - MIN_FINAL_CLTV_EXPIRY - edge_cltvd
     route_capacity = starting_edge['capacity']
-    route = Route(first_node, next_node, route_edges, route_time_lock, route_capacity, starting_edge['betweenness'])
+    route = Route(first_node, next_node, route_edges, route_time_lock, route_capacity,
+                  starting_edge.get('betweenness'))
     route.policies.append(get_policy(starting_edge, first_node))
-    return _append_next_edge_to_route(G, route, lock_period, max_route_length, type)
+    return _append_next_edge_to_route(G, route, lock_period, max_route_length, type, sorted_adjacency)
 
 
-def _choose_routes_by_betweenness(G, lock_period, max_route_length=MAX_ROUTE_LEN):
+def _locate_optimal_route(C, starting_edge, lock_period, max_route_length, time_budget=ROUTE_SEARCH_TIME_BUDGET,
+                          sorted_adjacency=None):
     """
-    Splits G into disjoint routes that can be locked for at-least lock_period blocks.
+    Locates the route of maximum capacity starting with the input edge (in the direction _locate_route picks), out of
+    the routes of at most max_route_length hops that keep the route locked for at least lock_period blocks, for a
+    CSRGraph C. Uses a best-first label-setting search: a label is a route prefix ending at some node, and it is
+    extended by each channel of that node that is not in the prefix and keeps the time lock constraint. A label is
+    pruned if another label at the same node has at least its capacity and time lock with at most its hops (the
+    channels of the prefixes are not compared, as usual in resource-constrained path searches), or if its capacity
+    bound (its capacity plus that of the channels of highest capacity left in C, one per hop it may add) does not
+    exceed the best route found. The greedy route (_locate_route) is the initial best route, hence the result is never
+    worse than it. The search stops after time_budget seconds, returning the best route found so far.
+    sorted_adjacency is an optional SortedAdjacency of C for the greedy route, to be reused across routes.
     """
+    start_time = time.perf_counter()
+    best_route = _locate_route(C, starting_edge, lock_period, max_route_length, sorted_adjacency=sorted_adjacency)
+    max_hops = max_route_length - 2
+    # Capacity bounds on the hops left: the sum of the capacities of the max_hops channels of highest capacity.
+    capacities = C.capacity[C.alive]
+    capacities = -np.sort(-np.partition(capacities, max(len(capacities) - max_hops, 0))[-max_hops:])
+    capacity_bounds = np.concatenate(([0], np.cumsum(capacities), [np.sum(capacities)] * max_hops))
+
+    # The first label, as _locate_route starts the route.
+    channel = C.channel_index[starting_edge['channel_id']]
+    side = 0 if starting_edge['node1_policy']['time_lock_delta'] <= starting_edge['node2_policy']['time_lock_delta'] \
+        else 1
+    first_node = (C.node1, C.node2)[side][channel]
+    # Labels: (node, time lock, capacity, hops, channel, side of the channel it is traversed from, parent label).
+    labels = [((C.node2, C.node1)[side][channel], LOCKTIME_MAX - MIN_FINAL_CLTV_EXPIRY -
+               int(C.time_lock_delta[channel, side]), int(C.capacity[channel]), 1, channel, side, -1)]
+    node_labels = {labels[0][0]: [0]}  # The non-dominated labels at each node.
+    pruned = set()
+    best_label, best_capacity = None, best_route.capacity
+    heap = [(-(labels[0][2] + capacity_bounds[max_hops - 1]), 0)]
+
+    while heap and time.perf_counter() - start_time < time_budget:
+        bound, i = heapq.heappop(heap)
+        if -bound <= best_capacity:
+            break  # No label left can lead to a better route.
+        if i in pruned:
+            continue
+        node, time_lock, capacity, hops, _, _, _ = labels[i]
+        if hops >= max_hops:
+            continue
+        prefix_channels, j = list(), i
+        while j >= 0:
+            prefix_channels.append(labels[j][4])
+            j = labels[j][6]
+
+        channels, adj_nodes, sides = C.adjacent(node)
+        cltv_deltas = C.time_lock_delta[channels, sides]
+        candidates = np.flatnonzero(~np.isin(channels, prefix_channels) &
+                                    (time_lock - cltv_deltas - C.cltv_delta_default[adj_nodes] >= lock_period))
+        for k in candidates:
+            label = (adj_nodes[k], time_lock - int(cltv_deltas[k]), capacity + int(C.capacity[channels[k]]), hops + 1,
+                     channels[k], sides[k], i)
+            same_node_labels = node_labels.setdefault(label[0], list())
+            if any(labels[j][1] >= label[1] and labels[j][2] >= label[2] and labels[j][3] <= label[3]
+                   for j in same_node_labels):
+                continue
+            for j in same_node_labels:
+                if label[1] >= labels[j][1] and label[2] >= labels[j][2] and label[3] <= labels[j][3]:
+                    pruned.add(j)
+            labels.append(label)
+            same_node_labels[:] = [j for j in same_node_labels if j not in pruned] + [len(labels) - 1]
+            if label[2] > best_capacity:
+                best_label, best_capacity = len(labels) - 1, label[2]
+            heapq.heappush(heap, (-(label[2] + capacity_bounds[max_hops - label[3]]), len(labels) - 1))
+
+    if best_label is None:
+        return best_route
+    # Builds the route of the best label.
+    path, j = list(), best_label
+    while j >= 0:
+        path.append(labels[j])
+        j = labels[j][6]
+    path.reverse()
+    route = Route(C.nodes[first_node], C.nodes[path[-1][0]], [C.channel_data(label[4]) for label in path],
+                  path[-1][1] - int(C.cltv_delta_default[path[-1][0]]), path[-1][2], starting_edge.get('betweenness'))
+    route.policies = [C.get_policy(label[4], label[5]) for label in path]
+    return route
+
+
+def _log_locked_capacity(num_of_routes, locked_capacity, network_capacity):
+    # Logs the fraction of the network capacity locked by the routes chosen so far, once in 100 routes.
+    if logger.level == logging.DEBUG and not num_of_routes % 100:
+        logger.debug("Attacker locked " + str(round(locked_capacity / network_capacity * 100, 1)) +
+                     "% of the network capacity, using " + str(num_of_routes * 2) + " channels.")
+
 
-    G_lnd = get_LND_subgraph(G)  # Reduce graph to LND nodes
-    G_lnd_complementary = get_LND_complementary_subgraph(G)  # complementary subgraph of G_lnd
-    attack_routes = AttackRoutes()
+def _iter_routes_by_betweenness(G, lock_period, max_route_length=MAX_ROUTE_LEN):
+    """
+    Splits G into disjoint routes that can be locked for at-least lock_period blocks. Yields the routes in the order
+    they are chosen (G is modified as they are).
+    """
 
+    # Routes are removed from the subgraphs, hence mutable copies are needed.
+    G_lnd = copy_graph(get_LND_subgraph(G))  # Reduce graph to LND nodes
+    G_lnd_complementary = copy_graph(get_LND_complementary_subgraph(G))  # complementary subgraph of G_lnd
+    # The subgraphs' channels keep the betweenness values they had when copied, hence their sorted adjacency is reused
+    # for all routes.
+    sorted_adjacency = {'lnd': SortedAdjacency(G_lnd, 'betweenness'),
+                        'lnd_complementary': SortedAdjacency(G_lnd_complementary, 'betweenness')}
+    num_of_routes, locked_capacity = 0, 0
+
+    # Sets the betweenness of G's channels and keeps it updated as routes are removed from G, recomputing only the
+    # shortest paths from sources affected by the removal.
+    betweenness_tracker = EdgeBetweennessTracker(G)
     # Channels to attack, sorted by betweenness in decreasing order. Initialized to all of the network channels.
     channels_to_attack = sorted(list(map(lambda x: x[2], G.edges(data=True))), key=lambda x: x['betweenness'],
                                 reverse=True)
-    G_tmp = G_lnd
+    G_tmp, subgraph = G_lnd, 'lnd'
     while channels_to_attack:
         channel = channels_to_attack[0]
         if G_lnd.has_edge(channel['node1_pub'], channel['node2_pub'], channel['channel_id']):
-            G_tmp = G_lnd
+            G_tmp, subgraph = G_lnd, 'lnd'
         elif G_lnd_complementary.has_edge(channel['node1_pub'], channel['node2_pub'], channel['channel_id']):
-            G_tmp = G_lnd_complementary
+            G_tmp, subgraph = G_lnd_complementary, 'lnd_complementary'
 
         # Locates a route to attack that starts with a channel having the highest betweenness value, using a greedy algorithm.
-        route = _locate_route(G_tmp, channel, lock_period, max_route_length, 'betweenness')
+        route = _locate_route(G_tmp, channel, lock_period, max_route_length, 'betweenness', sorted_adjacency[subgraph])
 
         # remove chosen route channels from the 'channels to attack' list and from the graph
-        for edge in list({edge['channel_id']: edge for edge in route.edges}.values()):
-            G.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
+        route_edges = list({edge['channel_id']: edge for edge in route.edges}.values())
+        for edge in route_edges:
             G_tmp.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
-        update_edges_betweenness(G)
+        betweenness_tracker.remove_edges(route_edges)
         channels_to_attack = sorted(list(map(lambda x: x[2], G.edges(data=True))), key=lambda x: x['betweenness'],
                                 reverse=True)
 
-        attack_routes.add_route(route)
+        num_of_routes, locked_capacity = num_of_routes + 1, locked_capacity + route.capacity
+        _log_locked_capacity(num_of_routes, locked_capacity, G.graph['network_capacity'])
+        yield route
 
-        if logger.level == logging.DEBUG:
-            if not len(attack_routes) % 100:
-                attack_cumulative_capacity = round(sum(list(map(lambda x: x / G.graph['network_capacity'],
-                                                       attack_routes.capacities))) * 100, 1)
-                logger.debug("Attacker locked " + str(attack_cumulative_capacity) + "% of the network capacity, using "
-                            + str((len(attack_routes))*2) + " channels.")
 
-    return attack_routes
-
-
-def _choose_routes(G, lock_period, max_route_length=MAX_ROUTE_LEN):
+def _iter_routes(G, lock_period, max_route_length=MAX_ROUTE_LEN, type='capacity'):
     """
-    Splits G into disjoint routes that can be locked for at-least lock_period blocks.
+    Splits G into disjoint routes that can be locked for at-least lock_period blocks. Yields the routes in the order
+    they are chosen (G is modified as they are). Each route starts with the channel of highest capacity left in G, and
+    is located greedily, or by _locate_optimal_route for the 'optimal' type (G must be a CSRGraph).
     """
 
-    attack_routes = AttackRoutes()
-
-    # Channels to attack, sorted by capacity in decreasing order. Initialized to all of the network channels.
-    channels_to_attack = sorted(list(map(lambda x: x[2], G.edges(data=True))), key=lambda x: x['capacity'],
-                                reverse=True)
+    # Channels to attack, in a max-heap by capacity (ties are broken by the order of the channels in G). Initialized
+    # to all of the network channels. Channels already used by chosen routes are skipped when they reach the top of the
+    # heap (lazy deletion), according to their channel ids.
+    channels_to_attack = [(-channel[2]['capacity'], i, channel[2]) for i, channel in enumerate(G.edges(data=True))]
+    heapq.heapify(channels_to_attack)
+    attacked_channels = set()
+    sorted_adjacency = SortedAdjacency(G)
+    num_of_routes, locked_capacity = 0, 0
 
     while channels_to_attack:
+        channel = heapq.heappop(channels_to_attack)[2]
+        if channel['channel_id'] in attacked_channels:
+            continue
         # Locates a route to attack that starts with a channel having the highest capacity, using a greedy algorithm.
-        route = _locate_route(G, channels_to_attack[0], lock_period, max_route_length)
-
-        # remove chosen route channels from the 'channels to attack' list and from the graph
-        channels_to_attack = [channel for channel in channels_to_attack if channel not in route.edges]
-        for edge in list({edge['channel_id']: edge for edge in route.edges}.values()):
+        if type == 'optimal':
+            route = _locate_optimal_route(G, channel, lock_period, max_route_length,
+                                          sorted_adjacency=sorted_adjacency)
+        else:
+            route = _locate_route(G, channel, lock_period, max_route_length, sorted_adjacency=sorted_adjacency)
+
+        # remove chosen route channels from the 'channels to attack' heap and from the graph
+        route_edges = list({edge['channel_id']: edge for edge in route.edges}.values())
+        attacked_channels.update(edge['channel_id'] for edge in route_edges)
+        for edge in route_edges:
             G.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
 
-        attack_routes.add_route(route)
+        num_of_routes, locked_capacity = num_of_routes + 1, locked_capacity + route.capacity
+        _log_locked_capacity(num_of_routes, locked_capacity, G.graph['network_capacity'])
+        yield route
 
-        if logger.level == logging.DEBUG:
-            if not len(attack_routes) % 100:
-                attack_cumulative_capacity = round(sum(list(map(lambda x: x / G.graph['network_capacity'],
-                                                       attack_routes.capacities))) * 100, 1)
-                logger.debug("Attacker locked " + str(attack_cumulative_capacity) + "% of the network capacity, using "
-                            + str((len(attack_routes))*2) + " channels.")
 
-    # sort chosen routes by capacity in descending order
-    attack_routes.sort_by_capacity()
-    return attack_routes
+def _merge_routes_by_capacity(routes_iterators, max_route_length=MAX_ROUTE_LEN):
+    """
+    Given iterators of routes (as _iter_routes yields them), yields their routes by decreasing capacity, ties broken by
+    the order of the iterators and then by the order of the routes in them (as AttackRoutes.sort_by_capacity sorts
+    their combination).
+    A route is yielded as soon as no route that is yet to be chosen can precede it, pulling routes from the iterators
+    only as needed: a route has at most max_route_length - 2 channels, and each of them has at most the capacity of
+    the channel starting the last route chosen from its iterator (which had the highest capacity left).
+    """
+    # Routes pulled from the iterators and not yielded yet, in a heap by (-capacity, iterator, order in the iterator).
+    pending_routes = list()
+    # Upper bounds on the capacity of the routes yet to be chosen from each iterator.
+    capacity_bounds = [float('inf')] * len(routes_iterators)
+    num_of_routes = [0] * len(routes_iterators)
+    active = list(range(len(routes_iterators)))
+    while pending_routes or active:
+        if pending_routes:
+            capacity, source = -pending_routes[0][0], pending_routes[0][1]
+            blocking = [i for i in active if capacity < capacity_bounds[i] or
+                        (capacity == capacity_bounds[i] and i < source)]
+        else:
+            blocking = active
+        if not blocking:
+            yield heapq.heappop(pending_routes)[3]
+            continue
+        i = blocking[0]
+        route = next(routes_iterators[i], None)
+        if route is None:
+            active.remove(i)
+            continue
+        capacity_bounds[i] = (max_route_length - 2) * route.edges[0]['capacity']
+        heapq.heappush(pending_routes, (-route.capacity, i, num_of_routes[i], route))
+        num_of_routes[i] += 1
+
+
+def iter_network_attack_routes(G, lock_period, type='capacity', max_route_length=MAX_ROUTE_LEN):
+    """
+    Splits G into disjoint routes that can be locked for at least lock_period blocks, yielding the routes in the order
+    _compute_network_attack_routes returns them (by decreasing capacity, or in the order they are chosen for the
+    betweenness type). Routes are only chosen as needed, hence a caller that stops early does not pay for the rest.
+    The 'optimal' type starts the routes as the capacity type does, but locates each of them by a search for the route
+    of maximum capacity (see _locate_optimal_route) instead of greedily.
+    G is not modified.
+    """
+    require_graph_attributes(G, ['htlc', 'dust'] + (['betweenness'] if type == 'betweenness' else []))
+    if type in ('capacity', 'optimal'):
+        logger.info("Choosing routes from LND subgraph and from LND complementary subgraph, combining both subgraphs "
+                    "results into disjoint routes in the network that can be locked for at-least " + str(lock_period) +
+                    " blocks (" + str(lock_period / 144) + " days)")
+        # Routes are chosen on the array representation of the subgraphs.
+        G_lnd = CSRGraph.from_graph(get_LND_subgraph(G))  # Reduce graph to LND nodes
+        # complementary subgraph of G_lnd
+        G_lnd_complementary = CSRGraph.from_graph(get_LND_complementary_subgraph(G))
+        yield from _merge_routes_by_capacity([_iter_routes(G_lnd, lock_period, max_route_length, type),
+                                              _iter_routes(G_lnd_complementary, lock_period, max_route_length, type)],
+                                             max_route_length)
+    elif type == 'betweenness':
+        yield from _iter_routes_by_betweenness(copy_graph(G), lock_period, max_route_length)
+
+
+def take_attack_routes(routes, network_capacity, max_attacker_channels=None, capacity_fraction=None):
+    """
+    Returns the AttackRoutes of the first routes of the given iterable, stopping once max_attacker_channels attacker
+    channels (2 per route) are used or once capacity_fraction of the network capacity is locked (whichever comes
+    first; no limit is applied for None).
+    """
+    chosen_routes = list()
+    locked_capacity = 0
+    for route in routes:
+        if max_attacker_channels is not None and (len(chosen_routes) + 1) * 2 > max_attacker_channels:
+            break
+        chosen_routes.append(route)
+        locked_capacity += route.capacity
+        if capacity_fraction is not None and locked_capacity >= capacity_fraction * network_capacity:
+            break
+    return AttackRoutes(chosen_routes)
 
 
 def _plot_attack_routes_data(attack_routes, network_capacity, lock_period, unachievable_upper_bound):
@@ -415,17 +834,12 @@ def _plot_attack_routes_data(attack_routes, network_capacity, lock_period, unach
     plt.savefig("plots/attack_on_network_success_rate.svg")
 
 
-def _plot_costs(attack_routes):
+def _plot_costs(attack_routes, network_capacity):
     # Plots evaluation of the costs
-    locked_liquidity = np.asarray(attack_routes.get_capacity_needed_to_attack())
-    blockchain_fees = np.asarray([OPEN_CHANNEL_COST_BTC * 2]*len(locked_liquidity))
-    sorted_data = np.asarray(sorted(
-        [[locked_liquidity[i], blockchain_fees[i], locked_liquidity[i] + blockchain_fees[i], attack_routes.capacities[i]]
-		   
-         for i in range(len(attack_routes))], key=lambda x: x[3] / x[2], reverse=True))
-    x = np.cumsum(list(map(lambda x: x / 1e8, sorted_data[:, 3])))  # 1 BTC = 1e8 SAT
-    y = [np.cumsum(sorted_data[:, 1]), np.cumsum(sorted_data[:, 0])]
-    logger.info("The attacker can paralyze " + str(round(x[np.argmax(y[0]+y[1] > 0.5) - 1], 1)) +
+    budget_index = AttackBudgetIndex(attack_routes, network_capacity)
+    x = budget_index.capacities[1:]
+    y = [budget_index.blockchain_fees[1:], budget_index.locked_liquidity[1:]]
+    logger.info("The attacker can paralyze " + str(round(budget_index.max_capacity(0.5), 1)) +
                 " BTC of liquidity in the Lightning Network for 3 days using less than 0.5 BTC")
     plt.figure(figsize=(5.4, 4.05), dpi=200)
     plt.stackplot(x, y, labels=['blockchain fees', 'locked liquidity'])
@@ -438,26 +852,15 @@ def _plot_costs(attack_routes):
     plt.savefig("plots/attack_on_network_costs.svg")
 
 
-def _compute_network_attack_routes(G, lock_period, type='capacity', max_route_length=MAX_ROUTE_LEN):
+def _compute_network_attack_routes(G, lock_period, type='capacity', max_route_length=MAX_ROUTE_LEN,
+                                   max_attacker_channels=None, capacity_fraction=None):
     """
-    Splits G into disjoint routes that can be locked for at least lock_period blocks.
+    Splits G into disjoint routes that can be locked for at least lock_period blocks. Stops early once
+    max_attacker_channels attacker channels are used or capacity_fraction of the network capacity is locked, if given
+    (see take_attack_routes).
     """
-    logger.info("Choosing routes from LND subgraph:")
-    if type == 'capacity':
-        G_lnd = get_LND_subgraph(G)  # Reduce graph to LND nodes
-        attack_routes_lnd = _choose_routes(G_lnd, lock_period, max_route_length)
-        logger.info("Choosing routes from LND complementary subgraph:")
-        G_lnd_complementary = get_LND_complementary_subgraph(G)  # complementary subgraph of G_lnd
-        attack_routes_lnd_complementary = _choose_routes(G_lnd_complementary, lock_period, max_route_length)
-        logger.info(
-            "Combining both subgraphs results into disjoint routes in the network that can be locked for at-least "
-            + str(lock_period) + " blocks (" + str(lock_period / 144) + " days)")
-        attack_routes = AttackRoutes.combine(attack_routes_lnd, attack_routes_lnd_complementary)
-        attack_routes.sort_by_capacity()
-    elif type == 'betweenness':
-        G_copy = copy.deepcopy(G)
-        attack_routes = _choose_routes_by_betweenness(G_copy, lock_period, max_route_length)
-    return attack_routes
+    return take_attack_routes(iter_network_attack_routes(G, lock_period, type, max_route_length),
+                              G.graph['network_capacity'], max_attacker_channels, capacity_fraction)
 
 
 def attack_on_network(snapshot_path):
@@ -468,11 +871,9 @@ def attack_on_network(snapshot_path):
     logger.info("Running attack on the Lightning Network on a snapshot from " +
                 datetime.datetime.strptime(snapshot_path.split("/")[1][3:13], '%Y.%m.%d').strftime("%d %B, %Y"))
 
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
-
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Read json file created by LND describegraph command on the mainnet, and parse it into a networkx MultiGraph obj
+    # (or read the parsed graph from the snapshot cache).
+    G = load_cached_graph(snapshot_path)
 
     logger.debug("Network capacity: " + str(round(G.graph['network_capacity'] / 1e8, 2)) + " BTC")
 
@@ -494,7 +895,7 @@ def attack_on_network(snapshot_path):
 				 
 
     # Plot attack costs for G (the given snapshot)
-    _plot_costs(attack_routes)
+    _plot_costs(attack_routes, G.graph['network_capacity'])
 
 
 def calc_unachievable_upper_bound(G):
@@ -518,6 +919,53 @@ def calc_unachievable_upper_bound(G):
     return upper_bound_results
 
 
+# The graph the sweep workers compute attack routes on (see run_sweep).
+_sweep_graph = None
+
+
+def _init_sweep_worker(G):
+    # Sets the graph of a worker process. G is None if the worker was forked, having inherited the graph.
+    global _sweep_graph
+    if G is not None:
+        _sweep_graph = G
+
+
+def _run_sweep_point(task):
+    (lock_period, max_route_length, type), max_attacker_channels = task
+    return task[0], _compute_network_attack_routes(_sweep_graph, lock_period, type, max_route_length,
+                                                   max_attacker_channels)
+
+
+def run_sweep(G, grid, processes=None, max_attacker_channels=None):
+    """
+    Computes the attack routes on G (an annotated graph, which is not modified) for each (lock_period,
+    max_route_length, type) setting of the grid, running the settings in parallel on a pool of processes (as many as
+    the cpu cores by default). Returns a dict mapping each setting to its AttackRoutes. If max_attacker_channels is
+    given, only the routes using up to this number of attacker channels are computed for each setting.
+    Where processes are forked, the workers inherit G; otherwise G is passed once to each worker. In both cases G is
+    not sent with each setting.
+    """
+    global _sweep_graph
+    grid = list(dict.fromkeys(grid))
+    # Compute the attributes needed by all settings once, rather than in each worker.
+    require_graph_attributes(G, ['htlc', 'dust'] + (['betweenness'] if any(p[2] == 'betweenness' for p in grid) else []))
+    processes = min(len(grid), processes or os.cpu_count() or 1)
+
+    _sweep_graph = G
+    try:
+        if processes <= 1:
+            results = [_run_sweep_point((grid_point, max_attacker_channels)) for grid_point in grid]
+        else:
+            fork = 'fork' in multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if fork else None)
+            with context.Pool(processes, initializer=_init_sweep_worker, initargs=(None if fork else G,)) as pool:
+                results = pool.map(_run_sweep_point, [(grid_point, max_attacker_channels) for grid_point in grid],
+                                   chunksize=1)
+    finally:
+        _sweep_graph = None
+    return dict(results)
+
+
 def attack_for_different_lock_periods(snapshot_path):
     """
     Analyzes the attack on the given snapshot, for different lock periods. Plots results.
@@ -525,20 +973,20 @@ def attack_for_different_lock_periods(snapshot_path):
     logger.info("Running the attack for different lock periods on a snapshot from " +
                 datetime.datetime.strptime(snapshot_path.split("/")[1][3:13], '%Y.%m.%d').strftime("%d %B, %Y"))
 
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
-
     lock_periods = [days * 144 for days in range(1, 7)]  # num of blocks that correspond to 1-6 days
+    # Parse the snapshot into a networkx MultiGraph obj (or read it from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['implementation', 'htlc', 'dust'])
+    # Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs.
+    remove_below_dust_capacity_channels(G)
+    # Only the first 800 routes (1600 attacker channels) are plotted, hence only they are computed.
+    attack_routes_per_lock_period = run_sweep(G, [(lock_period, MAX_ROUTE_LEN, 'capacity')
+                                                  for lock_period in lock_periods], max_attacker_channels=1600)
     fig, ax = plt.subplots(figsize=(6, 5), dpi=200)
     cumulative_attacked_capacity_per_lock_period = list()  # cumulative attacked capacity for each lock period
     for lock_period in lock_periods:
         logger.info("Proccesing attack results for lock time period of " + str(lock_period) + " blocks (" +
                      str(lock_period / 144) + " days)")
-        # Parse data into a networkx MultiGraph obj.
-        G = load_graph(json_data)
-        # Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs.
-        remove_below_dust_capacity_channels(G)
-        attack_routes = _compute_network_attack_routes(G, lock_period).reduced(800)
+        attack_routes = attack_routes_per_lock_period[(lock_period, MAX_ROUTE_LEN, 'capacity')]
         cumulative_attacked_capacity = np.cumsum(list(map(lambda x: x / G.graph['network_capacity'],
                                                           attack_routes.capacities)))
         cumulative_attacked_capacity_per_lock_period.append(cumulative_attacked_capacity)
@@ -558,19 +1006,19 @@ def attack_for_different_max_route_lengths(snapshot_path):
     logger.info("Running the attack for different upper bounds on route length on a snapshot from " +
                 datetime.datetime.strptime(snapshot_path.split("/")[1][3:13], '%Y.%m.%d').strftime("%d %B, %Y"))
 
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
     lock_period = 432  # 3 days
 
     max_route_lengths = [20, 14, 10, 8, 6]
+    # Parse the snapshot into a networkx MultiGraph obj (or read it from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['implementation', 'htlc', 'dust'])
+    # Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs.
+    remove_below_dust_capacity_channels(G)
+    attack_routes_per_max_route_len = run_sweep(G, [(lock_period, max_route_len, 'capacity')
+                                                    for max_route_len in max_route_lengths])
     plt.figure(figsize=(6, 5), dpi=200)
     for max_route_len in max_route_lengths:
         logger.info("Proccesing attack results for max route length of " + str(max_route_len) + " hops")
-        # Parse data into a networkx MultiGraph obj.
-        G = load_graph(json_data)
-        # Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs.
-        remove_below_dust_capacity_channels(G)
-        attack_routes = _compute_network_attack_routes(G, lock_period, 'capacity', max_route_len)
+        attack_routes = attack_routes_per_max_route_len[(lock_period, max_route_len, 'capacity')]
         cumulative_attacked_capacity = np.cumsum(list(map(lambda x: x / G.graph['network_capacity'],
                                                           attack_routes.capacities)))
         plt.plot(np.arange(2, 2 * (len(cumulative_attacked_capacity) + 1), 2), cumulative_attacked_capacity)
@@ -587,37 +1035,41 @@ def attack_for_different_snapshots(snapshots_dir):
     """
     Plots the attack results on different snapshots.
     """
-    snapshots_list = [f for f in listdir(snapshots_dir) if isfile(join(snapshots_dir, f)) and f.endswith('json')]
+    snapshots_list = list_snapshots(snapshots_dir)
     lock_period = 432  # 3 days
     fig, ax = plt.subplots()
-    attacked_capacity_by_snapshot = list()
+    attacked_capacity_by_snapshot = dict()
 
-    for G_str in snapshots_list:
+    # The snapshots are parsed concurrently (or read from the snapshot cache), and each is attacked once it is ready.
+    for snapshot_path in ingest_snapshots(snapshots_list, ['implementation', 'htlc', 'dust']):
+        G_str = os.path.basename(snapshot_path)
         logger.info("Processing attack results for a snapshot taken on " +
                     datetime.datetime.strptime(G_str[3:13], '%Y.%m.%d').strftime("%d %B, %Y"))
-        json_data = load_json(snapshots_dir + G_str)
-        G = load_graph(json_data)
+        G = load_cached_graph(snapshot_path, ['implementation', 'htlc', 'dust'])
         logger.debug("Network capacity: " + str(round(G.graph['network_capacity'] / 1e8, 2)) + " BTC")
         # Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs.
         remove_below_dust_capacity_channels(G)
-        attack_routes = _compute_network_attack_routes(G, lock_period)
+        # Only the first 800 routes (1600 attacker channels) are plotted, hence only they are computed.
+        attack_routes = _compute_network_attack_routes(G, lock_period, max_attacker_channels=1600)
         cumulative_attacked_capacity = [0] + np.cumsum(list(map(lambda x: x / G.graph['network_capacity'],
-                                                          attack_routes.capacities)))[:800]
+                                                          attack_routes.capacities)))
+        attacked_capacity_by_snapshot[snapshot_path] = cumulative_attacked_capacity
 
-        x = np.arange(0, 2 * len(cumulative_attacked_capacity), 2)
-        y = cumulative_attacked_capacity
-        attacked_capacity_by_snapshot.append(y)
-		
+    # Plotted in the order of the snapshots list.
+    for snapshot_path in snapshots_list:
+        y = attacked_capacity_by_snapshot[snapshot_path]
+        x = np.arange(0, 2 * len(y), 2)
         ax.plot(x, y)
 
-    plt.legend([datetime.datetime.strptime(G_str[3:13], '%Y.%m.%d').strftime("%d.%m.%Y") for G_str in snapshots_list],
+    plt.legend([datetime.datetime.strptime(os.path.basename(snapshot_path)[3:13], '%Y.%m.%d').strftime("%d.%m.%Y")
+                for snapshot_path in snapshots_list],
                loc='lower right', fontsize=12)
     plt.xlabel('Number of attacker channels', fontsize=15)
     plt.ylabel('Fraction of attacked capacity', fontsize=15)
     plt.xlim((-40, 1500))
     plt.ylim((-0.04, 1.04))
     axins = zoomed_inset_axes(ax, 12, loc=2)
-    for y in attacked_capacity_by_snapshot:
+    for y in attacked_capacity_by_snapshot.values():
         axins.plot(x, y)
     x1, x2, y1, y2 = 1300, 1325, 0.92, 0.948
     axins.set_xlim(x1, x2)
@@ -629,50 +1081,23 @@ def attack_for_different_snapshots(snapshots_dir):
     plt.savefig("plots/attack_on_network_different_snapshots.svg", bbox_inches='tight')
 
 
-def get_all_pairs_of_nodes(G):
-    nodes = list(G.nodes())
-    result = []
-    for p1 in range(len(nodes)):
-        for p2 in range(p1 + 1, len(nodes)):
-            result.append([nodes[p1], nodes[p2]])
-    return result
-
-
-def get_connected_pairs(G, pairs):
-    p = list()
-    for pair in pairs:
-        if nx.has_path(G, source=pair[0], target=pair[1]):
-            p.append(pair)
-    return p
-
-
 def _plot_connectivity(G, attack_routes):
     """
     Plots the fraction of connected pairs of nodes in the network, showing how the attack affects connectivity between
-     nodes in the network, when we remove channels with high betweenness value first.
+     nodes in the network, when we remove channels with high betweenness value first. G is not modified.
     """
     logger.info("Presenting fraction of nodes kept connected")
-    pairs = get_all_pairs_of_nodes(G)
-    total_pairs = len(pairs)
+    total_pairs = G.number_of_nodes() * (G.number_of_nodes() - 1) // 2
     logger.debug("Total pairs of nodes in the network: " + str(total_pairs))
-    connected_pairs = get_connected_pairs(G, pairs)
-    logger.debug("Total initial connected (by path) pairs of nodes in the network: " + str(len(connected_pairs)))
-    initial_connected_pairs_count = len(connected_pairs)
-    num_of_channels = list()
-    num_of_channels.append(0)
-    connected_pairs_count_list = list()
-    connected_pairs_count_list.append(initial_connected_pairs_count)
-    i = 0
-    for edges in attack_routes.edges:
-        for edge in list({edge['channel_id']: edge for edge in edges}.values()):
-            G.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
-        if i % 5 == 0:
-            connected_pairs = get_connected_pairs(G, connected_pairs)
-            connected_pairs_count_list.append(len(connected_pairs))
-            num_of_channels.append((i+1)*2)
-            logger.debug(str(connected_pairs_count_list[-1]/total_pairs) + "\t" + str(connected_pairs_count_list[-1]/initial_connected_pairs_count))				
-					
-        i += 1
+    # The number of connected pairs after the channels of each route are removed, one route after the other.
+    connected_pairs_count_list = count_connected_pairs_after_removals(G, attack_routes.edges)
+    initial_connected_pairs_count = connected_pairs_count_list[0]
+    logger.debug("Total initial connected (by path) pairs of nodes in the network: " +
+                 str(initial_connected_pairs_count))
+    num_of_channels = list(range(0, 2 * len(connected_pairs_count_list), 2))
+    for i in range(5, len(connected_pairs_count_list), 5):
+        logger.debug(str(connected_pairs_count_list[i]/total_pairs) + "\t" +
+                     str(connected_pairs_count_list[i]/initial_connected_pairs_count))
 
     plt.subplots(figsize=(5, 4), dpi=200)
     #### Plot: Fraction of network attacked capacity ###
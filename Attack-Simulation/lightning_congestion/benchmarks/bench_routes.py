@@ -0,0 +1,77 @@
+import os
+import sys
+import math
+import time
+# The modules of lightning_congestion are imported from its directory. It is appended to the path, since its
+# statistics module would otherwise shadow the standard library's one.
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from attack_on_network import *
+from attack_on_network import _iter_routes
+from snapshot_stream import load_snapshot
+
+
+"""
+    This benchmark measures how the greedy choice of attack routes (attack_on_network._iter_routes) scales with the
+    number of channels m. The LND subgraph of a snapshot is replicated into 1, 2, 4 and 8 disjoint copies, hence the
+    routes chosen on every copy are the same while m grows. For an O(m log m) choice, the time divided by m log m stays
+    about the same for all scales (a quadratic one doubles it whenever m doubles). Both the array (CSRGraph) and the
+    networkx representations of the graph are timed.
+    Run from the lightning_congestion directory: python benchmarks/bench_routes.py [snapshot_path]
+"""
+
+SNAPSHOT_PATH = 'snapshots/test/LN_2019.03.09-09.23.00.json.zip'
+LOCK_PERIOD = 432  # 3 days
+SCALES = [1, 2, 4, 8]
+
+
+def replicate_graph(G, copies):
+    """
+    Returns a multigraph holding the given number of disjoint copies of G. The nodes and channel ids of the i'th copy
+    are suffixed by '-i'.
+    """
+    G_copies = nx.MultiGraph()
+    G_copies.graph.update(G.graph)
+    for i in range(copies):
+        suffix = '-' + str(i)
+        G_copies.add_nodes_from((node + suffix, data) for node, data in G.nodes(data=True))
+        for u, v, channel_id, data in G.edges(keys=True, data=True):
+            G_copies.add_edge(u + suffix, v + suffix, key=channel_id + suffix,
+                              **dict(data, channel_id=channel_id + suffix, node1_pub=data['node1_pub'] + suffix,
+                                     node2_pub=data['node2_pub'] + suffix))
+    G_copies.graph['network_capacity'] = copies * G.graph['network_capacity']
+    G_copies.graph['network_channels_count'] = G_copies.number_of_edges()
+    return G_copies
+
+
+def time_routes_choice(G):
+    # Returns the number of routes chosen on G and the time it took, on each representation of G.
+    results = dict()
+    for representation, G_copy in [('CSRGraph', CSRGraph.from_graph(G)), ('networkx', copy_graph(G))]:
+        start = time.perf_counter()
+        num_of_routes = sum(1 for _ in _iter_routes(G_copy, LOCK_PERIOD))
+        results[representation] = (num_of_routes, time.perf_counter() - start)
+    return results
+
+
+def main():
+    coloredlogs.install(fmt='%(asctime)s [%(module)s: line %(lineno)d] %(levelname)s %(message)s',
+                        level=logging.INFO, logger=logger)
+    snapshot_path = sys.argv[1] if len(sys.argv) > 1 else SNAPSHOT_PATH
+    G = load_graph(load_snapshot(snapshot_path), ['implementation', 'htlc', 'dust'])
+    remove_below_dust_capacity_channels(G)
+    G_lnd = copy_graph(get_LND_subgraph(G))
+
+    base_time = dict()
+    for copies in SCALES:
+        G_copies = replicate_graph(G_lnd, copies)
+        m = G_copies.number_of_edges()
+        for representation, (num_of_routes, seconds) in time_routes_choice(G_copies).items():
+            per_m_log_m = seconds / (m * math.log2(m))
+            base_time.setdefault(representation, per_m_log_m)
+            logger.info(representation + ": " + str(m) + " channels, " + str(num_of_routes) + " routes chosen in " +
+                        str(round(seconds, 2)) + "s (time / m log m relative to 1 copy: " +
+                        str(round(per_m_log_m / base_time[representation], 2)) + ")")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from snapshot_cache import *
+from snapshot_ingestion import list_snapshots, ingest_snapshots
+from channel_table import COLUMNS
+import numpy as np
+import datetime
+import shutil
+import os
+
+
+"""
+    This module keeps the history of the network's channels over a series of snapshots (e.g. daily ones), in an
+    append-only store keyed by (channel_id, snapshot date). Each snapshot appended to the store becomes a segment: a
+    directory of columnar .npy files, which are memory-mapped when read. A segment holds the channel table of the
+    snapshot (see channel_table), whose rows stay in the order of the snapshot, the permutation sorting its rows by
+    channel_id (for looking up channels), and the nodes of the snapshot with their implementation, inferred from the
+    channel table (the nodes of the snapshot's annotated graph, see network_parser). Queries over a range of dates read
+    only the segments in the range, and never the snapshots.
+"""
+
+CHANNEL_HISTORY_DIR = 'channel_history/'
+# The columns of the nodes of a segment: pub keys and implementation (index into IMPLEMENTATIONS, -1 if unknown).
+NODE_COLUMNS = ('node', 'implementation')
+# Snapshot dates are in the format of the snapshot file names (e.g. LN_2020.09.21-08.00.01.json).
+DATE_FORMAT = '%Y.%m.%d'
+
+
+def get_snapshot_date(snapshot_path):
+    # Returns the date of the snapshot, by its file name.
+    return os.path.basename(snapshot_path)[3:13]
+
+
+class ChannelHistory:
+    """
+    The store in the given directory. Segments are appended in increasing order of their dates.
+    """
+
+    def __init__(self, store_dir=CHANNEL_HISTORY_DIR):
+        self.store_dir = store_dir
+        os.makedirs(store_dir, exist_ok=True)
+        self._segments = dict()
+
+    @property
+    def dates(self):
+        """
+        The dates of the segments in the store, in increasing order.
+        """
+        return sorted(d for d in os.listdir(self.store_dir) if not d.startswith('.'))
+
+    def append(self, snapshot_path):
+        """
+        Appends the segment of the given snapshot, reading its channel table from the snapshot cache (adding it to the
+        cache if needed). The snapshot must be newer than the segments already in the store.
+        """
+        date = get_snapshot_date(snapshot_path)
+        dates = self.dates
+        if dates and date <= dates[-1]:
+            raise Exception('Error: The channel history holds snapshots up to ' + dates[-1] + ', cannot append a '
+                            'snapshot of ' + date)
+        channel_table = load_cached_channel_table(snapshot_path)
+        columns = {name: getattr(channel_table, name) for name in COLUMNS}
+        columns['channel_order'] = np.argsort(channel_table.channel_id[::2], kind='stable')
+        implementations = _infer_nodes_implementation(channel_table.active())
+        columns['node'] = np.array(list(implementations), dtype=bytes)
+        columns['implementation'] = encode_implementations(implementations.values())
+
+        # Write to a temporary directory first, so that an interrupted append never leaves a partial segment.
+        tmp_segment_dir = os.path.join(self.store_dir, '.' + date + '.' + str(os.getpid()) + '.tmp')
+        shutil.rmtree(tmp_segment_dir, ignore_errors=True)
+        os.makedirs(tmp_segment_dir)
+        for name, column in columns.items():
+            np.save(os.path.join(tmp_segment_dir, name + '.npy'), column)
+        os.replace(tmp_segment_dir, os.path.join(self.store_dir, date))
+        logger.debug("Appended the snapshot of " + date + " to the channel history")
+
+    def segment(self, date):
+        """
+        Returns the columns of the segment of the given date (a dict of read-only memory-mapped arrays). Channel table
+        columns have a row per channel direction (see ChannelTable), channel_order has a row per channel and the node
+        columns have a row per node.
+        """
+        if date not in self._segments:
+            segment_dir = os.path.join(self.store_dir, date)
+            if not os.path.isdir(segment_dir):
+                raise Exception('Error: The channel history holds no snapshot of ' + date)
+            self._segments[date] = {name: np.load(os.path.join(segment_dir, name + '.npy'), mmap_mode='r')
+                                    for name in list(COLUMNS) + ['channel_order'] + list(NODE_COLUMNS)}
+        return self._segments[date]
+
+    def range(self, start=None, end=None):
+        """
+        Returns the dates of the segments from start to end (inclusive; the first and last dates of the store for
+        None).
+        """
+        return [date for date in self.dates if (start is None or date >= start) and (end is None or date <= end)]
+
+    def get(self, channel_id, date):
+        """
+        Returns the row of the given channel in the segment of the given date, as a dict of the channel table columns
+        (node_pub and each policy column hold the values of node1 and node2), or None if the channel is not in that
+        snapshot.
+        """
+        segment = self.segment(date)
+        channel_ids = segment['channel_id'][::2]
+        i = np.searchsorted(channel_ids[segment['channel_order']], np.uint64(channel_id))
+        if i == len(channel_ids) or channel_ids[segment['channel_order'][i]] != np.uint64(channel_id):
+            return None
+        channel = 2 * int(segment['channel_order'][i])
+        row = {name: int(segment[name][channel]) if name in ('channel_id', 'capacity') else
+               segment[name][channel:channel + 2].tolist() for name in COLUMNS}
+        row['node_pub'] = [node.decode() for node in row['node_pub']]
+        return row
+
+    def channel(self, channel_id, start=None, end=None):
+        """
+        Returns the history of the given channel: a dict mapping each date in the range at which the channel appears to
+        its row (see get).
+        """
+        history = {date: self.get(channel_id, date) for date in self.range(start, end)}
+        return {date: row for date, row in history.items() if row is not None}
+
+    def values(self, column, date, active=True):
+        """
+        Returns the given channel table column of the segment of the given date, in the order of the snapshot. Only the
+        rows of channels that are not disabled by any of their peers are returned, unless active is False (as in
+        ChannelTable.active).
+        """
+        segment = self.segment(date)
+        if not active:
+            return np.asarray(segment[column])
+        return np.asarray(segment[column])[np.repeat(~np.asarray(segment['disabled']).reshape(-1, 2).any(axis=1), 2)]
+
+    def value_counts(self, column, start=None, end=None, period=DATE_FORMAT, active=True):
+        """
+        Returns the distribution of the given channel table column (over channel directions) in each period (a
+        strftime format of the dates, e.g. '%Y.%m' for months) of the range, as a dict mapping each period to
+        the distinct values and their counts, summed over the period's segments. Only channels that are not disabled
+        are counted, unless active is False.
+        """
+        counts_by_period = dict()
+        for date in self.range(start, end):
+            counts_by_period.setdefault(_get_period(date, period), list()).append(self.values(column, date, active))
+        return {key: np.unique(np.concatenate(values), return_counts=True)
+                for key, values in counts_by_period.items()}
+
+    def implementation_share(self, start=None, end=None, period=DATE_FORMAT):
+        """
+        Returns the fraction of the nodes running each implementation in each period (see value_counts) of the range,
+        over the nodes of the period's segments, as a dict mapping each period to a dict of implementation fractions.
+        """
+        counts_by_period = dict()
+        for date in self.range(start, end):
+            implementations = np.asarray(self.segment(date)['implementation'])
+            counts = np.bincount(implementations[implementations >= 0], minlength=len(IMPLEMENTATIONS))
+            key = _get_period(date, period)
+            counts_by_period[key] = counts_by_period.get(key, 0) + counts
+        return {key: dict(zip(IMPLEMENTATIONS, (counts / max(counts.sum(), 1)).tolist()))
+                for key, counts in counts_by_period.items()}
+
+
+def _infer_nodes_implementation(channel_table):
+    # Returns a dict mapping each node of the (active) channel table to its inferred implementation, keeping the nodes
+    # the annotated graph of the snapshot keeps (see network_parser._handle_unknown_impl_nodes): the nodes of unknown
+    # implementation are dropped, and so are the nodes left with no channels.
+    implementations = infer_nodes_implementation(channel_table)
+    known = encode_implementations(implementations[node.decode()] for node in channel_table.node_pub.tolist()) >= 0
+    kept = set(channel_table.node_pub[np.repeat(known.reshape(-1, 2).all(axis=1), 2)].tolist())
+    return {node: implementation for node, implementation in implementations.items() if node.encode() in kept}
+
+
+def _get_period(date, period):
+    # Returns the period (formatted by the given strftime format) the date (in DATE_FORMAT) falls in.
+    return datetime.datetime.strptime(date, DATE_FORMAT).strftime(period)
+
+
+def update_channel_history(snapshots_dir, store_dir=None):
+    """
+    Appends to the channel history of the given directory (kept in its channel_history/ subdirectory by default) the
+    snapshots of the directory that are newer than its last segment (e.g. the snapshot of the day), in order of their
+    dates. Returns the store.
+    """
+    history = ChannelHistory(store_dir or os.path.join(snapshots_dir, CHANNEL_HISTORY_DIR))
+    dates = history.dates
+    snapshot_paths = sorted((snapshot_path for snapshot_path in list_snapshots(snapshots_dir)
+                             if not dates or get_snapshot_date(snapshot_path) > dates[-1]), key=get_snapshot_date)
+    # The channel tables of the new snapshots are ingested into the snapshot cache concurrently, then appended in
+    # order of their dates.
+    for _ in ingest_snapshots(snapshot_paths, None):
+        pass
+    for snapshot_path in snapshot_paths:
+        history.append(snapshot_path)
+    return history
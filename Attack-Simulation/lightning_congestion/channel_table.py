@@ -0,0 +1,86 @@
+from snapshot_stream import iter_snapshot_records
+import numpy as np
+
+
+"""
+    This module holds the channels of a snapshot (generated by using LND's describegraph command) as a columnar table
+    for the statistics on the parameters announced by nodes. The table is built in a single pass over the snapshot
+    records, keeping only the typed NumPy columns, with a row per channel direction (that is, per channel policy).
+"""
+
+# The table columns and their types. Policy columns are read from the policy fields of the same name in POLICY_FIELDS,
+# and node_pub holds the pub key of the node announcing the policy.
+COLUMNS = {'channel_id': np.uint64, 'capacity': np.int64, 'node_pub': bytes, 'cltv': np.int64, 'min_htlc': np.int64,
+           'fee_base': np.int64, 'fee_rate': np.int64, 'disabled': bool}
+POLICY_FIELDS = {'cltv': 'time_lock_delta', 'min_htlc': 'min_htlc', 'fee_base': 'fee_base_msat',
+                 'fee_rate': 'fee_rate_milli_msat', 'disabled': 'disabled'}
+
+
+class ChannelTable:
+    """
+    The channels declaring both of their policies, in the order of the snapshot. Rows 2 * i and 2 * i + 1 hold the
+    i'th channel's policies of node1 and of node2 (its channel_id and capacity appear in both).
+    """
+
+    def __init__(self, columns):
+        for name, dtype in COLUMNS.items():
+            setattr(self, name, np.asarray(columns[name], dtype=dtype))
+
+    @classmethod
+    def from_snapshot(cls, snapshot_path):
+        """
+        Reads the channels of the given snapshot (incrementally, see snapshot_stream) into a table.
+        """
+        columns = {name: list() for name in COLUMNS}
+        for key, channel in iter_snapshot_records(snapshot_path):
+            if key != 'edges' or not (channel['node1_policy'] and channel['node2_policy']):
+                continue
+            for node, policy in ((channel['node1_pub'], channel['node1_policy']),
+                                 (channel['node2_pub'], channel['node2_policy'])):
+                columns['channel_id'].append(int(channel['channel_id']))
+                columns['capacity'].append(int(channel['capacity']))
+                columns['node_pub'].append(node.encode())
+                for name, field in POLICY_FIELDS.items():
+                    columns[name].append(policy[field] if name == 'disabled' else int(policy[field]))
+        return cls(columns)
+
+    def save(self, f):
+        """
+        Writes the table columns to the given file (or file object), in NumPy's npz format.
+        """
+        np.savez(f, **{name: getattr(self, name) for name in COLUMNS})
+
+    @classmethod
+    def load(cls, f):
+        """
+        Reads a table written by save.
+        """
+        with np.load(f) as columns:
+            return cls({name: columns[name] for name in COLUMNS})
+
+    def __len__(self):
+        return len(self.capacity)
+
+    def active(self):
+        """
+        Returns the table of the channels that are not disabled by any of their peers (the channels
+        network_parser.filter_snapshot_data keeps).
+        """
+        rows = np.repeat(~self.disabled.reshape(-1, 2).any(axis=1), 2)
+        return ChannelTable({name: getattr(self, name)[rows] for name in COLUMNS})
+
+    def by_node(self):
+        """
+        Returns the nodes announcing the policies of the table (their pub keys, sorted), and the rows of their policies
+        grouped by node: the rows of the i'th node are rows[indptr[i]:indptr[i + 1]], in the order of the table.
+        """
+        nodes, inverse = np.unique(self.node_pub, return_inverse=True)
+        rows = np.argsort(inverse, kind='stable')
+        indptr = np.concatenate(([0], np.cumsum(np.bincount(inverse, minlength=len(nodes)))))
+        return [node.decode() for node in nodes.tolist()], rows, indptr
+
+    def by_channel(self, name):
+        """
+        Returns the given column with a row per channel, holding the values of node1 and node2 in its two columns.
+        """
+        return getattr(self, name).reshape(-1, 2)
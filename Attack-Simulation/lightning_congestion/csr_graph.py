@@ -0,0 +1,185 @@
+from network_parser import *
+import numpy as np
+
+
+"""
+    This module holds a compact, array-backed representation of the network multigraph, to be used by the attack
+    algorithms instead of the NetworkX multigraph. Nodes and channels are interned to integer ids, adjacency is kept in
+    CSR form (per node, a slice of its adjacent channels), and channel attributes and per-direction policies are held
+    in NumPy columns. Direction (side) 0 of a channel holds node1's policy and side 1 holds node2's policy.
+    Channels are removed by masking them out, hence the arrays themselves are never rebuilt.
+"""
+
+
+class CSRGraph:
+    """
+    Array-backed multigraph built from an annotated NetworkX multigraph (see from_graph).
+    """
+
+    def __init__(self):
+        self.graph = dict()
+
+        # Nodes: pub keys, aliases, total capacity and inferred implementation (index into IMPLEMENTATIONS, -1 if
+        # unknown, see encode_implementations).
+        self.nodes = list()
+        self.node_index = dict()
+        self.alias = list()
+        self.node_capacity = np.zeros(0, dtype=np.int64)
+        self.implementation = np.zeros(0, dtype=np.int8)
+        # The default cltv_delta of each node according to its implementation (CLTV_DELTA_DEFAULTS).
+        self.cltv_delta_default = np.zeros(0, dtype=np.int32)
+
+        # Channels: ids, peers (node ids), capacity, time_lock, htlc quota, dust limit and betweenness (nan if it was
+        # not computed).
+        self.channel_ids = list()
+        self.channel_index = dict()
+        self.node1 = np.zeros(0, dtype=np.int32)
+        self.node2 = np.zeros(0, dtype=np.int32)
+        self.capacity = np.zeros(0, dtype=np.int64)
+        self.time_lock = np.zeros(0, dtype=np.int32)
+        self.htlc = np.zeros(0, dtype=np.int32)
+        self.dust = np.zeros(0, dtype=np.int32)
+        self.betweenness = np.zeros(0)
+        self.alive = np.zeros(0, dtype=bool)
+
+        # Per-direction policies, of shape (number of channels, 2).
+        self.time_lock_delta = np.zeros((0, 2), dtype=np.int32)
+        self.min_htlc = np.zeros((0, 2), dtype=np.int64)
+        self.fee_base_msat = np.zeros((0, 2), dtype=np.int64)
+        self.fee_rate_milli_msat = np.zeros((0, 2), dtype=np.int64)
+
+        # CSR adjacency: the channels adjacent to node i are adj_channel[indptr[i]:indptr[i + 1]], along with the
+        # neighbour on their other side and the side of node i in them.
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.adj_channel = np.zeros(0, dtype=np.int32)
+        self.adj_neighbour = np.zeros(0, dtype=np.int32)
+        self.adj_side = np.zeros(0, dtype=np.int8)
+
+    @classmethod
+    def from_graph(cls, G):
+        """
+        Builds the array representation of G. The derived attributes the attack algorithms use (implementation, htlc
+        and dust) are computed for G if needed; betweenness is copied only if it was already computed.
+        """
+        require_graph_attributes(G, ['capacity', 'implementation', 'htlc', 'dust'])
+        C = cls()
+        C.graph = dict(G.graph)
+
+        C.nodes = list(G.nodes)
+        C.node_index = {node: i for i, node in enumerate(C.nodes)}
+        nodes_data = [G.nodes[node] for node in C.nodes]
+        C.alias = [data.get('alias', node) for node, data in zip(C.nodes, nodes_data)]
+        C.node_capacity = np.array([data.get('capacity', 0) for data in nodes_data], dtype=np.int64)
+        C.implementation = encode_implementations([data.get('implementation') for data in nodes_data])
+        C.cltv_delta_default = np.array([CLTV_DELTA_DEFAULTS.get(implementation, 0)
+                                         for implementation in decode_implementations(C.implementation)],
+                                        dtype=np.int32)
+
+        edges = [edge[3] for edge in G.edges(keys=True, data=True)]
+        C.channel_ids = [edge['channel_id'] for edge in edges]
+        C.channel_index = {channel_id: i for i, channel_id in enumerate(C.channel_ids)}
+        C.node1 = np.array([C.node_index[edge['node1_pub']] for edge in edges], dtype=np.int32)
+        C.node2 = np.array([C.node_index[edge['node2_pub']] for edge in edges], dtype=np.int32)
+        C.capacity = np.array([edge['capacity'] for edge in edges], dtype=np.int64)
+        C.time_lock = np.array([edge['time_lock'] for edge in edges], dtype=np.int32)
+        C.htlc = np.array([edge['htlc'] for edge in edges], dtype=np.int32)
+        C.dust = np.array([edge['dust'] for edge in edges], dtype=np.int32)
+        C.betweenness = np.array([edge.get('betweenness', np.nan) for edge in edges], dtype=np.float64)
+        C.alive = np.ones(len(edges), dtype=bool)
+        for field in ['time_lock_delta', 'min_htlc', 'fee_base_msat', 'fee_rate_milli_msat']:
+            setattr(C, field, np.array([[edge['node1_policy'][field], edge['node2_policy'][field]] for edge in edges],
+                                       dtype=getattr(C, field).dtype).reshape(len(edges), 2))
+
+        # Adjacent channels are kept in the order G.adj iterates them, so that ties are broken the same way.
+        adj_channel, adj_neighbour, adj_side, degrees = list(), list(), list(), list()
+        for node in C.nodes:
+            degree = 0
+            for neighbour, channels in G.adj[node].items():
+                for channel_id in channels:
+                    channel = C.channel_index[channel_id]
+                    adj_channel.append(channel)
+                    adj_neighbour.append(C.node_index[neighbour])
+                    adj_side.append(0 if C.node1[channel] == C.node_index[node] else 1)
+                    degree += 1
+            degrees.append(degree)
+        C.indptr = np.concatenate(([0], np.cumsum(degrees))).astype(np.int64)
+        C.adj_channel = np.array(adj_channel, dtype=np.int32)
+        C.adj_neighbour = np.array(adj_neighbour, dtype=np.int32)
+        C.adj_side = np.array(adj_side, dtype=np.int8)
+        return C
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return int(np.count_nonzero(self.alive))
+
+    def adjacent(self, node):
+        """
+        Returns the (not removed) channels adjacent to the node with the given id, their neighbours (the node id on
+        the other side of each channel) and the side of the node in each channel.
+        """
+        channels = self.adj_channel[self.indptr[node]:self.indptr[node + 1]]
+        alive = self.alive[channels]
+        return channels[alive], self.adj_neighbour[self.indptr[node]:self.indptr[node + 1]][alive], \
+            self.adj_side[self.indptr[node]:self.indptr[node + 1]][alive]
+
+    def sorted_adjacency(self, values):
+        """
+        Returns the CSR adjacency (adj_channel, adj_neighbour and adj_side, sharing indptr) with the channels adjacent
+        to each node sorted by decreasing values (an array of a value per channel, e.g. capacity), then by increasing
+        cltv delta of the node in them, then by their order in the adjacency. Removed channels are included.
+        """
+        slot_nodes = np.repeat(np.arange(len(self.nodes)), np.diff(self.indptr))
+        order = np.lexsort((np.arange(len(self.adj_channel)), self.time_lock_delta[self.adj_channel, self.adj_side],
+                            -values[self.adj_channel], slot_nodes))
+        return self.adj_channel[order], self.adj_neighbour[order], self.adj_side[order]
+
+    def degree(self, node):
+        return len(self.adjacent(self.node_index[node])[0])
+
+    def get_policy(self, channel, side):
+        """
+        Returns the policy of the given side of the channel with the given id, as a dict (as in the snapshot data).
+        """
+        return {'time_lock_delta': int(self.time_lock_delta[channel, side]),
+                'min_htlc': int(self.min_htlc[channel, side]),
+                'fee_base_msat': int(self.fee_base_msat[channel, side]),
+                'fee_rate_milli_msat': int(self.fee_rate_milli_msat[channel, side])}
+
+    def channel_data(self, channel):
+        """
+        Returns the attributes of the channel with the given id, as a dict holding the same keys the attack
+        algorithms read from the NetworkX edges data.
+        """
+        data = {'channel_id': self.channel_ids[channel],
+                'node1_pub': self.nodes[self.node1[channel]],
+                'node2_pub': self.nodes[self.node2[channel]],
+                'capacity': int(self.capacity[channel]),
+                'node1_policy': self.get_policy(channel, 0),
+                'node2_policy': self.get_policy(channel, 1),
+                'Attacker': False,
+                'time_lock': int(self.time_lock[channel]),
+                'htlc': int(self.htlc[channel]),
+                'dust': int(self.dust[channel])}
+        if not np.isnan(self.betweenness[channel]):
+            data['betweenness'] = float(self.betweenness[channel])
+        return data
+
+    def edges(self, data=False):
+        """
+        Returns the (not removed) channels as (node1_pub, node2_pub) tuples, or as (node1_pub, node2_pub, channel data)
+        tuples if data is True (as G.edges of a NetworkX multigraph).
+        """
+        return [(self.nodes[self.node1[channel]], self.nodes[self.node2[channel]]) +
+                ((self.channel_data(channel),) if data else ()) for channel in np.flatnonzero(self.alive)]
+
+    def has_edge(self, u, v, key):
+        channel = self.channel_index.get(key)
+        return channel is not None and self.alive[channel] and \
+            {self.nodes[self.node1[channel]], self.nodes[self.node2[channel]]} == {u, v}
+
+    def remove_edge(self, u, v, key):
+        if not self.has_edge(u, v, key):
+            raise Exception('Error: There is no channel ' + str(key) + ' between ' + u + ' and ' + v)
+        self.alive[self.channel_index[key]] = False
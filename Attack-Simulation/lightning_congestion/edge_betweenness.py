@@ -0,0 +1,332 @@
+import numpy as np
+import logging
+import multiprocessing
+import os
+
+
+"""
+    This module maintains the edge betweenness of the network multigraph while channels are removed from it.
+    Brandes' algorithm sums, for each source node, the dependencies accumulated over the shortest-path DAG rooted at
+    it. Removing the channels between two nodes can only change the DAGs in which this pair of nodes appears (the
+    two nodes are at distances differing by exactly 1 from the source), so after a removal we recompute only these
+    sources' DAGs instead of running a full edge_betweenness_centrality pass. Since G is undirected, these sources are
+    found by a BFS from each of the two nodes. The DAGs of the affected sources are computed (in blocks of sources)
+    before and after the removal, and the contributions derived from them to every pair of adjacent nodes are
+    subtracted and added with vectorized operations (when most sources are affected, the contributions of all sources
+    are recomputed after the removal instead). No per-source data is kept between removals, hence this takes
+    O(n * m) memory per block of sources only. The betweenness maintained starts from the values already set on the
+    channels of G.
+    Values are equal to nx.edge_betweenness_centrality (normalized, as in network_parser) up to floating point
+    rounding.
+    The same per-source computation serves edge_betweenness, which computes the betweenness of a graph once: exactly,
+    exactly with the sources split across worker processes (their partial sums are merged), or estimated from a random
+    sample of sources along with the (estimated) standard error of each value. This takes O(n * m) memory per block of
+    sources only.
+"""
+
+logger = logging.getLogger('lightning_congestion')
+
+# Accumulated values smaller than this (in absolute value) are floating point leftovers of subtracted contributions.
+ROUNDING_TOLERANCE = 1e-9
+# Number of sources whose contributions are summed in a single vectorized step (bounds the temporary memory).
+SOURCES_BLOCK_SIZE = 256
+# The ways edge_betweenness computes the betweenness: over all sources, over all sources on a pool of processes, or
+# over a random sample of sources.
+BETWEENNESS_MODES = ('exact', 'parallel', 'sampled')
+# Default number of sources sampled in the sampled mode.
+BETWEENNESS_SAMPLE_SIZE = 500
+
+
+def _group_arcs(pair_u, pair_v):
+    """
+    Returns both directions of each pair of adjacent nodes, grouped by their first node: the nodes having neighbours,
+    the start of each node's group and the neighbours. Since G is undirected, summing a value over the neighbours of
+    every node is a single reduceat over these groups.
+    """
+    arc_nodes = np.concatenate((pair_u, pair_v))
+    arc_neighbours = np.concatenate((pair_v, pair_u))
+    order = np.argsort(arc_nodes, kind='stable')
+    arc_neighbours = arc_neighbours[order]
+    nodes, starts = np.unique(arc_nodes[order], return_index=True)
+    if not len(nodes):
+        starts = np.zeros(1, dtype=np.int64)
+        arc_neighbours = np.zeros(1, dtype=np.int64)
+    return nodes, starts, arc_neighbours
+
+
+def _shortest_path_dags(n, arcs, block):
+    """
+    Runs a BFS from each of the given sources (level by level, for the whole block at once) on the graph of the given
+    grouped arcs. Returns the BFS distances (-1 for unreachable nodes), number of shortest paths (sigma) and
+    dependency coefficients ((1 + delta) / sigma) of all nodes, in the shortest-path DAG rooted at each source (a row
+    per source).
+    """
+    nodes, starts, arc_neighbours = arcs
+    # Node-major arrays (row per node, column per source), so that gathering and summing over neighbours works on
+    # contiguous rows.
+    columns = np.arange(len(block))
+    distances = np.full((n, len(block)), -1, dtype=np.int32)
+    sigma = np.zeros((n, len(block)))
+    distances[block, columns] = 0
+    sigma[block, columns] = 1
+
+    # Forward: the number of shortest paths to a node first reached at level + 1 is the sum of the numbers of
+    # shortest paths to its neighbours at level.
+    level = 0
+    while len(nodes):
+        neighbours_sigma = np.add.reduceat(
+            np.where(distances[arc_neighbours] == level, sigma[arc_neighbours], 0), starts, axis=0)
+        reached = (distances[nodes] == -1) & (neighbours_sigma > 0)
+        if not reached.any():
+            break
+        reached_nodes, reached_columns = np.nonzero(reached)
+        distances[nodes[reached_nodes], reached_columns] = level + 1
+        sigma[nodes[reached_nodes], reached_columns] = neighbours_sigma[reached]
+        level += 1
+
+    # Backward: the dependency of a node at level - 1 sums the coefficients of its DAG successors (its neighbours at
+    # level), from the farthest level towards the sources.
+    coeff = np.zeros((n, len(block)))
+    delta = np.zeros((n, len(block)))
+    for level in range(level, -1, -1):
+        at_level = distances == level
+        coeff[at_level] = (1 + delta[at_level]) / sigma[at_level]
+        if level:
+            neighbours_coeff = np.add.reduceat(
+                np.where(distances[arc_neighbours] == level, coeff[arc_neighbours], 0), starts, axis=0)
+            predecessors = distances[nodes] == level - 1
+            delta[nodes] += np.where(predecessors, sigma[nodes] * neighbours_coeff, 0)
+    return distances.T, sigma.T, coeff.T
+
+
+def _pair_contributions(distances, sigma, coeff, pair_u, pair_v):
+    """
+    Given the shortest-path DAGs of a block of sources (as _shortest_path_dags returns them), returns the
+    contribution of each source to the (not normalized) betweenness of each of the given pairs of adjacent nodes (a
+    row per source), and a mask of the pairs that are edges of each DAG.
+    """
+    dist_u = distances[:, pair_u]
+    dist_v = distances[:, pair_v]
+    # The pair (u, v) is a DAG edge either from u to v or from v to u. Its contribution is the number of shortest
+    # paths to the predecessor times the coefficient of the successor.
+    forward = (dist_u >= 0) & (dist_v == dist_u + 1)
+    backward = (dist_v >= 0) & (dist_u == dist_v + 1)
+    contribution = np.where(forward, sigma[:, pair_u] * coeff[:, pair_v], 0)
+    contribution += np.where(backward, sigma[:, pair_v] * coeff[:, pair_u], 0)
+    return contribution, forward | backward
+
+
+def _sum_contributions(n, pair_u, pair_v, sources):
+    """
+    Returns the sums of the contributions of the given sources to the betweenness of each pair of adjacent nodes, and
+    the sums of their squares.
+    """
+    arcs = _group_arcs(pair_u, pair_v)
+    sums, squares = np.zeros(len(pair_u)), np.zeros(len(pair_u))
+    for i in range(0, len(sources), SOURCES_BLOCK_SIZE):
+        contribution = _pair_contributions(*_shortest_path_dags(n, arcs, sources[i:i + SOURCES_BLOCK_SIZE]),
+                                           pair_u, pair_v)[0]
+        sums += contribution.sum(axis=0)
+        squares += np.square(contribution).sum(axis=0)
+    return sums, squares
+
+
+# The graph (number of nodes and pairs of adjacent nodes) of the betweenness worker processes.
+_betweenness_graph = None
+
+
+def _init_betweenness_worker(graph):
+    # Sets the graph of a worker process. graph is None if the worker was forked, having inherited it.
+    global _betweenness_graph
+    if graph is not None:
+        _betweenness_graph = graph
+
+
+def _sum_sources_contributions(sources):
+    return _sum_contributions(*_betweenness_graph, sources)
+
+
+def edge_betweenness(G, mode='exact', num_of_sources=BETWEENNESS_SAMPLE_SIZE, processes=None, seed=None):
+    """
+    Returns the normalized betweenness of each pair of adjacent nodes of G (as nx.edge_betweenness_centrality does),
+    along with the standard error of each value, computed according to mode (one of BETWEENNESS_MODES):
+    - 'exact': sums the contributions of all sources (the errors are 0).
+    - 'parallel': as exact, splitting the sources across a pool of processes (as many as the cpu cores by default)
+      and merging their partial sums.
+    - 'sampled': sums the contributions of num_of_sources sources, chosen uniformly at random (by the given seed), and
+      scales them to all sources. The standard error of each value is estimated from the variance of the
+      contributions of the sampled sources to it (corrected for sampling without replacement). It is an estimate of
+      the standard deviation of the value, not a bound on its error.
+    """
+    if mode not in BETWEENNESS_MODES:
+        raise Exception('Error: Unknown betweenness mode ' + str(mode) + ', expected one of ' + str(BETWEENNESS_MODES))
+    global _betweenness_graph
+    nodes = list(G)
+    node_index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+    pairs = list(dict.fromkeys(G.edges()))
+    pair_u = np.array([node_index[u] for u, v in pairs], dtype=np.int64)
+    pair_v = np.array([node_index[v] for u, v in pairs], dtype=np.int64)
+
+    sources = np.arange(n)
+    if mode == 'sampled' and num_of_sources < n:
+        sources = np.sort(np.random.default_rng(seed).choice(n, num_of_sources, replace=False))
+    blocks = [sources[i:i + SOURCES_BLOCK_SIZE] for i in range(0, len(sources), SOURCES_BLOCK_SIZE)]
+    processes = min(len(blocks), processes or os.cpu_count() or 1) if mode == 'parallel' else 1
+    if processes <= 1:
+        sums, squares = _sum_contributions(n, pair_u, pair_v, sources)
+    else:
+        _betweenness_graph = (n, pair_u, pair_v)
+        try:
+            fork = 'fork' in multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('fork' if fork else None)
+            with context.Pool(processes, initializer=_init_betweenness_worker,
+                              initargs=(None if fork else _betweenness_graph,)) as pool:
+                # Partial sums are merged in the order of the blocks, hence the result does not depend on the workers.
+                partial_sums = pool.map(_sum_sources_contributions, blocks, chunksize=1)
+        finally:
+            _betweenness_graph = None
+        sums, squares = np.sum([s for s, _ in partial_sums], axis=0), np.sum([q for _, q in partial_sums], axis=0)
+
+    # Same normalization as nx.edge_betweenness_centrality(G) for an undirected graph (and with k sampled sources).
+    k = len(sources)
+    scale = 1 / (n * (n - 1)) if n > 1 else 1
+    errors = np.zeros(len(pairs))
+    if 1 < k < n:
+        # The sum over all sources is estimated by n times the mean contribution of the sampled sources. Its standard
+        # error follows from the sample variance of the contributions.
+        variance = np.maximum(squares - np.square(sums) / k, 0) / (k - 1)
+        errors = n * np.sqrt(variance / k * (1 - k / n)) * scale
+    return dict(zip(pairs, sums * n / max(k, 1) * scale)), dict(zip(pairs, errors))
+
+
+class EdgeBetweennessTracker:
+    """
+    Holds the edge betweenness of G, and keeps it (and the 'betweenness' attribute of G's edges) updated as channels
+    are removed from G through remove_edges. The 'betweenness' attribute of G's channels (see
+    network_parser.require_graph_attributes) is taken as the initial betweenness, and is computed (exactly) only if
+    some channel lacks it. For a sampled betweenness, the values remain estimates with the same errors, as the changes
+    of the affected sources' contributions are applied exactly.
+    """
+
+    def __init__(self, G):
+        self.G = G
+        self._nodes = list(G)
+        self._node_index = {node: i for i, node in enumerate(self._nodes)}
+
+        # Pairs of adjacent nodes (in G.edges orientation), their node indices and their (not normalized) betweenness.
+        self._pairs = list(dict.fromkeys(G.edges()))
+        self._pair_index = {pair: i for i, pair in enumerate(self._pairs)}
+        self._pair_u = np.array([self._node_index[u] for u, v in self._pairs], dtype=np.int64)
+        self._pair_v = np.array([self._node_index[v] for u, v in self._pairs], dtype=np.int64)
+        self._pair_alive = np.ones(len(self._pairs), dtype=bool)
+
+        if all('betweenness' in data for _, _, data in G.edges(data=True)):
+            # All the channels between a pair of nodes have the betweenness of the pair.
+            self._pair_betweenness = np.array([next(iter(G.adj[u][v].values()))['betweenness']
+                                               for u, v in self._pairs], dtype=float) / self._scale()
+        else:
+            betweenness = edge_betweenness(G)[0]
+            self._pair_betweenness = np.array([betweenness[pair] for pair in self._pairs], dtype=float) / self._scale()
+            self._set_edges_betweenness(np.flatnonzero(self._pair_alive))
+
+    def _accumulate(self, sources, sign):
+        """
+        Computes the shortest-path DAGs of the given sources on the current G (level by level, for a block of sources
+        at once) and adds (or subtracts, when sign is -1) their contributions to the betweenness of all remaining pairs
+        of adjacent nodes. Returns a mask of the pairs that were changed.
+        """
+        n = len(self._nodes)
+        pairs = np.flatnonzero(self._pair_alive)
+        pair_u = self._pair_u[pairs]
+        pair_v = self._pair_v[pairs]
+        arcs = _group_arcs(pair_u, pair_v)
+        changed = np.zeros(len(self._pairs), dtype=bool)
+        for i in range(0, len(sources), SOURCES_BLOCK_SIZE):
+            contribution, on_dag = _pair_contributions(
+                *_shortest_path_dags(n, arcs, sources[i:i + SOURCES_BLOCK_SIZE]), pair_u, pair_v)
+            self._pair_betweenness[pairs] += sign * contribution.sum(axis=0)
+            changed[pairs] |= on_dag.any(axis=0)
+        return changed
+
+    def _affected_sources(self, pairs):
+        """
+        Returns the indices of the sources whose shortest-path DAG (on the current G) contains at least one of the
+        given pairs. Since G is undirected, the distances of a source from u and v are those of u and v from it, and
+        (u, v) is a DAG edge exactly when they differ.
+        """
+        affected = np.zeros(len(self._nodes), dtype=bool)
+        if not len(pairs):
+            return np.flatnonzero(affected)
+        ends = np.unique(np.concatenate((self._pair_u[pairs], self._pair_v[pairs])))
+        end_index = {node: i for i, node in enumerate(ends.tolist())}
+        alive_pairs = np.flatnonzero(self._pair_alive)
+        arcs = _group_arcs(self._pair_u[alive_pairs], self._pair_v[alive_pairs])
+        distances = np.concatenate([_shortest_path_dags(len(self._nodes), arcs, ends[i:i + SOURCES_BLOCK_SIZE])[0]
+                                    for i in range(0, len(ends), SOURCES_BLOCK_SIZE)])
+        for p in pairs:
+            dist_u = distances[end_index[self._pair_u[p]]]
+            dist_v = distances[end_index[self._pair_v[p]]]
+            affected |= (dist_u >= 0) & (dist_v >= 0) & (dist_u != dist_v)
+        return np.flatnonzero(affected)
+
+    def _scale(self):
+        # Same normalization as nx.edge_betweenness_centrality(G) for an undirected graph.
+        n = len(self._nodes)
+        return 1 / (n * (n - 1)) if n > 1 else 1
+
+    def _set_edges_betweenness(self, pairs):
+        # Sets the 'betweenness' attribute of all channels between each of the given pairs of nodes.
+        scale = self._scale()
+        for p in pairs:
+            u, v = self._pairs[p]
+            for channel in self.G.adj[u][v].values():
+                channel['betweenness'] = self._pair_betweenness[p] * scale
+
+    def _get_pair_index(self, u, v):
+        return self._pair_index[(u, v)] if (u, v) in self._pair_index else self._pair_index[(v, u)]
+
+    def betweenness(self):
+        """
+        Returns the normalized betweenness of each pair of adjacent nodes (as returned by
+        nx.edge_betweenness_centrality).
+        """
+        scale = self._scale()
+        return {self._pairs[p]: self._pair_betweenness[p] * scale for p in np.flatnonzero(self._pair_alive)}
+
+    def remove_edges(self, edges):
+        """
+        Removes the input edges (channels) from G, updates the betweenness of the affected pairs and sets the
+        'betweenness' attribute of their remaining channels.
+        """
+        channels_by_pair = dict()
+        for edge in edges:
+            if self.G.has_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id']):
+                channels_by_pair.setdefault(self._get_pair_index(edge['node1_pub'], edge['node2_pub']), set())\
+                    .add(edge['channel_id'])
+
+        # In a multigraph, shortest paths only change once the last channel between two nodes is removed.
+        removed_pairs = [p for p, channel_ids in channels_by_pair.items()
+                         if set(self.G.adj[self._pairs[p][0]][self._pairs[p][1]]) <= channel_ids]
+        affected_sources = self._affected_sources(removed_pairs)
+        logger.debug("Removing " + str(len(removed_pairs)) + " pairs of nodes affects the shortest paths of " +
+                     str(len(affected_sources)) + " out of " + str(len(self._nodes)) + " sources.")
+
+        # Updating the affected sources runs their BFS twice (before and after the removal), hence once they are more
+        # than half of the sources it is cheaper to recompute the contributions of all sources after the removal.
+        recompute = 2 * len(affected_sources) > len(self._nodes)
+        changed = self._pair_alive.copy() if recompute else self._accumulate(affected_sources, -1)
+        for p, channel_ids in channels_by_pair.items():
+            for channel_id in channel_ids:
+                self.G.remove_edge(self._pairs[p][0], self._pairs[p][1], key=channel_id)
+        self._pair_alive[removed_pairs] = False
+        self._pair_betweenness[removed_pairs] = 0
+        if recompute:
+            self._pair_betweenness[:] = 0
+            self._accumulate(np.arange(len(self._nodes)), 1)
+        else:
+            changed |= self._accumulate(affected_sources, 1)
+
+        changed &= self._pair_alive
+        self._pair_betweenness[changed & (np.abs(self._pair_betweenness) < ROUNDING_TOLERANCE)] = 0
+        self._set_edges_betweenness(np.flatnonzero(changed))
@@ -14,8 +14,8 @@ def generate_csv_files(file_path):
     file_name = file_path.split("/")[-1]
     # Read json file created by LND describegraph command on the mainnet.
     json_data = load_json(file_path)
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Parse data into a networkx MultiGraph obj (edges betweenness is not exported).
+    G = load_graph(json_data, ['capacity', 'implementation', 'htlc'])
 
     with open('LN_nodes_'+file_name[3:13]+'_.csv', 'a+', newline='', encoding='utf8', errors='ignore') as file_object:
         csv_file = csv.writer(file_object)
@@ -35,10 +35,10 @@ def generate_csv_files(file_path):
         for edge in edges:
             edge_data = list(edge[2].values())
             direction1_values = [edge[2]['channel_id']+"_1", edge[2]['channel_id']+"_1"] +\
-                                edge_data[3:5] + [edge_data[5]/1e8 , edge_data[5], edge_data[10]] + \
+                                edge_data[3:5] + [edge_data[5]/1e8 , edge_data[5], edge[2]['htlc']] + \
                                 list(edge[2]['node1_policy'].values())
             direction2_values = [edge[2]['channel_id']+"_2", edge[2]['channel_id']+"_2"] + [edge_data[4], \
-                                edge_data[3], edge_data[5]/1e8, edge_data[5], edge_data[10]] + list(edge[2]['node2_policy'].values())
+                                edge_data[3], edge_data[5]/1e8, edge_data[5], edge[2]['htlc']] + list(edge[2]['node2_policy'].values())
             csv_file.writerow(direction1_values)
             csv_file.writerow(direction2_values)
 
@@ -1,4 +1,5 @@
 import numpy as np
+import networkx as nx
 from collections import Counter
 
 """
@@ -43,6 +44,11 @@ def calc_implementation_distribution(sample):
     impl_vec = np.array([get_keys_by_value(CLTV_DELTA_DEFAULTS, sample[0]),
                          get_keys_by_value(HTLC_MIN_DEFAULTS, sample[1]),
                          get_keys_by_value(FEE_DEFAULTS, sample[2])])
+    return _calc_distribution(impl_vec)
+
+
+def _calc_distribution(impl_vec):
+    # Returns the distribution on the implementations given the indicator vectors of the three parameters.
     impl_dist = np.dot(PARAM_WEIGHTS_DIST, impl_vec)
     if not np.all(impl_dist == np.array([0, 0, 0])):
         impl_dist = impl_dist / sum(impl_dist)
@@ -63,15 +69,26 @@ def calc_node_attr(node, edge):
     return policy['time_lock_delta'], policy['min_htlc'], policy['fee_rate_milli_msat']
 
 
+def get_node_channels_parameters(G, node):
+    """
+    Returns a list of tuples (cltv_delta, min_htlc, fee_proportional) values of the node for each of its channels.
+    G is either a networkx multigraph or a csr_graph.CSRGraph.
+    """
+    if isinstance(G, nx.Graph):
+        neighbours = G.adj[node]._atlas
+        return [calc_node_attr(node, neighbours[adj_node_id][channel_id]) for adj_node_id in
+                neighbours for channel_id in neighbours[adj_node_id]]
+    channels, _, sides = G.adjacent(G.node_index[node])
+    return list(zip(G.time_lock_delta[channels, sides].tolist(), G.min_htlc[channels, sides].tolist(),
+                    G.fee_rate_milli_msat[channels, sides].tolist()))
+
+
 def infer_node_implementation(G, node):
     """
     infers nodes' implementation (by its defaults).
     """
-    neighbours = G.adj[node]._atlas
     # A list of tuples (cltv_delta, min_htlc, fee_proportional) values of the node for each of its channels.
-    channels_parameteres = [calc_node_attr(node, neighbours[adj_node_id][channel_id]) for adj_node_id in
-                          neighbours for channel_id in
-                          neighbours[adj_node_id]]
+    channels_parameteres = get_node_channels_parameters(G, node)
 
     # A list of implementation distribution for each of the nodes' channel.
     channels_impl_dist = [calc_implementation_distribution(channel_params) for channel_params in channels_parameteres]
@@ -84,6 +101,113 @@ def infer_node_implementation(G, node):
         return "unknown"
 
 
+# The defaults dicts of the parameters (cltv_delta, min_htlc, fee_proportional), in the order of their weights.
+PARAMS_DEFAULTS = [CLTV_DELTA_DEFAULTS, HTLC_MIN_DEFAULTS, FEE_DEFAULTS]
+
+
+def _calc_distribution_table():
+    # Returns the distribution calc_implementation_distribution returns for each combination of parameter
+    # indicators. The indicator of a parameter value is encoded as a bitmask of the items of its defaults dict
+    # containing it (see _encode_parameter), and the table is indexed by the three bitmasks.
+    items = [list(defaults.items()) for defaults in PARAMS_DEFAULTS]
+    table = np.zeros([2 ** len(param_items) for param_items in items] + [len(IMPLEMENTATIONS)])
+    for codes in np.ndindex(*table.shape[:-1]):
+        impl_vec = np.array([sum([np.array([0, 0, 0])] + [np.asarray(item[0]) for i, item in enumerate(param_items)
+                                                          if code >> i & 1])
+                             for param_items, code in zip(items, codes)])
+        table[codes] = _calc_distribution(impl_vec)
+    return table
+
+
+def _encode_parameter(defaults, values):
+    # Encodes each of the values of a parameter as the bitmask of the items of the defaults dict containing it.
+    codes = np.zeros(len(values), dtype=np.int64)
+    for i, default_values in enumerate(defaults.values()):
+        codes |= np.isin(values, default_values).astype(np.int64) << i
+    return codes
+
+
+def _sum_segments_in_order(values, indptr):
+    # Sums the rows of values over each segment values[indptr[i]:indptr[i + 1]], adding them one after the other in
+    # order (as sum does), so that the floating point results are the same. Each step adds the j'th row of all the
+    # segments longer than j.
+    degrees = np.diff(indptr)
+    order = np.argsort(-degrees, kind='stable')
+    starts, sorted_degrees = indptr[:-1][order], degrees[order]
+    sorted_sums = np.zeros((len(degrees),) + values.shape[1:])
+    for j in range(sorted_degrees[0] if len(degrees) else 0):
+        count = np.searchsorted(-sorted_degrees, -j)  # the number of segments longer than j
+        sorted_sums[:count] += values[starts[:count] + j]
+    sums = np.empty_like(sorted_sums)
+    sums[order] = sorted_sums
+    return sums
+
+
+def infer_implementations(indptr, cltv_deltas, min_htlcs, fee_rates):
+    """
+    Infers the implementation of many nodes at once, as infer_node_implementation does. The (cltv_delta, min_htlc,
+    fee_proportional) values of the i'th node in each of its channels are given by the slice indptr[i]:indptr[i + 1]
+    of the cltv_deltas, min_htlcs and fee_rates arrays. Returns the list of inferred implementations.
+    """
+    indptr = np.asarray(indptr, dtype=np.int64)
+    codes = [_encode_parameter(defaults, np.asarray(values))
+             for defaults, values in zip(PARAMS_DEFAULTS, [cltv_deltas, min_htlcs, fee_rates])]
+    channels_impl_dist = _calc_distribution_table()[tuple(codes)]
+    impl_dist = _sum_segments_in_order(channels_impl_dist, indptr)
+    total = impl_dist[:, 0]
+    for i in range(1, len(IMPLEMENTATIONS)):
+        total = total + impl_dist[:, i]
+    known = total != 0
+    impl_dist[known] = impl_dist[known] / total[known, np.newaxis]
+    return [IMPLEMENTATIONS[i] if is_known else "unknown" for i, is_known in zip(np.argmax(impl_dist, axis=1), known)]
+
+
+def encode_implementations(implementations):
+    """
+    Returns the codes of the given implementations, as array representations hold them: the index into IMPLEMENTATIONS,
+    or -1 for 'unknown' (or any other implementation).
+    """
+    return np.array([IMPLEMENTATIONS.index(implementation) if implementation in IMPLEMENTATIONS else -1
+                     for implementation in implementations], dtype=np.int8)
+
+
+def decode_implementations(codes):
+    """
+    Returns the implementations of the given codes (see encode_implementations), 'unknown' for -1.
+    """
+    implementations = list()
+    for code in np.asarray(codes).tolist():
+        if not -1 <= code < len(IMPLEMENTATIONS):
+            raise Exception('Error: Invalid implementation code ' + str(code))
+        implementations.append(IMPLEMENTATIONS[code] if code != -1 else "unknown")
+    return implementations
+
+
+def infer_nodes_implementation(G, nodes=None):
+    """
+    Returns a dict mapping each node of G (a networkx multigraph, a csr_graph.CSRGraph or a channel_table.ChannelTable)
+    to its inferred implementation, as infer_node_implementation does, inferring all of them at once. For a networkx
+    multigraph, only the given nodes may be inferred. For a channel table, the nodes are those announcing its policies
+    (in the order of their pub keys), and they are inferred from the policies of the table.
+    """
+    if isinstance(G, nx.Graph):
+        nodes = list(G.nodes if nodes is None else nodes)
+        channels_parameteres = [get_node_channels_parameters(G, node) for node in nodes]
+        indptr = np.concatenate(([0], np.cumsum([len(params) for params in channels_parameteres])))
+        columns = list(zip(*[params for node_params in channels_parameteres for params in node_params])) or [[]] * 3
+    elif hasattr(G, 'by_node'):  # A channel table
+        nodes, rows, indptr = G.by_node()
+        columns = [G.cltv[rows], G.min_htlc[rows], G.fee_rate[rows]]
+    else:
+        nodes = G.nodes
+        alive = G.alive[G.adj_channel]
+        channels, sides = G.adj_channel[alive], G.adj_side[alive]
+        indptr = np.concatenate(([0], np.cumsum(alive)))[G.indptr]
+        columns = [G.time_lock_delta[channels, sides], G.min_htlc[channels, sides],
+                   G.fee_rate_milli_msat[channels, sides]]
+    return dict(zip(nodes, infer_implementations(indptr, *columns)))
+
+
 
 
 
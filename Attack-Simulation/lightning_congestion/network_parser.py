@@ -1,8 +1,14 @@
 import json
+import zipfile
+import gzip
+import io
 from networkx_changes.node_link import node_link_graph
 import networkx as nx
-from lightning_implementation_inference import infer_node_implementation
+from lightning_implementation_inference import infer_node_implementation, infer_nodes_implementation, \
+    encode_implementations, decode_implementations
+from edge_betweenness import edge_betweenness, BETWEENNESS_SAMPLE_SIZE
 import copy
+import math
 import coloredlogs
 import logging
 import seaborn as sns
@@ -26,12 +32,30 @@ IMPLEMENTATIONS = ['LND', 'C-Lightning', 'Eclair']
 MAX_CONCURRENT_HTLCS_DEFAULTS = {"LND": 483, 'C-Lightning': 30, 'Eclair': 30}
 CLTV_DELTA_DEFAULTS = {'LND': 40, 'C-Lightning': 14, 'Eclair': 144}
 DEFAULT_DUST_LIMIT_SAT = {'LND': 573, 'C-Lightning': 546, 'Eclair': 546} # in sat
+# Snapshots are stored either as plain json files or compressed in zip (holding a single json file) or gzip archives.
+SNAPSHOT_EXTENSIONS = ('.json', '.json.zip', '.json.gz')
+
+
+def open_snapshot(snapshot_path):
+    """
+    Opens the snapshot file for reading as text, decompressing zip and gzip archives on the fly.
+    """
+    if snapshot_path.endswith('.zip'):
+        with zipfile.ZipFile(snapshot_path) as archive:
+            json_files = [name for name in archive.namelist() if name.endswith('.json')]
+            if len(json_files) != 1:
+                raise Exception('Error: Expected a single json file in the snapshot archive ' + snapshot_path)
+            # The member file remains readable after the archive object is closed.
+            return io.TextIOWrapper(archive.open(json_files[0]), encoding="utf8")
+    if snapshot_path.endswith('.gz'):
+        return gzip.open(snapshot_path, 'rt', encoding="utf8")
+    return open(snapshot_path, 'r', encoding="utf8")
 
 
 def load_json(snapshot_path):
     # Read json file created by LND describegraph command on the mainnet.
-    f = open(snapshot_path, 'r', encoding="utf8")
-    json_data = json.load(f)
+    with open_snapshot(snapshot_path) as f:
+        json_data = json.load(f)
 
     for channel in json_data['edges']:
         _cast_channel_data(channel)
@@ -51,12 +75,15 @@ def _cast_channel_data(channel):
         channel['node2_policy']['fee_rate_milli_msat'] = int(channel['node2_policy']['fee_rate_milli_msat'])
 
 
+def is_active_channel(channel):
+    # Channels having both peers exposing their policies, that are not disabled by any of them.
+    return bool(channel['node1_policy'] and channel['node2_policy']) and \
+        not (channel['node1_policy']['disabled'] or channel['node2_policy']['disabled'])
+
+
 def filter_snapshot_data(json_data):
-    # Filter to channels having both peers exposing their policies
-    json_data['edges'] = list(filter(lambda x: x['node1_policy'] and x['node2_policy'], json_data['edges']))
-    # Filter to non disabled channels
-    json_data['edges'] = list(filter(lambda x: not (x['node1_policy']['disabled'] or x['node2_policy']['disabled']),
-                                     json_data['edges']))
+    # Filter to non disabled channels having both peers exposing their policies
+    json_data['edges'] = list(filter(is_active_channel, json_data['edges']))
     return json_data
 
 
@@ -71,17 +98,24 @@ def _calc_edges_timelock(G):
 
 
 def _calc_edges_betweenness(G):
-    # For each edge calculates the betweenness.
-    edge_betweenness = dict.fromkeys(G.edges, 0)
-    edge_betweenness_by_pair_of_nodes = nx.edge_betweenness_centrality(G)
-    for key in edge_betweenness:
-        edge_betweenness[key] = edge_betweenness_by_pair_of_nodes[key[:2]]
-    ### G.edges[list(G.edges)[0]]['betweenness']
-    return edge_betweenness
+    # For each edge calculates the betweenness, in the betweenness mode of G (see load_graph). For the sampled mode,
+    # the root mean square over the edges of the standard errors of their values is kept as the
+    # 'betweenness_rms_error' of G. It is the typical error of an edge's value, not a bound on the error of any edge
+    # (the standard errors of single edges vary widely, and the errors themselves may exceed them).
+    mode, num_of_sources, processes = G.graph.get('betweenness_mode', ('exact', BETWEENNESS_SAMPLE_SIZE, None))
+    edges_betweenness = dict.fromkeys(G.edges, 0)
+    edge_betweenness_by_pair_of_nodes, errors = edge_betweenness(G, mode, num_of_sources, processes)
+    for key in edges_betweenness:
+        edges_betweenness[key] = edge_betweenness_by_pair_of_nodes[key[:2]]
+    G.graph['betweenness_rms_error'] = math.sqrt(sum(e ** 2 for e in errors.values()) / len(errors)) if errors else 0
+    if mode == 'sampled':
+        logger.info("Estimated the edge betweenness from " + str(num_of_sources) + " sources, with an RMS standard "
+                    "error of " + str(G.graph['betweenness_rms_error']))
+    return edges_betweenness
 
 
 def update_edges_betweenness(G):
-    nx.set_edge_attributes(G, _calc_edges_betweenness(G), ' betweenness')
+    nx.set_edge_attributes(G, _calc_edges_betweenness(G), 'betweenness')
 
 
 def _calc_node_capacity(G, node):
@@ -98,13 +132,14 @@ def _handle_unknown_impl_nodes(G):
     Almost always, the implementation inference manages to match an implementation to each node - meaning no node is
     tagged as 'unknown'. For the cases were the are such nodes, we first verify their negligence, meaning they make up
     less than 0.5% of the nodes, and that their sum of capacities are less than 0.05% of the networks'. Then we
-    remove them.
+    remove them (from G itself, as other attributes may be computed on G later on).
     """
     unknown_impl_nodes = list(filter(lambda x: x[1]['implementation'] == 'unknown', G.nodes(data=True)))
     if unknown_impl_nodes:
         assert len(unknown_impl_nodes) / G.number_of_nodes() < 0.005 and \
                 sum([node[1]['capacity'] for node in unknown_impl_nodes]) / G.graph['network_capacity'] < 0.0005
-        G = _remove_nodes(G, [node[0] for node in unknown_impl_nodes])
+        G.remove_nodes_from([node[0] for node in unknown_impl_nodes])
+        G.remove_nodes_from(list(nx.isolates(G)))
         G.graph['network_capacity'] = sum(list(map(lambda x: x[2]['capacity'], G.edges(data=True))))
         G.graph['network_channels_count'] = nx.number_of_edges(G)
         # Sets 'capacity' attribute for nodes
@@ -128,7 +163,87 @@ def _edges_max_dust_limit(G):
             for key in G.edges.keys()}
 
 
-def load_graph(json_data):
+def _set_nodes_capacity(G):
+    # Sets 'capacity' attribute for nodes
+    nx.set_node_attributes(G, {node: _calc_node_capacity(G, node) for node in G.nodes}, 'capacity')
+
+
+def _set_nodes_implementation(G):
+    # Sets 'implementation' attribute for nodes, and removes the nodes for which no implementation was inferred.
+    nx.set_node_attributes(G, infer_nodes_implementation(G), 'implementation')
+    _handle_unknown_impl_nodes(G)
+
+
+def _set_edges_betweenness(G):
+    # Sets 'betweenness' attribute to each edge
+    nx.set_edge_attributes(G, _calc_edges_betweenness(G), 'betweenness')
+
+
+def _set_edges_htlc(G):
+    # Sets 'htlc' attribute to each edge, initialized to the default max_concurrent_htlcs according to the
+    # inferred implementation. This attribute indicates the remaining quota of htlcs that the peer will accept.
+    nx.set_edge_attributes(G, _edges_max_concurrent_htlcs(G), 'htlc')
+
+
+def _set_edges_dust(G):
+    # Sets 'dust' attribute to each edge, initialized to the maximum default dust limit of the peers according to their
+    # inferred implementation. This attribute indicates the threshold on the payment size below which htlcs would not
+    # be added by nodes.
+    nx.set_edge_attributes(G, _edges_max_dust_limit(G), 'dust')
+
+
+# The attributes derived from the snapshot data: for each, the attributes it depends on and the function setting it.
+# The implementation inference may remove nodes from the graph, hence betweenness is computed after it.
+DERIVED_ATTRIBUTES = {'capacity': ([], _set_nodes_capacity),
+                      'implementation': (['capacity'], _set_nodes_implementation),
+                      'betweenness': (['implementation'], _set_edges_betweenness),
+                      'htlc': (['implementation'], _set_edges_htlc),
+                      'dust': (['implementation'], _set_edges_dust)}
+
+
+# The derived attributes set on nodes (the others are set on edges).
+NODE_DERIVED_ATTRIBUTES = ('capacity', 'implementation')
+
+
+def get_derived_attributes(G):
+    """
+    Returns the set of derived attributes computed for G. Graphs not built by load_graph (e.g. graphs pickled by
+    earlier versions, or built by hand) hold no record of these, hence an attribute is considered computed for them if
+    all their nodes (or edges) hold it.
+    """
+    if 'derived_attributes' in G.graph:
+        return G.graph['derived_attributes']
+    return frozenset(attribute for attribute in DERIVED_ATTRIBUTES
+                     if all(attribute in data for data in (G.nodes.values() if attribute in NODE_DERIVED_ATTRIBUTES
+                                                           else (edge[-1] for edge in G.edges(data=True)))))
+
+
+def require_graph_attributes(G, attributes):
+    """
+    Computes the given derived attributes (keys of DERIVED_ATTRIBUTES), along with the attributes they depend on, the
+    first time they are required for G. Attributes that were already computed for G (see get_derived_attributes) are
+    not computed again.
+    """
+    for attribute in attributes:
+        if attribute in get_derived_attributes(G):
+            continue
+        dependencies, set_attribute = DERIVED_ATTRIBUTES[attribute]
+        require_graph_attributes(G, dependencies)
+        set_attribute(G)
+        # A new set is assigned (rather than updated), since copies of G share the graph attributes dict values.
+        G.graph['derived_attributes'] = get_derived_attributes(G) | {attribute}
+    return G
+
+
+def load_graph(json_data, attributes=tuple(DERIVED_ATTRIBUTES), betweenness_mode='exact',
+               betweenness_sources=BETWEENNESS_SAMPLE_SIZE, processes=None):
+    """
+    Parses the snapshot data into a multigraph. Only the given derived attributes (all by default) are computed; any
+    other may be computed when needed, using require_graph_attributes.
+    The betweenness (whenever it is computed for G) is computed in the given betweenness_mode: 'exact', 'parallel'
+    (exact, on a pool of processes) or 'sampled' (estimated from betweenness_sources random sources, with the RMS of
+    the edges' standard errors kept as G.graph['betweenness_rms_error']), see edge_betweenness.edge_betweenness.
+    """
     # Remove channels that are disabled or that do not declare their policies.
     json_data = filter_snapshot_data(json_data)
     # Create an undirected multigraph using networkx
@@ -146,69 +261,74 @@ def load_graph(json_data):
     G.graph['network_channels_count'] = nx.number_of_edges(G)
     # Sets 'time_lock' attribute to each edge, which holds the sum of time_lock_delta values on both sides
     nx.set_edge_attributes(G, _calc_edges_timelock(G), 'time_lock')
-    # Sets 'capacity' attribute for nodes
-    nx.set_node_attributes(G, {node: _calc_node_capacity(G, node) for node in G.nodes}, 'capacity')
-    # Sets 'implementation' attribute for nodes
-    nx.set_node_attributes(G, {node: infer_node_implementation(G, node) for node in G.nodes}, 'implementation')
-    # Sets 'betweenness' attribute to each edge
-    nx.set_edge_attributes(G, _calc_edges_betweenness(G), 'betweenness')
-    G = _handle_unknown_impl_nodes(G)
-    # Sets 'htlc' attribute to each edge, initialized to the default max_concurrent_htlcs according to the
-    # inferred implementation. This attribute indicates the remaining quota of htlcs that the peer will accept.
-    nx.set_edge_attributes(G, _edges_max_concurrent_htlcs(G), 'htlc')
-    # Sets 'dust' attribute to each edge, initialized to the maximum default dust limit of the peers according to their
-    # inferred implementation. This attribute indicates the threshold on the payment size below which htlcs would not
-    # be added by nodes.
-    nx.set_edge_attributes(G, _edges_max_dust_limit(G), 'dust')
-    return G
+    # How the betweenness is computed for G
+    G.graph['betweenness_mode'] = (betweenness_mode, betweenness_sources, processes)
+    # The derived attributes computed so far
+    G.graph['derived_attributes'] = frozenset()
+    return require_graph_attributes(G, attributes)
 
 
 def remove_below_dust_capacity_channels(G):
     """
     Removes edges from G with capacity lower than the dust limit * max concurrent htlcs.
     """
+    require_graph_attributes(G, ['htlc', 'dust'])
     removed_capacity = 0
-    for edge in copy.deepcopy(G.edges(data=True)):
-        edge_data = edge[2]
-        if edge_data['capacity'] < edge_data['htlc'] * edge_data['dust']:
-            removed_capacity += edge_data['capacity']
-            G.remove_edge(edge_data['node1_pub'], edge_data['node2_pub'], key=edge_data['channel_id'])
+    edges_to_remove = [edge[2] for edge in G.edges(data=True) if edge[2]['capacity'] < edge[2]['htlc'] * edge[2]['dust']]
+    for edge_data in edges_to_remove:
+        removed_capacity += edge_data['capacity']
+        G.remove_edge(edge_data['node1_pub'], edge_data['node2_pub'], key=edge_data['channel_id'])
     logger.debug("Removing edges that cannot be attacked due to a capacity lower than the dust limit * max concurrent htlcs. "
                  "These constitute " + str(round(removed_capacity * 100 / G.graph['network_capacity'], 1))
                  + "% of the networks' capacity")
 
 
+def copy_graph(G):
+    """
+    Returns an independent mutable copy of G (or of a view of G). The copy holds its own structure and its own node,
+    edge and graph attribute dicts, so removing nodes or channels from it or setting attributes on it does not affect
+    G. The channels' policies, which are never modified, are shared. Nodes and adjacencies keep the order of G.
+    """
+    G_copy = nx.MultiGraph()
+    G_copy.graph.update(G.graph)
+    G_copy.add_nodes_from((node, data.copy()) for node, data in G.nodes(data=True))
+    # As in G, both directions of a pair of nodes share the same dict of channels.
+    channels_by_pair = dict()
+    for node, neighbours in G.adj.items():
+        for adj_node, channels in neighbours.items():
+            pair = frozenset((node, adj_node))
+            if pair not in channels_by_pair:
+                channels_by_pair[pair] = {channel_id: data.copy() for channel_id, data in channels.items()}
+            G_copy._adj[node][adj_node] = channels_by_pair[pair]
+    return G_copy
+
+
 def _remove_edges(G, edges):
     """
-    Removes the input edges from G and the remaining isolated nodes.
+    Returns a read-only view of G without the input edges and the remaining isolated nodes. The view shares G's
+    data, and changes to G are reflected in it (use copy_graph for a mutable independent subgraph).
     """
-    G_sub = copy.deepcopy(G)
-    for edge in edges:
-        if G_sub.has_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id']):
-            G_sub.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
-    G_sub.remove_nodes_from(list(nx.isolates(G_sub)))
-    return G_sub
+    removed_channels = {edge['channel_id'] for edge in edges}
+    remaining_nodes = {node for u, v, channel_id in G.edges(keys=True) if channel_id not in removed_channels
+                       for node in (u, v)}
+    return nx.subgraph_view(G, filter_node=remaining_nodes.__contains__,
+                            filter_edge=lambda u, v, channel_id: channel_id not in removed_channels)
 
 
 def _remove_nodes(G, nodes):
     """
-    Removes the input nodes from G, including their edges and remaining isolated nodes.
-    """
-    G_sub = copy.deepcopy(G)
-    for node in nodes:
-        neighbours = G.adj[node]._atlas
-        adjacent_edges = [neighbours[adj_node_id][channel_id] for adj_node_id in neighbours
-                          for channel_id in neighbours[adj_node_id]]
-        for edge in adjacent_edges:
-            if G_sub.has_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id']):
-                G_sub.remove_edge(edge['node1_pub'], edge['node2_pub'], key=edge['channel_id'])
-        G_sub.remove_node(node)
-    G_sub.remove_nodes_from(list(nx.isolates(G_sub)))
-    return G_sub
+    Returns a read-only view of G without the input nodes, their edges and the remaining isolated nodes. The view
+    shares G's data, and changes to G are reflected in it (use copy_graph for a mutable independent subgraph).
+    """
+    removed_nodes = set(nodes)
+    remaining_nodes = {node for u, v in G.edges() if u not in removed_nodes and v not in removed_nodes
+                       for node in (u, v)}
+    return nx.subgraph_view(G, filter_node=remaining_nodes.__contains__)
 
 
 def _get_subgraph_by_implementation(G, implementation):
     # Returns G reduced to nodes running the input implementation
+    require_graph_attributes(G, ['implementation'])
     nodes_to_remove = [i[0] for i in list(G.nodes(data=True)) if i[1]['implementation'] != implementation]
     G_sub = _remove_nodes(G, nodes_to_remove)
     logger.debug("Subgraph reduced to " + implementation + " nodes holds " +
@@ -218,13 +338,14 @@ def _get_subgraph_by_implementation(G, implementation):
 
 
 def get_LND_subgraph(G):
-    # Returns G reduced to LND nodes
+    # Returns G reduced to LND nodes, as a read-only view of G.
     return _get_subgraph_by_implementation(G, 'LND')
 
 
 def get_LND_complementary_subgraph(G):
     # Returns the complementary to the G reduced to LND nodes graph. This subgraph consists of all channels with at
-    # least one Eclair or C-Lightning node.
+    # least one Eclair or C-Lightning node. Returned as a read-only view of G.
+    require_graph_attributes(G, ['htlc'])
     edges_to_remove = [e[2] for e in G.edges(data=True) if e[2]['htlc'] != 30]
     G_sub = _remove_edges(G, edges_to_remove)
     logger.debug("The complementary to LND subgraph holds " +
@@ -0,0 +1,144 @@
+from network_parser import *
+from snapshot_stream import load_snapshot
+from channel_table import ChannelTable
+import lightning_implementation_inference
+import hashlib
+import pickle
+import os
+
+
+"""
+    This module keeps an on-disk cache of parsed snapshots. A snapshot is parsed (and annotated with the derived
+    attributes requested: capacity, implementation, betweenness, htlc and dust) only the first time it is loaded, and
+    the resulting graph is stored in a binary (pickle) file. Later loads of the same snapshot read this file, skipping
+    the JSON parsing and the computation of the attributes already cached. Attributes requested later on are computed
+    on the cached graph, which is then stored again, so that the costly betweenness is only computed (and cached) once
+    some analysis requires it. The channel table of a snapshot (see channel_table) is cached alike, in an npz file.
+    Cache entries are keyed by the hash of the snapshot file and of the defaults tables the annotation depends on, so
+    changing any of these creates a new entry. The least recently used entries are evicted when the total size of the
+    cache exceeds CACHE_MAX_SIZE.
+"""
+
+CACHE_DIR = 'snapshots/cache/'
+CACHE_MAX_SIZE = 4 * 1024 ** 3  # in bytes
+# Should be increased whenever the way graphs are built or annotated changes, invalidating the existing entries.
+CACHE_VERSION = 5
+
+
+def _hash_file(file_path):
+    # Returns the sha256 hex digest of the file contents.
+    file_hash = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+
+def _defaults_tables():
+    # The tables according to which the graph attributes are derived from the snapshot data.
+    return {'version': CACHE_VERSION,
+            'max_concurrent_htlcs': MAX_CONCURRENT_HTLCS_DEFAULTS,
+            'cltv_delta': CLTV_DELTA_DEFAULTS,
+            'dust_limit': DEFAULT_DUST_LIMIT_SAT,
+            'inference_cltv_delta': lightning_implementation_inference.CLTV_DELTA_DEFAULTS,
+            'inference_htlc_min': lightning_implementation_inference.HTLC_MIN_DEFAULTS,
+            'inference_fee': lightning_implementation_inference.FEE_DEFAULTS,
+            'inference_weights': lightning_implementation_inference.PARAM_WEIGHTS_DIST}
+
+
+def get_cache_key(snapshot_path):
+    """
+    Returns the key of the cache entry of the given snapshot: a hash of the snapshot contents and the defaults tables.
+    """
+    key = hashlib.sha256(_hash_file(snapshot_path).encode())
+    key.update(repr(sorted((name, repr(table)) for name, table in _defaults_tables().items())).encode())
+    return key.hexdigest()
+
+
+def get_cache_entry(snapshot_path, cache_dir=CACHE_DIR, suffix='.pickle'):
+    """
+    Returns the path of the cache entry of the given snapshot (the graph entry, or the channel table entry for the
+    '.channels.npz' suffix).
+    """
+    return os.path.join(cache_dir, get_cache_key(snapshot_path) + suffix)
+
+
+def _evict(cache_dir, max_cache_size):
+    # Removes the least recently used entries (by modification time, which is updated on each use) until the total
+    # size of the cache is at most max_cache_size.
+    # Entries may be evicted concurrently by other processes (see snapshot_ingestion), hence missing ones are skipped.
+    entries = list()
+    for f in os.listdir(cache_dir):
+        if f.endswith(('.pickle', '.npz')):
+            try:
+                entry_stat = os.stat(os.path.join(cache_dir, f))
+            except FileNotFoundError:
+                continue
+            entries.append((entry_stat.st_mtime, entry_stat.st_size, os.path.join(cache_dir, f)))
+    entries.sort()
+    cache_size = sum(entry_size for _, entry_size, _ in entries)
+    while entries and cache_size > max_cache_size:
+        _, entry_size, entry = entries.pop(0)
+        cache_size -= entry_size
+        try:
+            os.remove(entry)
+        except FileNotFoundError:
+            continue
+        logger.debug("Evicted snapshot cache entry " + entry)
+
+
+def _write_cache_entry(entry, G, cache_dir, max_cache_size):
+    # Stores the graph in the given entry, evicting old entries if the cache grows beyond max_cache_size.
+    # Write to a temporary file first, so that an interrupted write never leaves a corrupted entry.
+    tmp_entry = entry + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_entry, 'wb') as f:
+        pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_entry, entry)
+    _evict(cache_dir, max_cache_size)
+
+
+def load_cached_graph(snapshot_path, attributes=tuple(DERIVED_ATTRIBUTES), cache_dir=CACHE_DIR,
+                      max_cache_size=CACHE_MAX_SIZE):
+    """
+    Returns the graph of the given snapshot annotated with (at least) the given derived attributes (as
+    load_graph(load_snapshot(snapshot_path), attributes) does), reading it from the cache if possible and adding it to
+    the cache otherwise. Attributes missing from the cached graph are computed and the entry is updated with them. Any
+    other attribute may be computed when needed, using require_graph_attributes. Each call returns a new graph object,
+    which the caller may modify.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = get_cache_entry(snapshot_path, cache_dir)
+    if os.path.isfile(entry):
+        logger.debug("Loading snapshot " + snapshot_path + " from cache")
+        os.utime(entry)
+        with open(entry, 'rb') as f:
+            G = pickle.load(f)
+        if not set(attributes) <= get_derived_attributes(G):
+            _write_cache_entry(entry, require_graph_attributes(G, attributes), cache_dir, max_cache_size)
+        return G
+
+    G = load_graph(load_snapshot(snapshot_path), attributes)
+    _write_cache_entry(entry, G, cache_dir, max_cache_size)
+    return G
+
+
+def load_cached_channel_table(snapshot_path, cache_dir=CACHE_DIR, max_cache_size=CACHE_MAX_SIZE):
+    """
+    Returns the channel table of the given snapshot (as ChannelTable.from_snapshot(snapshot_path) does), reading it
+    from the cache if possible and adding it to the cache otherwise.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = get_cache_entry(snapshot_path, cache_dir, '.channels.npz')
+    if os.path.isfile(entry):
+        logger.debug("Loading the channel table of snapshot " + snapshot_path + " from cache")
+        os.utime(entry)
+        return ChannelTable.load(entry)
+
+    channel_table = ChannelTable.from_snapshot(snapshot_path)
+    # Write to a temporary file first, so that an interrupted write never leaves a corrupted entry.
+    tmp_entry = entry + '.' + str(os.getpid()) + '.tmp'
+    with open(tmp_entry, 'wb') as f:
+        channel_table.save(f)
+    os.replace(tmp_entry, entry)
+    _evict(cache_dir, max_cache_size)
+    return channel_table
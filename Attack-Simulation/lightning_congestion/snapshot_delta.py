@@ -0,0 +1,163 @@
+from network_parser import *
+from network_parser import _calc_node_capacity
+from snapshot_stream import POLICY_FIELDS
+
+
+"""
+    This module keeps an annotated graph (see network_parser.load_graph) of a snapshot up to date with a newer
+    snapshot, without building the graph of the newer snapshot from scratch. The two snapshots are compared by
+    channel_id and by the contents of the channels (peers, capacity and policies), and the channels added, removed and
+    updated are applied to the graph. The derived attributes are then recomputed for the affected nodes and channels
+    only: node capacities, implementations, and the htlc and dust attributes of their channels. The betweenness depends
+    on the whole graph, hence once the channels of the graph change it is dropped, to be recomputed when it is required
+    (see require_graph_attributes).
+    Nodes that were removed from the graph (having no inferred implementation) are added back, along with all their
+    channels, once any of their channels changes. Until then, the implementation of their peers is inferred without
+    their channels, hence it may differ from the one load_graph infers.
+"""
+
+
+class SnapshotDelta:
+    """
+    The differences between an older and a newer snapshot: the channels added (as in the newer snapshot), removed (as
+    in the older snapshot) and updated (as in the newer snapshot). Also holds the nodes of the newer snapshot by pub
+    key, and the channels of the newer snapshot by node, for the nodes that are added back to the graph.
+    """
+
+    def __init__(self, added, removed, updated, nodes, channels_by_node):
+        self.added = added
+        self.removed = removed
+        self.updated = updated
+        self.nodes = nodes
+        self.channels_by_node = channels_by_node
+
+    def __len__(self):
+        return len(self.added) + len(self.removed) + len(self.updated)
+
+
+def _channel_contents(channel):
+    # The fields of the channel from which its graph attributes are derived.
+    return (channel['capacity'], tuple(channel['node1_policy'][field] for field in POLICY_FIELDS),
+            tuple(channel['node2_policy'][field] for field in POLICY_FIELDS))
+
+
+def diff_snapshots(old_json_data, new_json_data):
+    """
+    Returns the SnapshotDelta between the data of two snapshots (as load_snapshot returns it), comparing the channels
+    load_graph keeps (see filter_snapshot_data). A channel whose peers changed is considered removed and added.
+    """
+    old_channels = {channel['channel_id']: channel for channel in filter(is_active_channel, old_json_data['edges'])}
+    new_channels = {channel['channel_id']: channel for channel in filter(is_active_channel, new_json_data['edges'])}
+    added, removed, updated = list(), list(), list()
+    for channel_id, channel in new_channels.items():
+        old_channel = old_channels.get(channel_id)
+        if old_channel is None:
+            added.append(channel)
+        elif (old_channel['node1_pub'], old_channel['node2_pub']) != (channel['node1_pub'], channel['node2_pub']):
+            removed.append(old_channel)
+            added.append(channel)
+        elif _channel_contents(old_channel) != _channel_contents(channel):
+            updated.append(channel)
+    removed.extend(channel for channel_id, channel in old_channels.items() if channel_id not in new_channels)
+    channels_by_node = dict()
+    for channel in new_channels.values():
+        channels_by_node.setdefault(channel['node1_pub'], list()).append(channel)
+        channels_by_node.setdefault(channel['node2_pub'], list()).append(channel)
+    return SnapshotDelta(added, removed, updated, {node['pub_key']: node for node in new_json_data['nodes']},
+                         channels_by_node)
+
+
+def apply_delta(G, delta):
+    """
+    Applies the SnapshotDelta to G, an annotated graph of the older snapshot, in place. Of the derived attributes
+    computed for G, the node capacity and implementation are recomputed for the peers of the changed channels, and the
+    htlc and dust for their channels; betweenness is dropped if channels were added or removed. Returns G.
+    """
+    derived_attributes = get_derived_attributes(G)
+    affected_nodes = set()
+    structure_changed = False
+
+    for channel in delta.removed:
+        u, v, channel_id = channel['node1_pub'], channel['node2_pub'], channel['channel_id']
+        if G.has_edge(u, v, channel_id):
+            G.graph['network_capacity'] -= G.edges[u, v, channel_id]['capacity']
+            G.remove_edge(u, v, channel_id)
+            affected_nodes.update((u, v))
+            structure_changed = True
+
+    # Channels to add or update. Nodes missing from G are added along with all of their channels in the newer snapshot
+    # (which may add further nodes).
+    channels_to_apply = delta.updated + delta.added
+    while channels_to_apply:
+        channel = channels_to_apply.pop()
+        u, v, channel_id = channel['node1_pub'], channel['node2_pub'], channel['channel_id']
+        affected_nodes.update((u, v))
+        # As load_graph sets the channel's attributes.
+        data = dict(channel, Attacker=False, time_lock=channel['node1_policy']['time_lock_delta'] +
+                    channel['node2_policy']['time_lock_delta'])
+        if G.has_edge(u, v, channel_id):
+            edge = G.edges[u, v, channel_id]
+            G.graph['network_capacity'] += data['capacity'] - edge['capacity']
+            betweenness = edge.get('betweenness')
+            edge.clear()
+            edge.update(data)
+            # An updated channel keeps its betweenness, since the policies do not affect shortest paths.
+            if betweenness is not None:
+                edge['betweenness'] = betweenness
+        else:
+            for node in (u, v):
+                if node not in G:
+                    G.add_node(node, **{key: value for key, value in delta.nodes.get(node, {}).items()
+                                        if key != 'pub_key'})
+                    channels_to_apply.extend(node_channel for node_channel in delta.channels_by_node.get(node, ())
+                                             if node_channel is not channel)
+            G.add_edge(u, v, key=channel_id, **data)
+            G.graph['network_capacity'] += data['capacity']
+            structure_changed = True
+
+    def remove_nodes(nodes):
+        # Removes the given nodes, and the nodes they leave isolated, as load_graph does.
+        nonlocal structure_changed
+        neighbours = {neighbour for node in nodes for neighbour in G.adj[node]} - set(nodes)
+        G.graph['network_capacity'] -= sum(channel['capacity'] for node in nodes for neighbour in G.adj[node]
+                                           if neighbour not in nodes or node < neighbour
+                                           for channel in G.adj[node][neighbour].values())
+        G.remove_nodes_from(nodes)
+        isolated_nodes = [node for node in neighbours if not G.degree(node)]
+        G.remove_nodes_from(isolated_nodes)
+        affected_nodes.difference_update(nodes)
+        affected_nodes.difference_update(isolated_nodes)
+        affected_nodes.update(node for node in neighbours if node in G)
+        structure_changed = structure_changed or bool(nodes)
+
+    remove_nodes([node for node in affected_nodes if node in G and not G.degree(node)])
+    affected_nodes.intersection_update(G.nodes)
+    if 'capacity' in derived_attributes:
+        for node in affected_nodes:
+            G.nodes[node]['capacity'] = _calc_node_capacity(G, node)
+    if 'implementation' in derived_attributes:
+        nx.set_node_attributes(G, infer_nodes_implementation(G, affected_nodes), 'implementation')
+        # Nodes with no inferred implementation are removed (as in _handle_unknown_impl_nodes). Their neighbours keep
+        # their implementation, but their capacity is recomputed.
+        remove_nodes([node for node in affected_nodes if G.nodes[node]['implementation'] == 'unknown'])
+        if 'capacity' in derived_attributes:
+            for node in affected_nodes:
+                G.nodes[node]['capacity'] = _calc_node_capacity(G, node)
+    G.graph['network_channels_count'] = G.number_of_edges()
+
+    # The channels of the affected nodes (including all the added and updated channels).
+    channels = {(u, v, channel_id) for node in affected_nodes for u, v, channel_id in G.edges(node, keys=True)}
+    if 'htlc' in derived_attributes:
+        nx.set_edge_attributes(G, {key: min(MAX_CONCURRENT_HTLCS_DEFAULTS[G.nodes[key[0]]['implementation']],
+                                            MAX_CONCURRENT_HTLCS_DEFAULTS[G.nodes[key[1]]['implementation']])
+                                   for key in channels}, 'htlc')
+    if 'dust' in derived_attributes:
+        nx.set_edge_attributes(G, {key: max(DEFAULT_DUST_LIMIT_SAT[G.nodes[key[0]]['implementation']],
+                                            DEFAULT_DUST_LIMIT_SAT[G.nodes[key[1]]['implementation']])
+                                   for key in channels}, 'dust')
+    if structure_changed and 'betweenness' in derived_attributes:
+        for _, _, data in G.edges(data=True):
+            data.pop('betweenness', None)
+        # A new set is assigned (rather than updated), since copies of G share the graph attributes dict values.
+        G.graph['derived_attributes'] = derived_attributes - {'betweenness'}
+    return G
@@ -0,0 +1,56 @@
+from snapshot_cache import *
+from os.path import isfile, join
+from os import listdir
+import multiprocessing
+import os
+
+
+"""
+    This module ingests the snapshots of a directory into the snapshot cache (see snapshot_cache) concurrently, on a
+    pool of processes. Each snapshot is decoded, filtered and annotated (with the derived attributes its analyses need
+    only) into a graph, and read into a channel table, once; the analyses of several snapshots then read these from
+    the cache. Snapshots already in the cache are only hashed.
+"""
+
+
+def list_snapshots(snapshots_dir):
+    """
+    Returns the paths of the snapshot files in the given directory (in the order of the directory listing).
+    """
+    return [snapshots_dir + f for f in listdir(snapshots_dir) if isfile(join(snapshots_dir, f)) and
+            f.endswith(SNAPSHOT_EXTENSIONS)]
+
+
+def _ingest_snapshot(task):
+    # Adds the graph (annotated with the given attributes, none for no graph) and the channel table of the snapshot to
+    # the cache, unless they are already there.
+    snapshot_path, attributes, cache_dir = task
+    if attributes and not os.path.isfile(get_cache_entry(snapshot_path, cache_dir)):
+        load_cached_graph(snapshot_path, attributes, cache_dir=cache_dir)
+    if not os.path.isfile(get_cache_entry(snapshot_path, cache_dir, '.channels.npz')):
+        load_cached_channel_table(snapshot_path, cache_dir)
+    return snapshot_path
+
+
+def ingest_snapshots(snapshot_paths, attributes=('capacity', 'implementation'), processes=None, cache_dir=CACHE_DIR):
+    """
+    Adds the graphs and channel tables of the given snapshots to the cache, processing the snapshots concurrently on a
+    pool of processes (as many as the cpu cores by default). The graphs are annotated with the given derived
+    attributes only (see load_cached_graph); if there are none, only the channel tables are added. Graphs already in
+    the cache are not loaded, hence attributes they lack are computed by the first load_cached_graph requesting them.
+    Yields the path of each snapshot as soon as it is ingested (in the order they complete), after which
+    load_cached_graph and load_cached_channel_table read it from the cache.
+    """
+    snapshot_paths = list(dict.fromkeys(snapshot_paths))
+    attributes = tuple(attributes or ())
+    tasks = [(snapshot_path, attributes, cache_dir) for snapshot_path in snapshot_paths]
+    processes = min(len(tasks), processes or os.cpu_count() or 1)
+    os.makedirs(cache_dir, exist_ok=True)
+    if processes <= 1:
+        for task in tasks:
+            yield _ingest_snapshot(task)
+        return
+    with multiprocessing.Pool(processes) as pool:
+        for snapshot_path in pool.imap_unordered(_ingest_snapshot, tasks):
+            logger.debug("Ingested snapshot " + snapshot_path)
+            yield snapshot_path
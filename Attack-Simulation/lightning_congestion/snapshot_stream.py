@@ -0,0 +1,146 @@
+from network_parser import *
+from network_parser import _cast_channel_data
+import json
+import sys
+import re
+
+
+"""
+    This module reads snapshots (generated by using LND's describegraph command, possibly compressed in zip or gzip
+    archives) incrementally. The nodes and edges arrays are decoded one record at a time, and each record is reduced to
+    the fields the analyses use, cast and filtered (as filter_snapshot_data does) as soon as it is read. Hence the raw
+    json document is never held in memory, only the retained data.
+"""
+
+# Number of characters read from the snapshot at once.
+READ_CHUNK_SIZE = 1024 * 1024
+# The fields retained for each node, channel and channel policy. Other fields (addresses, features, chan_point, etc.)
+# are dropped.
+NODE_FIELDS = ('pub_key', 'alias')
+EDGE_FIELDS = ('channel_id', 'node1_pub', 'node2_pub', 'capacity', 'node1_policy', 'node2_policy')
+POLICY_FIELDS = ('time_lock_delta', 'min_htlc', 'fee_base_msat', 'fee_rate_milli_msat', 'disabled')
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+
+
+class _JSONStream:
+    """
+    Decodes json values one by one from a text stream, holding in memory only the chunk being decoded.
+    """
+
+    def __init__(self, f, chunk_size=READ_CHUNK_SIZE):
+        self._f = f
+        self._chunk_size = chunk_size
+        self._decoder = json.JSONDecoder()
+        self._buffer = ''
+        self._pos = 0
+        self._eof = False
+
+    def _read_chunk(self):
+        # Appends the next chunk of the stream to the buffer (dropping its consumed part). Returns False at the end of
+        # the stream.
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            self._eof = True
+            return False
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+        return True
+
+    def peek(self):
+        # Skips whitespace and returns the next character without consuming it ('' at the end of the stream).
+        while True:
+            self._pos = WHITESPACE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._read_chunk():
+                return ''
+
+    def expect(self, characters):
+        # Consumes the next character, which must be one of the given characters, and returns it.
+        character = self.peek()
+        if not character or character not in characters:
+            raise Exception('Error: Malformed snapshot, expected one of "' + characters + '" but found "' +
+                            character + '"')
+        self._pos += 1
+        return character
+
+    def value(self):
+        # Decodes the next json value.
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+                # A value ending at the end of the buffer (e.g. a number) may continue in the next chunk.
+                if end < len(self._buffer) or self._eof:
+                    self._pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read_chunk()
+
+    def array_items(self):
+        # Yields the decoded items of the next json array.
+        self.expect('[')
+        if self.peek() == ']':
+            self._pos += 1
+            return
+        while True:
+            yield self.value()
+            if self.expect(',]') == ']':
+                return
+
+
+def iter_snapshot_records(snapshot_path):
+    """
+    Yields ('nodes', node) and ('edges', channel) tuples, for the records of the snapshot, in the order they are read.
+    Other top level values of the snapshot are skipped.
+    """
+    with open_snapshot(snapshot_path) as f:
+        stream = _JSONStream(f)
+        stream.expect('{')
+        if stream.peek() == '}':
+            return
+        while True:
+            key = stream.value()
+            stream.expect(':')
+            if key in ('nodes', 'edges') and stream.peek() == '[':
+                for record in stream.array_items():
+                    yield key, record
+            else:
+                stream.value()
+            if stream.expect(',}') == '}':
+                return
+
+
+def _reduce_node(node):
+    # Keeps the retained fields of the node. Pub keys are interned, to be shared with the channels referring to them.
+    node = {field: node[field] for field in NODE_FIELDS if field in node}
+    node['pub_key'] = sys.intern(node['pub_key'])
+    return node
+
+
+def _reduce_channel(channel):
+    # Keeps the retained fields of the channel and its policies, and casts them to their natural form.
+    channel = {field: channel[field] for field in EDGE_FIELDS}
+    channel['node1_pub'] = sys.intern(channel['node1_pub'])
+    channel['node2_pub'] = sys.intern(channel['node2_pub'])
+    channel['node1_policy'] = {field: channel['node1_policy'][field] for field in POLICY_FIELDS}
+    channel['node2_policy'] = {field: channel['node2_policy'][field] for field in POLICY_FIELDS}
+    _cast_channel_data(channel)
+    return channel
+
+
+def load_snapshot(snapshot_path):
+    """
+    Reads the snapshot incrementally and returns its data as filter_snapshot_data(load_json(snapshot_path)) does,
+    keeping only the NODE_FIELDS, EDGE_FIELDS and POLICY_FIELDS fields.
+    """
+    json_data = {'nodes': list(), 'edges': list()}
+    for key, record in iter_snapshot_records(snapshot_path):
+        if key == 'nodes':
+            json_data['nodes'].append(_reduce_node(record))
+        elif is_active_channel(record):
+            json_data['edges'].append(_reduce_channel(record))
+    return json_data
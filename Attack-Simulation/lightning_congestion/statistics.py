@@ -1,7 +1,7 @@
 from network_parser import *
+from snapshot_cache import load_cached_graph, load_cached_channel_table
+from channel_history import update_channel_history, DATE_FORMAT
 import matplotlib.pyplot as plt
-from os import listdir
-from os.path import isfile, join
 import networkx as nx
 from collections import Counter, deque
 import datetime
@@ -16,39 +16,12 @@ import time
 """
 
 
-def _get_policy_field(edge, field):
-    # Returns the input parameter (field) values as declared in the policies of the input channel (edge).
-    return [int(edge['node1_policy'][field]), int(edge['node2_policy'][field])]
-
-
-def _get_edge_time_lock_delta(edge):
-    return _get_policy_field(edge, 'time_lock_delta')
-
-
-def _get_min_htlc(edge):
-    return _get_policy_field(edge, 'min_htlc')
-
-
-def _get_fee_base_msat(edge):
-    return _get_policy_field(edge, 'fee_base_msat')
-
-
-def _get_fee_proportional_millionths(edge):
-    return _get_policy_field(edge, 'fee_rate_milli_msat')
-
-
-def _channel_exceeds_upper_bound(edge_deltas, upper_bound):
-    # Checks whether the channel has a peer with configured cltv_delta greater or equal that the given upper_bound.
-    if max(edge_deltas) >= upper_bound:
-        return True
-    return False
-
-
-def _channel_exceeds_lower_bound(edge_deltas, lower_bound):
-    # Checks whether the channel has a peer with configured cltv_delta smaller or equal that the given lower_bound.
-    if min(edge_deltas) <= lower_bound:
-        return True
-    return False
+def _percent_by_value(values):
+    # Returns (value, percent of the values) tuples for the distinct input values, sorted by decreasing percent. Ties
+    # are kept in the order the values first appear (as when sorting the items of a Counter of the values).
+    distinct_values, first_indices, counts = np.unique(values, return_index=True, return_counts=True)
+    order = np.lexsort((first_indices, -counts))
+    return list(zip(distinct_values[order].tolist(), (counts[order] * 100 / len(values)).tolist()))
 
 
 def _get_peer_cltv_delta(channel, node):
@@ -124,27 +97,29 @@ def plot_implementation_distribution_for_different_snapshots(snapshots_dir):
     """
     Plots the implementation distribution of nodes for different snapshots.
     """
-    snapshots_list = [f for f in listdir(snapshots_dir) if isfile(join(snapshots_dir, f)) and f.endswith('json')]
-    dates = list()
+    # The snapshots are read from the channel history of the directory, appending the snapshots not yet in it.
+    history = update_channel_history(snapshots_dir)
+    snapshot_dates = history.dates
+    dates = [datetime.datetime.strptime(date, DATE_FORMAT) for date in snapshot_dates]
     impl_dist_by_snapshot = dict()
 
-    for G_str in snapshots_list:
-        logger.debug("Processing graph " + G_str[3:13])
-        dates.append(datetime.datetime.strptime(G_str[3:13], '%Y.%m.%d'))
-        json_data = load_json(snapshots_dir + G_str)
-        G = load_graph(json_data)
-        nodes_implementation = nx.get_node_attributes(G, 'implementation')
-        count = Counter(nodes_implementation.values())
-        impl_labels, y_labels = zip(*count.items())
-        sum_ = sum(y_labels)
-        y_labels = [i * 100 / sum_ for i in y_labels]
-        impl_dist_by_snapshot[G_str[3:13]] = dict(zip(impl_labels, round_distribution(y_labels)))
+    for date in snapshot_dates:
+        logger.debug("Processing graph " + date)
+        # The implementations of the nodes, in the order they first appear in the graph (as in a Counter of them).
+        codes, first_indices, counts = np.unique(history.segment(date)['implementation'], return_index=True,
+                                                 return_counts=True)
+        order = np.argsort(first_indices)
+        impl_labels = decode_implementations(codes[order])
+        y_labels = [i * 100 / counts.sum() for i in counts[order].tolist()]
+        impl_dist_by_snapshot[date] = dict(zip(impl_labels, round_distribution(y_labels)))
+    # The implementations, in the order of the last snapshot's distribution.
+    impl_labels = list(impl_dist_by_snapshot[snapshot_dates[-1]])
 
     x_labels = [time.mktime(date.timetuple()) for date in dates]
     date_labels = [date.strftime("%d %b %y") for date in dates]
     fig, ax = plt.subplots(figsize=(7.5, 5), dpi=200)
     for imp in impl_labels:
-        y_labels = [impl_dist_by_snapshot[G_str[3:13]][imp] for G_str in snapshots_list]
+        y_labels = [impl_dist_by_snapshot[date][imp] for date in snapshot_dates]
         ax.plot(x_labels, y_labels, marker='o')
         for i in [0, 1, 5, 8, 12]:
             plt.text(x_labels[i], y_labels[i] + 1.5, round(y_labels[i]/100, 2), fontsize=9)
@@ -163,10 +138,9 @@ def plot_implementation_distribution_for_different_snapshots(snapshots_dir):
 def run_impl_infer_plots(snapshot_path, snapshots_dir):
     # produces plots related to the Lightning implementation inference process
 
-    # Read json file created by LND describegraph command on the mainnet.
-    json_data = load_json(snapshot_path)
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Read json file created by LND describegraph command on the mainnet, and parse it into a networkx MultiGraph obj
+    # (or read the parsed graph from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['implementation', 'htlc'])
 
     plot_implementation_distribution(G)
     plot_capacity_implementation_distribution(G)
@@ -177,25 +151,20 @@ def run_impl_infer_plots(snapshot_path, snapshots_dir):
 ######################## Amounts Transferred Parameters Plots ########################
 
 
-def plot_htlc_min(snapshot_path):
+def plot_htlc_min(channel_table):
     # Plots a pie chart presenting the distribution of htlc_minimum_msat parameter, which indicates the minimum amount
-    # in millisatoshi (msat) that the node will be willing to transfer.
-
-    json_data = load_json(snapshot_path)
-    # Remove channels that are disabled or that do not declare their policies.
-    json_data = filter_snapshot_data(json_data)
-
-    min_htlc_values = sum([_get_min_htlc(e) for e in json_data['edges']], [])
-    min_htlc_count = sorted(Counter(min_htlc_values).items(), key=lambda item: item[1], reverse=True)
-    min_htlc_percent = list(map(lambda x: (x[0], x[1] * 100 / sum(j for i, j in min_htlc_count)), min_htlc_count))
+    # in millisatoshi (msat) that the node will be willing to transfer, in the channels of the given ChannelTable that
+    # are not disabled.
+    min_htlc_values = channel_table.active().min_htlc
+    min_htlc_percent = _percent_by_value(min_htlc_values)
     data_to_plot = min_htlc_percent[:3]
     data_to_plot.append(('other', sum(j for i, j in min_htlc_percent[3:])))
     x_labels = [val[0] for val in data_to_plot]
     y_labels = round_distribution([val[1] for val in data_to_plot], 1)
 
-    max_ = max(min_htlc_values)
+    max_ = int(min_htlc_values.max())
     logger.debug("max value of htlc_min: " + str(max_) + " msat which are " + str(max_/ 1e11) + " BTC")
-    logger.info(str(round(len([i for i in min_htlc_values if i <= 1000]) / len(min_htlc_values)*100, 1)) +
+    logger.info(str(round(np.count_nonzero(min_htlc_values <= 1000) / len(min_htlc_values)*100, 1)) +
                 "% of the network with min htlc <= 1000")
 
     fig, ax = plt.subplots()
@@ -215,26 +184,20 @@ def plot_htlc_min(snapshot_path):
     plt.savefig("plots/htlc_min.svg")
 
 
-def plot_fee_base(snapshot_path):
+def plot_fee_base(channel_table):
     # Plots a pie chart presenting the distribution of fee_base_msat parameter, which indicates , the constant
-    # fee (in msat) the node will charge per transfer.
-
-    json_data = load_json(snapshot_path)
-    # Remove channels that are disabled or that do not declare their policies.
-    json_data = filter_snapshot_data(json_data)
-
-    fee_base_values = sum([_get_fee_base_msat(e) for e in json_data['edges']], [])
-    fee_base_count = sorted(Counter(fee_base_values).items(), key=lambda item: item[1], reverse=True)
-    fee_base_percent = list(map(lambda x: (x[0], x[1] * 100 / sum(j for i, j in fee_base_count)), fee_base_count))
+    # fee (in msat) the node will charge per transfer, in the channels of the given ChannelTable that are not disabled.
+    fee_base_values = channel_table.active().fee_base
+    fee_base_percent = _percent_by_value(fee_base_values)
     # pick the index where the percent gets lower than 1.1%
     bound_idx = min([i for i, n in enumerate(fee_base_percent) if n[1] < 1.3])
     data_to_plot = sorted(fee_base_percent[:bound_idx], reverse=True)
     data_to_plot.append(('other', sum(j for i, j in fee_base_percent[bound_idx:])))  # (with <1.3%)
     x_labels = [val[0] for val in data_to_plot]
     y_labels = round_distribution([val[1] for val in data_to_plot], 2)
-    max_ = max(fee_base_values)
+    max_ = int(fee_base_values.max())
     logger.debug("max value of fee_base: " + str(max_) + " msat which are " + str(max_/ 1e11) + " BTC")
-    logger.info(str(round(len([i for i in fee_base_values if i <= 1000]) / len(fee_base_values) * 100,
+    logger.info(str(round(np.count_nonzero(fee_base_values <= 1000) / len(fee_base_values) * 100,
                     1)) + "% of the network with fee base <= 1000")
 
     fig, ax = plt.subplots()
@@ -253,18 +216,12 @@ def plot_fee_base(snapshot_path):
     plt.savefig("plots/fee_base.svg")
 
 
-def plot_fee_proportional(snapshot_path):
+def plot_fee_proportional(channel_table):
     # Plots a pie chart presenting the distribution of fee_proportional_millionths parameter, which indicates the
-    # amount (in millionths of a satoshi) that nodes will charge per transferred satoshi.
-
-    json_data = load_json(snapshot_path)
-    # Remove channels that are disabled or that do not declare their policies.
-    json_data = filter_snapshot_data(json_data)
-
-    fee_proportional_values = sum([_get_fee_proportional_millionths(e) for e in json_data['edges']], [])
-    fee_proportional_count = sorted(Counter(fee_proportional_values).items(), key=lambda item: item[1], reverse=True)
-    fee_proportional_percent = list(map(lambda x: (x[0], x[1] * 100 / sum(j for i, j in fee_proportional_count)),
-                                        fee_proportional_count))
+    # amount (in millionths of a satoshi) that nodes will charge per transferred satoshi, in the channels of the given
+    # ChannelTable that are not disabled.
+    fee_proportional_values = channel_table.active().fee_rate
+    fee_proportional_percent = _percent_by_value(fee_proportional_values)
     # pick the index where the percent gets lower than 2.8%
     bound_idx = min([i for i, n in enumerate(fee_proportional_percent) if n[1] < 2])
     data_to_plot = sorted(fee_proportional_percent[:bound_idx], reverse=True)
@@ -276,11 +233,11 @@ def plot_fee_proportional(snapshot_path):
     x_labels = [val[0] for val in data_to_plot]
     y_labels = round_distribution([val[1] for val in data_to_plot], 2)
 
-    max_ = max(fee_proportional_values)
+    max_ = int(fee_proportional_values.max())
     logger.debug("max value of fee_proportional_millionths: " + str(max_) + " msat which are " + str(max_/ 1e11) + " BTC")
-    logger.info(str(round(len([i for i in fee_proportional_values if i <= 1]) / len(
+    logger.info(str(round(np.count_nonzero(fee_proportional_values <= 1) / len(
         fee_proportional_values) * 100, 1)) + "% of the network with fee proportional millionths <= 1")
-    logger.info(str(round(len([i for i in fee_proportional_values if i <= 1000]) / len(fee_proportional_values) * 100,
+    logger.info(str(round(np.count_nonzero(fee_proportional_values <= 1000) / len(fee_proportional_values) * 100,
                     1)) + "% of the network with fee proportional millionths <= 1000")
 
     fig, ax = plt.subplots()
@@ -302,9 +259,11 @@ def plot_fee_proportional(snapshot_path):
 def run_amounts_transferred_plots(snapshot_path):
     # produces plots related to the amounts transferred through the network (bounds and fees)
 
-    plot_htlc_min(snapshot_path)
-    plot_fee_base(snapshot_path)
-    plot_fee_proportional(snapshot_path)
+    # Read the channels of the snapshot (once, for all plots).
+    channel_table = load_cached_channel_table(snapshot_path)
+    plot_htlc_min(channel_table)
+    plot_fee_base(channel_table)
+    plot_fee_proportional(channel_table)
 
 
 
@@ -312,25 +271,22 @@ def run_amounts_transferred_plots(snapshot_path):
 ######################## Timelock Plots ########################
 
 
-def plot_cltv_delta(snapshot_path):
+def plot_cltv_delta(channel_table):
     # Plots a pie chart presenting the distribution of cltv_expiry_delta parameter, which indicates the
-    # minimum difference in htlc timeouts the forwarding node will accept.
-
-    json_data = load_json(snapshot_path)
-    # Remove channels that are disabled or that do not declare their policies.
-    json_data = filter_snapshot_data(json_data)
-
-    cltv_deltas_per_edge = [_get_edge_time_lock_delta(e) for e in json_data['edges']]
-    percent_of_mixed_channels = round([_channel_exceeds_lower_bound(edge_deltas, 40)
-                                       and _channel_exceeds_upper_bound(edge_deltas, 144) for
-        edge_deltas in cltv_deltas_per_edge].count(True) / (len(cltv_deltas_per_edge)) * 100, 1)
+    # minimum difference in htlc timeouts the forwarding node will accept, in the channels of the given ChannelTable
+    # that are not disabled.
+    channel_table = channel_table.active()
+
+    # Channels having a peer with cltv_delta <= 40 and a peer with cltv_delta >= 144.
+    cltv_deltas_per_edge = channel_table.by_channel('cltv')
+    percent_of_mixed_channels = round(np.count_nonzero((cltv_deltas_per_edge.min(axis=1) <= 40) &
+                                                       (cltv_deltas_per_edge.max(axis=1) >= 144)) /
+                                      (len(cltv_deltas_per_edge)) * 100, 1)
     logger.debug(
         "percent of channels with one peer configured cltv_delta <= 40 and the other configured cltv_delta >= 144: "
         + str(percent_of_mixed_channels) + "%")
 
-    cltv_delta_values = sum(cltv_deltas_per_edge, [])
-    cltv_delta_count = sorted(Counter(cltv_delta_values).items(), key=lambda item: item[1], reverse=True)
-    cltv_delta_percent = list(map(lambda x: (x[0], x[1] * 100 / sum(j for i, j in cltv_delta_count)), cltv_delta_count))
+    cltv_delta_percent = _percent_by_value(channel_table.cltv)
     logger.info("The cltv delta default values (" + ', '.join(map(str, CLTV_DELTA_DEFAULTS.values())) +
                 ") from the different major implementations constitute " +
                 str(round(sum([dict(cltv_delta_percent)[cltv_delta]
@@ -365,11 +321,8 @@ def plot_node_cltv_delta(snapshot_path):
     # Plots a pie chart presenting the timelock delta distribution by nodes (rather than by channel peers),
     # which we do by looking at the most common value of cltv_expiry_delta used by each node.
 
-    json_data = load_json(snapshot_path)
-    # Remove node_cltv_deltas that are disabled or that do not declare their policies.
-    json_data = filter_snapshot_data(json_data)
-    # Parse data into a networkx MultiGraph obj.
-    G = load_graph(json_data)
+    # Parse the snapshot into a networkx MultiGraph obj (or read it from the snapshot cache).
+    G = load_cached_graph(snapshot_path, ['capacity', 'implementation'])
     # nodes sorted by decreasing capacity
     nodes = sorted(G.nodes(data=True), key=lambda x: x[1]['capacity'], reverse=True)
     nodes_cltv_deltas = list()
@@ -409,21 +362,16 @@ def plot_cltv_delta_for_different_snapshots(snapshots_dir):
     """
     Plots the cltv_expiry_delta distribution of nodes for different snapshots.
     """
-    snapshots_list = [f for f in listdir(snapshots_dir) if isfile(join(snapshots_dir, f)) and f.endswith('json')]
-    dates = list()
+    # The snapshots are read from the channel history of the directory, appending the snapshots not yet in it.
+    history = update_channel_history(snapshots_dir)
+    snapshot_dates = history.dates
+    dates = [datetime.datetime.strptime(date, DATE_FORMAT) for date in snapshot_dates]
     cltvd_dist_by_snapshot = dict()
 
-    for G_str in snapshots_list:
-        logger.debug("Processing graph " + G_str[3:13])
-        dates.append(datetime.datetime.strptime(G_str[3:13], '%Y.%m.%d'))
-        json_data = load_json(snapshots_dir + G_str)
-        # Remove nodes that are disabled or that do not declare their policies.
-        json_data = filter_snapshot_data(json_data)
-        cltv_delta_values = sum([_get_edge_time_lock_delta(e) for e in json_data['edges']], [])
-        cltv_delta_count = sorted(Counter(cltv_delta_values).items(), key=lambda item: item[1], reverse=True)
-        cltv_delta_percent = list(map(lambda x: (x[0], x[1] * 100 / sum(j for i, j in cltv_delta_count)),
-                                      cltv_delta_count))
-        cltvd_dist_by_snapshot[G_str[3:13]] = cltv_delta_percent
+    for date in snapshot_dates:
+        logger.debug("Processing graph " + date)
+        # Read the channels that are not disabled and that declare their policies.
+        cltvd_dist_by_snapshot[date] = _percent_by_value(history.values('cltv', date))
 
     x_labels = [time.mktime(date.timetuple()) for date in dates]
     date_labels = [date.strftime("%d %b %y") for date in dates]
@@ -438,17 +386,17 @@ def plot_cltv_delta_for_different_snapshots(snapshots_dir):
     markers = ['d', '>', 's', 'H', 'o', '*']
     for cltv_delta in cltv_delta_labels:
         cltv_delta_by_snapshot = list()
-        for G_str in snapshots_list:
-            G_str_dict = dict(cltvd_dist_by_snapshot[G_str[3:13]])
+        for date in snapshot_dates:
+            G_str_dict = dict(cltvd_dist_by_snapshot[date])
             if cltv_delta == 'other':
                 cltv_delta_by_snapshot.append(
-                    (G_str[3:13], round(sum(value for key, value in G_str_dict.items()
-                                            if key not in cltv_delta_labels), 1)))
+                    (date, round(sum(value for key, value in G_str_dict.items()
+                                     if key not in cltv_delta_labels), 1)))
             else:
                 if cltv_delta in G_str_dict:
-                    cltv_delta_by_snapshot.append((G_str[3:13], round(G_str_dict[cltv_delta], 1)))
+                    cltv_delta_by_snapshot.append((date, round(G_str_dict[cltv_delta], 1)))
                 else:
-                    cltv_delta_by_snapshot.append((G_str[3:13], 0))
+                    cltv_delta_by_snapshot.append((date, 0))
         y_labels = [val[1] for val in cltv_delta_by_snapshot]
         ax.plot(x_labels, y_labels, marker=markers[i], label=cltv_delta)
         i += 1
@@ -468,7 +416,7 @@ def plot_cltv_delta_for_different_snapshots(snapshots_dir):
 def run_timelock_plots(snapshot_path, snapshots_dir):
     # produces plots related to the timelocks configured by peers in the network.
 
-    plot_cltv_delta(snapshot_path)
+    plot_cltv_delta(load_cached_channel_table(snapshot_path))
     plot_node_cltv_delta(snapshot_path)
     plot_cltv_delta_for_different_snapshots(snapshots_dir)
 